@@ -1,7 +1,36 @@
 import os
 import sys
+import time
+import heapq
+import itertools
+import bisect
+import random
 import argparse
+import collections
+import contextlib
+import json
+import sqlite3
+import threading
+from array import array
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
 from wcwidth import wcswidth
+from _render import (
+    RENDERERS,
+    Z_95,
+    TextRenderer,
+    human_readable_size,
+    iter_entries,
+    render,
+)
+from _snapshot import print_diff, write_snapshot
+from _ignore import IgnoreRules
+from _watch import PollingWatcher, make_watcher
+from _daemon import default_address, run_client
 
 """
 github의 오픈소스 참고.
@@ -9,146 +38,1616 @@ https://github.com/kddnewton/tree
 https://github.com/kddnewton/tree/blob/main/tree.py
 """
 
-DIRS_ONLY = False
-LEVEL = -1
-MAX_FILES = 4
-PRINT_FILES_FIRST = False
 
+def entry_size(entry, allocated=False):
+    """
+    DirEntry의 파일 크기. stat 결과는 DirEntry에 캐시되므로 항목당 한 번만 호출된다.
 
-def human_readable_size(size):
-    for unit in ["B", "KB", "MB", "GB", "TB"]:
-        if size < 1024:
-            return f"{size:.0f}{unit}"
-        size /= 1024
+    du처럼 심볼릭 링크는 따라가지 않고 링크 자체의 크기를 센다.
+    allocated면 st_size 대신 실제로 할당된 크기(st_blocks * 512)로, sparse 파일은 작게,
+    작은 파일은 블록 크기만큼 크게 나온다. st_blocks가 없는 Windows에서는 st_size.
+    """
+    try:
+        st = entry.stat(follow_symlinks=False)
+    except OSError:  # 읽는 사이에 지워진 파일
+        return 0
+    if allocated:
+        blocks = getattr(st, "st_blocks", None)
+        if blocks is not None:
+            return blocks * 512
+    return st.st_size
 
 
-def get_directory_size(directory):
-    total_size = 0
-    for dirpath, dirnames, filenames in os.walk(directory):
-        for f in filenames:
-            fp = os.path.join(dirpath, f)
-            total_size += os.path.getsize(fp)
-    return total_size
+def entry_is_dir(entry):
+    """
+    디렉토리이거나 디렉토리를 가리키는 심볼릭 링크인지. 서로를 가리키는 링크(ELOOP)처럼
+    따라갈 수 없는 링크는 파일로 본다.
+    """
+    try:
+        return entry.is_dir()
+    except OSError:
+        return False
 
 
-class Tree:
+def entry_mtime(entry):
+    try:
+        return entry.stat(follow_symlinks=False).st_mtime
+    except OSError:
+        return None
+
+
+class InodeSet:
+    """
+    하드 링크된 파일(st_nlink > 1)의 (st_dev, st_ino) 집합. 같은 파일을 가리키는 링크가
+    여럿이어도 크기는 처음 만난 하나만 센다 (du와 같음). 링크가 하나뿐인 파일은 담지 않으므로
+    메모리는 하드 링크의 수에만 비례한다.
+
+    DirEntry에 캐시된 stat 결과를 쓰므로 시스템 콜이 더 들지 않는다.
+    """
+
     def __init__(self):
-        self.dirCount = 0
-        self.fileCount = 0
+        self.seen = set()
+
+    @staticmethod
+    def key(entry):
+        """
+        하드 링크된 파일이면 (st_dev, st_ino), 아니면 None.
+        """
+        try:
+            st = entry.stat(follow_symlinks=False)
+        except OSError:
+            return None
+        # Windows의 DirEntry.stat()은 st_nlink가 0이므로 여기서 걸러진다
+        if st.st_nlink < 2:
+            return None
+        return st.st_dev, st.st_ino
+
+    def add(self, entry):
+        """
+        처음 보는 파일이면 True, 다른 링크로 이미 센 파일이면 False.
+        """
+        key = self.key(entry)
+        return key is None or self.add_key(key)
+
+    def add_key(self, key):
+        if key in self.seen:
+            return False
+        self.seen.add(key)
+        return True
+
+
+class DeferredLinks:
+    """
+    scan_parallel의 작업 스레드에서 InodeSet 대신 list_directory에 넘긴다. 하드 링크된 파일은
+    세지 않고 (키, 이름, 크기)를 links에 모아 두었다가, 메인 스레드가 한 스레드로 스캔할 때의
+    순서대로 InodeSet에 넣는다. 그래야 같은 파일의 링크 중 어느 디렉토리의 것을 셀지가 스레드가
+    끝나는 순서와 상관없이 정해진다.
+    """
+
+    __slots__ = ("links", "allocated")
+
+    def __init__(self, links, allocated=False):
+        self.links = links
+        self.allocated = allocated
+
+    def add(self, entry):
+        key = InodeSet.key(entry)
+        if key is None:
+            return True
+        self.links.append((key, entry.name, entry_size(entry, self.allocated)))
+        return False
+
+
+def is_visible_file(filename):
+    """
+    숨김파일은 크기에는 더하지만 목록과 파일 수에서는 뺀다. 아예 빼려면 제외 규칙을 쓴다.
+    """
+    return filename[0] != "."
+
+
+# 규칙 파일을 찾으려고 모아 두는 scandir 항목 수의 상한 (find_rule_files 참고)
+RULE_FILE_LOOKAHEAD = 1000
+
+
+def find_rule_files(rules, directory, it):
+    """
+    scandir 이터레이터 it의 항목에서 directory의 규칙 파일(rules.ignore_files)을 찾는다.
+    (찾은 이름의 튜플, it의 항목을 처음부터 다시 내 주는 이터레이터)를 돌려준다.
+
+    규칙 파일은 같은 디렉토리의 항목에도 적용되므로 항목을 거르기 전에 찾아야 한다. 디렉토리마다
+    없는 파일을 열어 보는 대신(실패하는 시스템 콜, NFS에서는 왕복 한 번) 어차피 읽는 scandir
+    결과에서 이름을 찾는다. 모아 두는 항목은 RULE_FILE_LOOKAHEAD개까지이고, 그보다 큰
+    디렉토리에서만 규칙 파일마다 stat한다.
+    """
+    if rules is None or not rules.ignore_files:
+        return (), it
+
+    ignore_files = rules.ignore_files
+    entries = list(itertools.islice(it, RULE_FILE_LOOKAHEAD))
+    if len(entries) < RULE_FILE_LOOKAHEAD:
+        names = tuple(
+            entry.name
+            for entry in entries
+            if entry.name in ignore_files and not entry_is_dir(entry)
+        )
+        return names, iter(entries)
+
+    names = tuple(
+        name for name in ignore_files if os.path.isfile(os.path.join(directory, name))
+    )
+    return names, itertools.chain(entries, it)
+
+
+def exclusion_matcher(rules, directory):
+    """
+    directory의 항목 이름을 받아 제외 대상인지 판정하는 함수. 규칙이 없으면 None.
+    """
+    if rules is None or rules.regex is None:
+        return None
+
+    prefix = rules.relative(directory)
+    match = rules.match
+    return lambda name, is_dir=False: match(prefix + name, is_dir)
+
+
+def on_other_device(entry, device):
+    """
+    하위 디렉토리 entry가 다른 파일시스템의 마운트 지점인지. 디렉토리마다 lstat이 한 번 든다.
+    """
+    try:
+        return entry.stat(follow_symlinks=False).st_dev != device
+    except OSError:
+        return True
+
+
+def stat_directory(listing, directory, with_mtime, allocated):
+    """
+    디렉토리 자체의 mtime과, allocated면 디렉토리가 차지하는 블록을 listing에 채운다.
+    """
+    if not (with_mtime or allocated):
+        return
+
+    st = os.stat(directory)
+    if with_mtime:
+        listing.mtime = st.st_mtime
+    if allocated and hasattr(st, "st_blocks"):
+        listing.size += st.st_blocks * 512
+
+
+class ScanOptions:
+    """
+    스캔과 출력 옵션. 스캔마다 따로 만들어 넘기므로 한 프로세스에서 여러 스캔을 동시에 돌릴 수 있다.
+
+    with_mtime은 디렉토리의 mtime도 읽을지 여부. 디렉토리마다 stat이 한 번 더 필요하다.
+    sample_size가 0보다 크면 디렉토리마다 파일을 그만큼만 표본으로 stat해서 크기를 추정하고,
+    표본을 stat하는 시간은 디렉토리마다 time_budget초로 제한한다 (estimate_directory 참고).
+    with_histogram이면 디렉토리마다 확장자별, 크기 구간별 Histogram을 집계한다.
+    processes가 1보다 크면 최상위 하위 디렉토리들을 그만큼의 프로세스에 나눠서 스캔한다.
+    excludes는 --exclude 패턴, default_excludes는 기본 제외 목록과 .treeviewignore를 쓸지,
+    gitignore는 .gitignore도 읽을지 여부 (_ignore.IgnoreRules.load 참고).
+    one_file_system이면 다른 파일시스템이 마운트된 디렉토리로 내려가지 않는다.
+    allocated면 파일 크기 대신 할당된 크기(st_blocks)를 디렉토리 자체의 것까지 더한다.
+    count_links면 하드 링크를 링크마다 센다. 기본은 한 번만 세며, 표본만 stat하는 --estimate는
+    예외다. processes가 1보다 크거나 인덱스(ScanIndex)를 쓰려면 count_links여야 한다
+    (scan_processes, Scanner 참고).
+    """
+
+    __slots__ = (
+        "dirs_only",
+        "level",
+        "max_files",
+        "files_first",
+        "jobs",
+        "with_mtime",
+        "sample_size",
+        "time_budget",
+        "with_histogram",
+        "processes",
+        "excludes",
+        "default_excludes",
+        "gitignore",
+        "one_file_system",
+        "allocated",
+        "count_links",
+    )
+
+    def __init__(
+        self,
+        dirs_only=False,
+        level=-1,
+        max_files=4,
+        files_first=False,
+        jobs=1,
+        with_mtime=False,
+        sample_size=0,
+        time_budget=1.0,
+        with_histogram=False,
+        processes=1,
+        excludes=(),
+        default_excludes=True,
+        gitignore=False,
+        one_file_system=False,
+        allocated=False,
+        count_links=False,
+    ):
+        self.dirs_only = dirs_only
+        self.level = level
+        self.max_files = max_files
+        self.files_first = files_first
+        self.jobs = jobs
+        self.with_mtime = with_mtime
+        self.sample_size = sample_size
+        self.time_budget = time_budget
+        self.with_histogram = with_histogram
+        self.processes = processes
+        self.excludes = tuple(excludes)
+        self.default_excludes = default_excludes
+        self.gitignore = gitignore
+        self.one_file_system = one_file_system
+        self.allocated = allocated
+        self.count_links = count_links
+
+
+class Histogram:
+    """
+    확장자별 (파일 수, 크기 합)과 크기 구간별 (파일 수, 크기 합).
+
+    list_directory가 이미 stat한 크기로 채우고, 하위 디렉토리의 것은 크기처럼 부모에 더한다.
+    확장자는 소문자로 바꾸며, 확장자가 없는 파일은 ""로 모은다.
+    """
+
+    __slots__ = ("extensions", "bucket_counts", "bucket_bytes")
+
+    # 크기 구간의 경계. 0B, 1KB 미만, 그 다음부터는 16배씩
+    BOUNDS = [1, 1024, 16 * 1024, 256 * 1024, 4 * 1024**2, 64 * 1024**2, 1024**3]
+    LABELS = ["0B", "<1KB", "<16KB", "<256KB", "<4MB", "<64MB", "<1GB", ">=1GB"]
+
+    def __init__(self):
+        self.extensions = {}  # 확장자 -> [파일 수, 크기 합]
+        self.bucket_counts = [0] * len(self.LABELS)
+        self.bucket_bytes = [0] * len(self.LABELS)
 
-    def register(self, absolute):
-        if os.path.isdir(absolute):
-            self.dirCount += 1
+    def add(self, name, size):
+        extension = os.path.splitext(name)[1].lower()
+        totals = self.extensions.get(extension)
+        if totals is None:
+            self.extensions[extension] = [1, size]
         else:
-            self.fileCount += 1
+            totals[0] += 1
+            totals[1] += size
 
-    def summary(self):
-        return str(self.dirCount) + " directories, " + str(self.fileCount) + " files"
+        bucket = bisect.bisect_right(self.BOUNDS, size)
+        self.bucket_counts[bucket] += 1
+        self.bucket_bytes[bucket] += size
+
+    def merge(self, other):
+        for extension, (count, size) in other.extensions.items():
+            totals = self.extensions.get(extension)
+            if totals is None:
+                self.extensions[extension] = [count, size]
+            else:
+                totals[0] += count
+                totals[1] += size
 
-    # def print_root(self, args.directory):
+        for bucket in range(len(self.LABELS)):
+            self.bucket_counts[bucket] += other.bucket_counts[bucket]
+            self.bucket_bytes[bucket] += other.bucket_bytes[bucket]
 
-    def walk(self, directory, prefix="", depth=0, is_root=True):  # , num_files=0):
-        if LEVEL > -1 and depth > LEVEL:
-            return
+    def to_dict(self):
+        return {
+            "extensions": {
+                extension: {"count": count, "bytes": size}
+                for extension, (count, size) in sorted(self.extensions.items())
+            },
+            "sizes": [
+                {"bucket": label, "count": count, "bytes": size}
+                for label, count, size in zip(
+                    self.LABELS, self.bucket_counts, self.bucket_bytes
+                )
+            ],
+        }
+
+    def report(self, out=sys.stdout, limit=20):
+        lines = ["", "확장자별"]
+        ranked = sorted(
+            self.extensions.items(), key=lambda item: (-item[1][1], item[0])
+        )
+        for extension, (count, size) in ranked[:limit]:
+            label = extension or "(없음)"
+            # 한글은 두 칸을 차지하므로 wcswidth로 폭을 맞춘다
+            label += " " * (12 - wcswidth(label))
+            lines.append(f"  {label} {count:>12,}개 {human_readable_size(size):>7}")
+        if len(ranked) > limit:
+            lines.append(f"  그 외 {len(ranked) - limit:,}개 확장자")
+
+        lines += ["", "크기별"]
+        for label, count, size in zip(self.LABELS, self.bucket_counts, self.bucket_bytes):
+            lines.append(
+                f"  {label:<12} {count:>12,}개 {human_readable_size(size):>7}"
+            )
+
+        print("\n".join(lines), file=out)
+
+
+class DirNode:
+    """
+    디렉토리 하나의 집계 결과.
+
+    size는 하위 전체 파일 크기의 합,
+    num_files는 직속 파일 중 출력 대상(숨김파일 제외)의 개수.
+    size_var는 크기를 추정한 경우 그 분산의 합으로, 정확한 값이면 0.
+    histogram은 with_histogram일 때 하위 전체 파일의 Histogram.
+    rules는 이 디렉토리에 적용할 IgnoreRules로, 상위 디렉토리의 규칙 파일까지 반영된 것이다.
+    linked는 디렉토리 심볼릭 링크를 거쳐 온 디렉토리면 여기까지 따라온 링크 대상의 실제 경로
+    튜플, 아니면 빈 튜플. 링크 순환을 막는 데 쓴다 (Scanner.follow_link).
+    """
+
+    __slots__ = (
+        "name",
+        "path",
+        "depth",
+        "displayed",
+        "linked",
+        "mtime",
+        "size",
+        "size_var",
+        "num_files",
+        "dirs",
+        "files",
+        "histogram",
+        "rules",
+    )
+
+    def __init__(self, name, path, depth=0, displayed=True, linked=(), rules=None):
+        self.name = name
+        self.path = path
+        self.depth = depth
+        self.displayed = displayed  # False면 크기만 집계하고 출력하지 않는 디렉토리
+        self.linked = linked  # 디렉토리 심볼릭 링크를 거쳐 온 디렉토리. 상위 크기에 더하지 않는다
+        self.mtime = None
+        self.size = 0
+        self.size_var = 0.0
+        self.num_files = 0
+        self.dirs = []  # 출력할 하위 디렉토리 DirNode, 이름순
+        self.files = []  # 출력할 파일 (name, size, mtime), 이름순
+        self.histogram = None
+        self.rules = rules
+
+
+class Listing:
+    """
+    디렉토리 하나를 읽은 결과. level 같은 출력 옵션과 무관하다. 제외 규칙에 걸린 항목은 없다.
+
+    size는 직속 파일 크기의 합, files는 출력 대상 파일 (name, size, mtime) 목록,
+    subdirs는 하위 디렉토리 (name, is_symlink) 목록. 모두 이름순.
+    mtime은 디렉토리 자체의 수정 시각으로, with_mtime일 때만 채워진다.
+    size_var는 estimate_directory로 크기를 추정했을 때의 분산.
+    histogram은 with_histogram일 때 직속 파일의 Histogram.
+    rules는 이 디렉토리의 규칙 파일까지 더한 IgnoreRules(규칙이 없으면 None)로, 항목과 하위
+    디렉토리에 적용한다. rule_files는 이 디렉토리에 있는 규칙 파일의 이름들.
+    """
+
+    __slots__ = (
+        "mtime",
+        "size",
+        "size_var",
+        "num_files",
+        "files",
+        "subdirs",
+        "histogram",
+        "rules",
+        "rule_files",
+    )
+
+    def __init__(
+        self,
+        mtime=None,
+        size=0,
+        num_files=0,
+        files=None,
+        subdirs=None,
+        rules=None,
+        rule_files=(),
+    ):
+        self.mtime = mtime
+        self.size = size
+        self.size_var = 0.0
+        self.histogram = None
+        self.num_files = num_files
+        self.files = [] if files is None else files
+        self.subdirs = [] if subdirs is None else subdirs
+        self.rules = rules
+        self.rule_files = rule_files
+
+
+def list_directory(
+    directory,
+    max_files,
+    stats=None,
+    with_mtime=False,
+    top=None,
+    with_histogram=False,
+    rules=None,
+    *,
+    allocated=False,
+    inodes=None,
+    device=None,
+):
+    """
+    scandir 한 번으로 직속 파일의 개수와 크기를 집계한다.
+
+    출력용 파일 목록은 이름순으로 앞의 max_files개만 남긴다. 항목을 버퍼에 모으다가
+    2 * max_files개를 넘으면 정렬해서 앞부분만 남기므로, 메모리는 디렉토리의 폭이 아니라
+    max_files에 비례한다. 결과는 전체를 정렬한 뒤 자른 것과 같다.
+    top(TopN)을 주면 모든 파일의 크기를 넘긴다.
+    with_histogram이면 모든 파일을 listing.histogram에 집계한다.
+    rules(IgnoreRules)를 주면 제외 대상은 stat하기 전에 버리고, 하위 디렉토리 목록에도 넣지 않는다.
+    rules는 상위 디렉토리까지의 규칙이고, 이 디렉토리의 규칙 파일은 scandir 결과에서 찾아서 더한다.
+    allocated면 할당된 크기를 센다 (entry_size 참고).
+    inodes(InodeSet)를 주면 다른 링크로 이미 센 하드 링크는 목록에만 넣고 합계, top, 히스토그램에는 넣지 않는다.
+    device(st_dev)를 주면 다른 파일시스템이 마운트된 하위 디렉토리는 목록에 넣지 않는다.
+    """
+    listing = Listing()
+    files = listing.files
+    histogram = listing.histogram = Histogram() if with_histogram else None
+
+    started = time.perf_counter()
+    stat_seconds = 0.0
+    stat_calls = 0
+    entries = 0
+
+    stat_directory(listing, directory, with_mtime, allocated)
+
+    with os.scandir(directory) as it:
+        listing.rule_files, scanned = find_rule_files(rules, directory, it)
+        if rules is not None:
+            rules = rules.for_directory(directory, listing.rule_files)
+        listing.rules = rules
+        excluded = exclusion_matcher(rules, directory)
+
+        for entry in scanned:
+            entries += 1
+            name = entry.name
+            # is_dir()과 is_symlink()는 d_type을 사용하므로, 심볼릭 링크가 아니면 stat을 호출하지 않는다
+            if entry_is_dir(entry):
+                if excluded is not None and excluded(name, True):
+                    continue
+                is_symlink = entry.is_symlink()
+                # 디렉토리 심볼릭 링크의 대상은 Scanner.follow_link에서 따로 확인한다
+                if device is not None and not is_symlink and on_other_device(entry, device):
+                    continue
+                listing.subdirs.append((name, is_symlink))
+                continue
+            if excluded is not None and excluded(name):
+                continue
+
+            if stats is None:
+                size = entry_size(entry, allocated)
+            else:
+                stat_started = time.perf_counter()
+                size = entry_size(entry, allocated)
+                stat_seconds += time.perf_counter() - stat_started
+                stat_calls += 1
+
+            if inodes is None or inodes.add(entry):
+                listing.size += size
+                if top is not None:
+                    top.add_file(directory, name, size)
+                if histogram is not None:
+                    histogram.add(name, size)
+            if not is_visible_file(name):
+                continue
+
+            listing.num_files += 1
+            if max_files > 0:
+                files.append((name, size, entry_mtime(entry)))
+                if len(files) >= 2 * max_files:
+                    files.sort()
+                    del files[max_files:]
+
+    files.sort()
+    del files[max_files:]
+    listing.subdirs.sort()
+
+    if stats is not None:
+        stats.record_listing(
+            directory, time.perf_counter() - started, stat_seconds, stat_calls, entries
+        )
+
+    return listing
+
+
+def estimate_directory(
+    directory,
+    max_files,
+    sample_size,
+    time_budget,
+    stats=None,
+    with_mtime=False,
+    top=None,
+    rules=None,
+    *,
+    allocated=False,
+    device=None,
+):
+    """
+    list_directory와 같은 Listing을 만들되, 파일 크기의 합은 표본으로 추정한다.
+
+    파일 목록과 개수는 d_type만으로 정확히 세고, stat은 reservoir sampling으로 고른
+    sample_size개의 파일(과 출력할 max_files개)에만 호출한다. 표본을 stat하는 데
+    time_budget초가 넘으면 그때까지의 표본으로 추정한다.
+    크기는 표본 평균 * 파일 수로 추정하고, 유한 모집단 보정을 한 분산을 size_var에 담는다.
+    모든 파일을 stat했으면 정확한 값이므로 size_var는 0이다.
+    top(TopN)에는 표본으로 stat한 파일만 넘긴다.
+    하드 링크는 표본에서 따로 가려내지 않으므로 링크마다 센다.
+    """
+    listing = Listing()
+    files = []  # 출력할 파일 (name, DirEntry) 후보
+    sample = []  # 크기를 잴 DirEntry 표본
+    count = 0  # 숨김파일을 포함한 전체 파일 수
+
+    started = time.perf_counter()
+    entries = 0
+
+    stat_directory(listing, directory, with_mtime, allocated)
+
+    with os.scandir(directory) as it:
+        listing.rule_files, scanned = find_rule_files(rules, directory, it)
+        if rules is not None:
+            rules = rules.for_directory(directory, listing.rule_files)
+        listing.rules = rules
+        excluded = exclusion_matcher(rules, directory)
+
+        for entry in scanned:
+            entries += 1
+            name = entry.name
+            if entry_is_dir(entry):
+                if excluded is not None and excluded(name, True):
+                    continue
+                is_symlink = entry.is_symlink()
+                if device is not None and not is_symlink and on_other_device(entry, device):
+                    continue
+                listing.subdirs.append((name, is_symlink))
+                continue
+            if excluded is not None and excluded(name):
+                continue
+
+            if count < sample_size:
+                sample.append(entry)
+            else:
+                slot = random.randrange(count + 1)
+                if slot < sample_size:
+                    sample[slot] = entry
+            count += 1
+
+            if not is_visible_file(name):
+                continue
 
-        if is_root:
-            all_filepaths = ["."]
+            listing.num_files += 1
+            if max_files > 0:
+                files.append((name, entry))
+                if len(files) >= 2 * max_files:
+                    files.sort(key=lambda file: file[0])
+                    del files[max_files:]
+
+    files.sort(key=lambda file: file[0])
+    del files[max_files:]
+    listing.subdirs.sort()
+
+    stat_started = time.perf_counter()
+    listing.files = [
+        (name, entry_size(entry, allocated), entry_mtime(entry)) for name, entry in files
+    ]
+
+    sizes = []
+    for entry in sample:
+        # 분산을 구하려면 표본이 둘은 있어야 한다
+        if len(sizes) >= 2 and time.perf_counter() - stat_started > time_budget:
+            break
+        sizes.append(entry_size(entry, allocated))
+        if top is not None:
+            top.add_file(directory, entry.name, sizes[-1])
+    stat_seconds = time.perf_counter() - stat_started
+
+    if len(sizes) == count:
+        listing.size += sum(sizes)
+    else:
+        mean = sum(sizes) / len(sizes)
+        variance = 0.0
+        if len(sizes) > 1:
+            variance = sum((size - mean) ** 2 for size in sizes) / (len(sizes) - 1)
+        listing.size += round(mean * count)
+        listing.size_var = count * count * (1 - len(sizes) / count) * variance / len(sizes)
+
+    if stats is not None:
+        stats.record_listing(
+            directory,
+            time.perf_counter() - started,
+            stat_seconds,
+            len(sizes) + len(files),
+            entries,
+        )
+
+    return listing
+
+
+def add_subtotal(node, child):
+    """
+    집계가 끝난 하위 디렉토리의 합계를 부모에 더한다.
+    """
+    node.size += child.size
+    node.size_var += child.size_var
+    if node.histogram is not None:
+        node.histogram.merge(child.histogram)
+
+
+class Scanner:
+    """
+    로컬 파일시스템 스캐너.
+
+    scan()은 post-order로 한 번만 순회하며 디렉토리별 크기와 파일 수를 집계한
+    DirNode 트리를 만들고, entries()는 그 트리를 출력 순서의 Entry 스트림으로 펼친다.
+    상태는 모두 인스턴스에 있으므로 Scanner를 여러 개 만들어 동시에 써도 된다.
+
+    index(ScanIndex)를 주면 mtime이 그대로인 디렉토리는 저장된 결과를 재사용한다. 재사용한
+    디렉토리의 하드 링크는 다시 가려낼 수 없으므로 options.count_links여야 한다 (아니면 ValueError).
+    on_dir_done을 주면 디렉토리 하나의 집계가 끝날 때마다 그 DirNode로 호출한다.
+    top(TopN)을 주면 스캔하면서 가장 큰 디렉토리와 파일을 모은다.
+    제외 규칙(options.excludes 등)에 걸린 디렉토리는 scandir 단계에서 버리므로 그 아래는 읽지 않는다.
+    """
+
+    def __init__(
+        self, options=None, *, index=None, stats=None, on_dir_done=None, top=None
+    ):
+        self.options = ScanOptions() if options is None else options
+        if index is not None and not self.options.count_links:
+            raise ValueError("a scan index needs count_links")
+        self.index = index  # ScanIndex
+        self.stats = stats  # ScanStats
+        self.on_dir_done = on_dir_done
+        self.top = top  # TopN
+        # 스캔마다 root_node()에서 새로 만든다
+        self.inodes = None if self.options.count_links else InodeSet()
+        self.device = None  # --one-file-system이면 루트의 st_dev
+
+    def scan(self, directory):
+        started = time.perf_counter()
+
+        if self.options.processes > 1:
+            root = self.scan_processes(directory)
+        elif self.options.jobs > 1:
+            root = self.scan_parallel(directory)
         else:
-            all_filepaths = sorted(os.listdir(directory))
+            root = self.root_node(directory)
+            self.scan_node(root)
 
-        dir_only_paths = [
-            filepath
-            for filepath in all_filepaths
-            if os.path.isdir(os.path.join(directory, filepath))
-            and filepath not in ["__MACOSX", "venv", ".git", ".idea", "node_modules"]
-        ]
-        file_only_paths = self.list_files(directory, all_filepaths)
+        if self.stats is not None:
+            self.stats.add("scan", time.perf_counter() - started)
+
+        return root
+
+    def root_node(self, directory):
+        options = self.options
+        self.inodes = None if options.count_links else InodeSet()
+        if options.one_file_system:
+            self.device = os.stat(directory).st_dev
+        rules = IgnoreRules.load(
+            directory,
+            patterns=options.excludes,
+            defaults=options.default_excludes,
+            gitignore=options.gitignore,
+        )
+        return DirNode(
+            os.path.basename(os.path.normpath(directory)), directory, rules=rules
+        )
+
+    def entries(self, root):
+        options = self.options
+        return iter_entries(
+            root,
+            max_files=options.max_files,
+            dirs_only=options.dirs_only,
+            files_first=options.files_first,
+            level=options.level,
+        )
 
-        if DIRS_ONLY:
-            filepaths = dir_only_paths
+    def scan_entries(self, node, links=None):
+        """
+        디렉토리 하나를 읽어 node에 직속 파일의 크기와 목록을 채운다.
+
+        하위 디렉토리는 빈 DirNode를 만들어 (child, counted) 목록으로 반환한다.
+        counted가 False인 항목(디렉토리 심볼릭 링크)은 부모 크기에 더하지 않는다.
+        links(list)를 주면 하드 링크된 파일은 세지 않고 links에 모은다 (DeferredLinks 참고).
+        """
+        options = self.options
+        directory = node.path
+        # 링크를 거쳐 온 파일은 다른 경로로 이미 센 것일 수 있으므로 순위에 넣지 않는다.
+        # 하드 링크 집합에도 넣지 않는다. 넣으면 실제 경로에서 만났을 때 0으로 셀 수 있다
+        top = None if node.linked else self.top
+        inodes = None if node.linked else self.inodes
+        if inodes is not None and links is not None:
+            inodes = DeferredLinks(links, options.allocated)
+        keep_children = node.displayed and (
+            options.level < 0 or node.depth < options.level
+        )
+        max_files = options.max_files if keep_children and not options.dirs_only else 0
+
+        if options.sample_size > 0:
+            listing = estimate_directory(
+                directory,
+                max_files,
+                options.sample_size,
+                options.time_budget,
+                self.stats,
+                options.with_mtime,
+                top,
+                node.rules,
+                allocated=options.allocated,
+                device=self.device,
+            )
+        elif self.index is None:
+            listing = list_directory(
+                directory,
+                max_files,
+                self.stats,
+                options.with_mtime,
+                top,
+                options.with_histogram,
+                node.rules,
+                allocated=options.allocated,
+                inodes=inodes,
+                device=self.device,
+            )
         else:
-            if PRINT_FILES_FIRST:  # 파일을 먼저 출력하고 디렉토리를 출력
-                filepaths = file_only_paths[:MAX_FILES] + dir_only_paths
-            else:  # 디렉토리를 먼저 출력하고 파일을 출력
-                filepaths = dir_only_paths + file_only_paths[:MAX_FILES]
-
-        for index in range(len(filepaths)):
-            # if filepaths[index][0] == ".":
-            #     continue
-
-            absolute = os.path.join(directory, filepaths[index])
-            is_dir_path = os.path.isdir(absolute)
-            if is_dir_path:
-                # directory 출력
-                emoji = "📂"
-                # num_files = len(
-                #     [
-                #         f
-                #         for f in os.listdir(absolute)
-                #         if os.path.isfile(os.path.join(absolute, f))
-                #     ]
-                # )
-                num_files = len(self.list_files(absolute, os.listdir(absolute)))
-                file_count_str = f" {num_files:,}개의 파일" if num_files > 0 else ""
-                dir_size = get_directory_size(absolute)
-                dir_size_str = f"{human_readable_size(dir_size)}"
-
-                if is_root:
-                    directory_title = os.path.basename(os.path.normpath(directory))
-                else:
-                    directory_title = filepaths[index]
+            listing = self.index.listing(directory, max_files, self.stats, node.rules)
+
+        # 이 디렉토리의 규칙 파일은 이 디렉토리의 항목과 그 아래에 적용된다
+        rules = listing.rules
+        subdirs = []
+
+        node.mtime = listing.mtime
+        node.size += listing.size
+        node.size_var += listing.size_var
+        node.histogram = listing.histogram
+        node.num_files = listing.num_files
+        if keep_children:
+            node.files = listing.files
+
+        for name, is_symlink in listing.subdirs:
+            displayed = keep_children
+            if is_symlink:
+                # os.walk는 디렉토리 심볼릭 링크를 따라가지 않으므로 크기에 포함하지 않는다.
+                # 출력 대상이면 링크 대상의 크기로 따로 집계한다.
+                if displayed:
+                    path = os.path.join(directory, name)
+                    target = self.follow_link(node, path)
+                    child = DirNode(
+                        name,
+                        path,
+                        node.depth + 1,
+                        linked=node.linked + (target,),
+                        rules=rules,
+                    )
+                    node.dirs.append(child)
+                    # 따라가지 않는 링크는 빈 디렉토리로 보여 준다
+                    if target is not None:
+                        subdirs.append((child, False))
+                continue
+
+            child = DirNode(
+                name,
+                os.path.join(directory, name),
+                node.depth + 1,
+                displayed,
+                node.linked,
+                rules,
+            )
+            if displayed:
+                node.dirs.append(child)
+            subdirs.append((child, True))
+
+        return subdirs
+
+    def follow_link(self, node, path):
+        """
+        node 안의 디렉토리 심볼릭 링크 path를 따라갈지 정한다. 따라가면 대상의 실제 경로, 아니면 None.
+
+        대상이 node 자신이나 그 조상이거나, 여기까지 오면서 이미 따라온 링크의 대상이면 순환이므로
+        따라가지 않는다. 링크를 따라갈 때마다 새 대상이 하나씩 늘어나므로 순회는 반드시 끝난다.
+        device가 있으면(--one-file-system) 다른 파일시스템에 있는 대상도 따라가지 않는다.
+        """
+        try:
+            target = os.path.realpath(path, strict=True)
+            if self.device is not None and os.stat(target).st_dev != self.device:
+                return None
+            current = os.path.realpath(node.path, strict=True)
+        except OSError:  # 깨진 링크, 링크 자체의 순환(ELOOP)
+            return None
+
+        if target in node.linked:
+            return None
+        if current == target or current.startswith(target.rstrip(os.sep) + os.sep):
+            return None
+        return target
+
+    def dir_done(self, node):
+        """
+        디렉토리 하나의 집계가 끝났을 때(post-order) 호출된다. 모든 하위 디렉토리가 먼저 끝난다.
+        """
+        if self.top is not None and not node.linked:
+            self.top.add_dir(node)
+        if self.on_dir_done is not None:
+            self.on_dir_done(node)
+
+    def scan_node(self, node):
+        """
+        하위 디렉토리의 크기는 재귀 호출의 결과를 부모에 더해서 구하므로,
+        디렉토리마다 os.walk를 다시 돌 필요가 없다.
+        level 보다 깊은 디렉토리는 크기만 집계하고 노드는 보관하지 않는다.
+        """
+        for child, counted in self.scan_entries(node):
+            self.scan_node(child)
+            if counted:
+                add_subtotal(node, child)
+
+        self.dir_done(node)
+
+    def scan_parallel(self, directory):
+        """
+        scan_node()와 같은 결과를 만들되, 디렉토리 하나를 읽는 작업을 스레드 풀에서 동시에 실행한다.
+
+        NFS 같은 네트워크 파일시스템에서는 scandir/stat이 지연 시간에 묶여 있으므로
+        형제 디렉토리를 동시에 읽으면 처리량이 늘어난다.
+        크기 집계는 메인 스레드에서만 하므로 잠금이 필요 없다.
+        하위 디렉토리가 모두 끝난 노드부터 부모로 크기를 올려 보낸다.
+
+        하드 링크는 작업 스레드에서 세지 않고, 메인 스레드가 읽기가 끝난 디렉토리를 한 스레드로
+        스캔할 때의 순서(pre-order)로 받아서 InodeSet에 넣는다. 따라서 여러 디렉토리에 링크된
+        파일의 크기는 scan_node()와 같은 디렉토리에 더해진다.
+        """
+        root = self.root_node(directory)
+        parents = {}  # child -> (parent, counted)
+        remaining = {}  # node -> 아직 끝나지 않은 하위 디렉토리 수
+        results = {}  # node -> 읽기가 끝났지만 아직 차례가 오지 않은 (subdirs, links)
+        order = [root]  # 다음에 받을 노드들. 끝이 pre-order로 다음 차례다
+
+        def scan(node):
+            links = None if self.inodes is None else []
+            return self.scan_entries(node, links), links
+
+        def accept(node, subdirs, links):
+            for key, name, size in links or ():
+                if self.inodes.add_key(key):
+                    node.size += size
+                    if self.top is not None:
+                        self.top.add_file(node.path, name, size)
+                    if node.histogram is not None:
+                        node.histogram.add(name, size)
+
+            if not subdirs:
+                finish(node)
+                return
+            remaining[node] = len(subdirs)
+            order.extend(child for child, _ in reversed(subdirs))
+
+        def finish(node):
+            while True:
+                self.dir_done(node)
+                if node is root:
+                    return
+
+                parent, counted = parents.pop(node)
+                if counted:
+                    add_subtotal(parent, node)
+                remaining[parent] -= 1
+                if remaining[parent]:
+                    return
+                del remaining[parent]
+                node = parent
+
+        with ThreadPoolExecutor(max_workers=self.options.jobs) as pool:
+            futures = {pool.submit(scan, root): root}
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    node = futures.pop(future)
+                    subdirs, links = future.result()
+                    results[node] = subdirs, links
+                    for child, counted in subdirs:
+                        parents[child] = (node, counted)
+                        futures[pool.submit(scan, child)] = child
+
+                while order and order[-1] in results:
+                    node = order.pop()
+                    accept(node, *results.pop(node))
+
+        return root
+
+    def scan_processes(self, directory):
+        """
+        scan_node()와 같은 결과를 만들되, 최상위 하위 디렉토리마다 작업 프로세스에서 스캔한다.
+
+        로컬 NVMe처럼 I/O가 빠르면 항목마다 드는 파이썬 처리 비용이 병목이라 스레드로는
+        빨라지지 않는다. 작업 프로세스는 encode_tree()의 배열로 결과를 돌려주고,
+        메인 프로세스는 하위 디렉토리 순서대로 붙이므로 출력은 한 프로세스로 스캔한 것과 같다.
+
+        다른 최상위 디렉토리에 걸친 하드 링크는 프로세스 사이에서 한 번만 셀 수 없으므로
+        options.count_links여야 한다. 아니면 ValueError.
+        """
+        if not self.options.count_links:
+            raise ValueError("scanning in processes needs count_links")
+
+        root = self.root_node(directory)
+        subdirs = self.scan_entries(root)
+        top_n = 0 if self.top is None else self.top.n
+
+        with ProcessPoolExecutor(max_workers=self.options.processes) as pool:
+            futures = [
+                pool.submit(
+                    scan_subtree,
+                    child.path,
+                    child.name,
+                    child.depth,
+                    child.displayed,
+                    child.linked,
+                    child.rules,
+                    self.options,
+                    top_n,
+                    self.device,
+                )
+                for child, _ in subdirs
+            ]
+
+            for (child, counted), future in zip(subdirs, futures):
+                encoded, heaps = future.result()
+                decode_tree(child, encoded)
+                if heaps is not None:
+                    self.top.merge(*heaps)
+                if counted:
+                    add_subtotal(root, child)
+
+        self.dir_done(root)
+        return root
+
+
+def scan_subtree(path, name, depth, displayed, linked, rules, options, top_n, device):
+    """
+    scan_processes의 작업 프로세스에서 최상위 하위 디렉토리 하나를 스캔한다.
+
+    결과는 encode_tree()로 펼친 배열과, --top이면 그 프로세스에서 모은 heap이다.
+    """
+    node = DirNode(name, path, depth, displayed, linked, rules)
+    top = TopN(top_n) if top_n else None
+    scanner = Scanner(options, top=top)
+    scanner.device = device
+    scanner.scan_node(node)
+
+    heaps = None if top is None else (top.dirs, top.files)
+    return encode_tree(node), heaps
+
+
+def encode_tree(root):
+    """
+    DirNode 트리를 pre-order로 펼쳐 문자열 하나와 배열 몇 개로 만든다.
+
+    프로세스 사이에 노드와 파일마다 파이썬 객체를 pickle하지 않도록, 이름은 NUL로 이어 붙이고
+    (파일 이름에는 NUL이 올 수 없다) 숫자는 array에 담는다. mtime의 None은 NaN으로 쓴다.
+    노드마다 ints에 size, num_files, 하위 디렉토리 수, 파일 수를, floats에 mtime, size_var를
+    쓰고, 이어서 파일마다 ints에 size를, floats에 mtime을 쓴다.
+    """
+    names = []
+    ints = array("q")
+    floats = array("d")
+    histograms = []
+    nan = float("nan")
+
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        names.append(node.name)
+        ints.extend((node.size, node.num_files, len(node.dirs), len(node.files)))
+        floats.extend((nan if node.mtime is None else node.mtime, node.size_var))
+        histograms.append(node.histogram)
+
+        for name, size, mtime in node.files:
+            names.append(name)
+            ints.append(size)
+            floats.append(nan if mtime is None else mtime)
+
+        stack.extend(reversed(node.dirs))
+
+    if root.histogram is None:
+        histograms = None
+    return "\0".join(names), ints, floats, histograms
+
+
+def decode_tree(root, encoded):
+    """
+    encode_tree()의 결과로 root(이미 만들어 둔 최상위 노드)와 그 아래 트리를 채운다.
+    """
+    names, ints, floats, histograms = encoded
+    names = names.split("\0")
+    positions = [0, 0, 0, 0]  # names, ints, floats, histograms에서 읽을 위치
+
+    def optional(value):
+        return None if value != value else value  # NaN -> None
+
+    def read_node(node):
+        n, i, f, h = positions
+        node.size, node.num_files, num_dirs, num_files = ints[i : i + 4]
+        node.mtime = optional(floats[f])
+        node.size_var = floats[f + 1]
+        node.histogram = None if histograms is None else histograms[h]
+        n, i, f, h = n + 1, i + 4, f + 2, h + 1
+
+        node.files = [
+            (names[n + k], ints[i + k], optional(floats[f + k]))
+            for k in range(num_files)
+        ]
+        positions[:] = n + num_files, i + num_files, f + num_files, h
+        return num_dirs
+
+    pending = [[root, read_node(root)]]  # [노드, 아직 읽지 않은 하위 디렉토리 수]
+    while pending:
+        parent = pending[-1]
+        if not parent[1]:
+            pending.pop()
+            continue
+
+        parent[1] -= 1
+        node = parent[0]
+        name = names[positions[0]]
+        child = DirNode(
+            name, os.path.join(node.path, name), node.depth + 1, linked=node.linked
+        )
+        node.dirs.append(child)
+        pending.append([child, read_node(child)])
+
+
+class ScanIndex:
+    """
+    디렉토리별 Listing을 SQLite 파일에 저장하는 스캔 인덱스.
+
+    다음 실행에서 디렉토리의 mtime이 그대로면 저장된 Listing을 재사용하므로
+    scandir와 파일별 stat을 건너뛴다. 디렉토리마다 os.stat은 여전히 한 번씩 하고,
+    하위 전체의 합계는 저장하지 않고 매번 Listing에서 다시 더한다.
+    디렉토리의 mtime은 항목이 추가/삭제/이름변경될 때만 바뀌므로, 기존 파일이 그 자리에서
+    커지거나 줄어든 경우는 반영되지 않고 저장할 때의 크기가 그대로 나온다.
+    저장된 Listing은 저장할 때의 제외 규칙을 적용한 것이다. .treeviewignore를 고쳤으면 인덱스를 지운다.
+    """
+
+    VERSION = 5  # 규칙 파일 이름(rule_files) 열을 더함
+
+    def __init__(self, path):
+        # scan_parallel의 작업 스레드에서도 사용하므로 잠금으로 보호한다
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.reused = 0
+        self.rescanned = 0
+
+        # 저장 형식이 바뀌었으면 기존 인덱스는 버리고 새로 만든다
+        if self.conn.execute("PRAGMA user_version").fetchone()[0] != self.VERSION:
+            self.conn.execute("DROP TABLE IF EXISTS dirs")
+            self.conn.execute(f"PRAGMA user_version = {self.VERSION}")
+
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS dirs (
+                path TEXT PRIMARY KEY,
+                mtime_ns INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                num_files INTEGER NOT NULL,
+                files TEXT NOT NULL,
+                subdirs TEXT NOT NULL,
+                rule_files TEXT NOT NULL
+            )
+            """
+        )
+
+    def listing(self, directory, max_files, stats=None, rules=None):
+        key = os.path.abspath(directory)
+        started = time.perf_counter()
+        mtime_ns = os.stat(directory).st_mtime_ns
+
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT mtime_ns, size, num_files, files, subdirs, rule_files"
+                " FROM dirs WHERE path = ?",
+                (key,),
+            ).fetchone()
+
+        if stats is not None:
+            stats.add("index", time.perf_counter() - started)
+
+        if row is not None and row[0] == mtime_ns:
+            files = json.loads(row[3])
+            # 저장된 파일 목록은 저장 당시의 max_files개까지이므로, 이번에 더 필요하면 다시 읽는다
+            if len(files) >= min(row[2], max_files):
+                self.reused += 1
+                if stats is not None:
+                    stats.add("index hit", 0)
+                # 규칙 파일이 생기거나 없어지면 mtime이 바뀌므로 저장된 이름을 그대로 쓸 수 있다
+                rule_files = tuple(json.loads(row[5]))
+                if rules is not None:
+                    rules = rules.for_directory(directory, rule_files)
+                return Listing(
+                    mtime=mtime_ns / 1e9,
+                    size=row[1],
+                    num_files=row[2],
+                    files=files[:max_files],
+                    subdirs=json.loads(row[4]),
+                    rules=rules,
+                    rule_files=rule_files,
+                )
+
+        listing = list_directory(directory, max_files, stats, rules=rules)
+        listing.mtime = mtime_ns / 1e9
+        self.rescanned += 1
+
+        with self.lock:
+            if row is not None:
+                # 사라진 하위 디렉토리의 항목은 그 아래까지 모두 지운다
+                names = {name for name, _ in listing.subdirs}
+                for name, _ in json.loads(row[4]):
+                    if name not in names:
+                        self.delete_subtree(os.path.join(key, name))
+
+            self.conn.execute(
+                "INSERT OR REPLACE INTO dirs VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    key,
+                    mtime_ns,
+                    listing.size,
+                    listing.num_files,
+                    json.dumps(listing.files, ensure_ascii=False),
+                    json.dumps(listing.subdirs, ensure_ascii=False),
+                    json.dumps(listing.rule_files, ensure_ascii=False),
+                ),
+            )
 
-                paddding = self.get_padding(prefix, is_root, directory_title)
+        return listing
 
-                formatted_output = f"{emoji} {directory_title}{' ' * paddding} [{dir_size_str}{file_count_str}]"
+    def delete_subtree(self, key):
+        # '/' 다음 문자는 '0'이므로 [key/, key0) 범위가 key 아래의 모든 경로다
+        self.conn.execute(
+            "DELETE FROM dirs WHERE path = ? OR (path >= ? AND path < ?)",
+            (key, key + "/", key + "0"),
+        )
+
+    def close(self):
+        with self.lock:
+            self.conn.commit()
+            self.conn.close()
+
+
+class ScanStats:
+    """
+    --stats 옵션에서 쓰는 단계별 시간과 호출 횟수.
+
+    Scanner(stats=ScanStats())와 TextRenderer(stats=...)로 넘기면 스캔과 출력 중에 채워진다.
+    scan_parallel의 작업 스레드에서도 기록하므로 잠금으로 보호하며,
+    이 경우 scandir/stat 시간은 스레드별 시간의 합이라 전체 시간보다 클 수 있다.
+    """
+
+    SLOWEST = 10
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.seconds = collections.Counter()
+        self.calls = collections.Counter()
+        self.entries = 0
+        self.slowest = []  # (seconds, directory) min-heap, 최대 SLOWEST개
+
+    def add(self, phase, seconds, calls=1):
+        with self.lock:
+            self.seconds[phase] += seconds
+            self.calls[phase] += calls
+
+    def record_listing(self, directory, seconds, stat_seconds, stat_calls, entries):
+        with self.lock:
+            self.seconds["scandir"] += seconds - stat_seconds
+            self.calls["scandir"] += 1
+            self.seconds["stat"] += stat_seconds
+            self.calls["stat"] += stat_calls
+            self.entries += entries
+
+            if len(self.slowest) < self.SLOWEST:
+                heapq.heappush(self.slowest, (seconds, directory))
             else:
-                # file 출력
-                emoji = "📄"
-                file_count_str = ""
-                dir_size_str = f"{human_readable_size(os.path.getsize(absolute))}"
-                formatted_output = f"{emoji} {filepaths[index]} [{dir_size_str}]"
+                heapq.heappushpop(self.slowest, (seconds, directory))
+
+    def report(self, out=sys.stderr):
+        seconds = self.seconds
+        calls = self.calls
+        rate = self.entries / seconds["scan"] if seconds["scan"] else 0
+        # 인덱스에서 재사용한 디렉토리는 scandir을 거치지 않는다
+        directories = calls["scandir"] + calls["index hit"]
+
+        lines = [
+            f"scan     {seconds['scan']:9.3f}s  {directories:,} directories,"
+            f" {self.entries:,} entries ({rate:,.0f} entries/s)",
+            f"  scandir {seconds['scandir']:8.3f}s  {calls['scandir']:,} calls",
+            f"  stat    {seconds['stat']:8.3f}s  {calls['stat']:,} calls",
+        ]
+        if calls["index"]:
+            lines.append(
+                f"  index   {seconds['index']:8.3f}s  {calls['index hit']:,} hits,"
+                f" {calls['index'] - calls['index hit']:,} rescanned"
+            )
+        lines += [
+            f"render   {seconds['render']:9.3f}s",
+            f"  padding {seconds['padding']:8.3f}s  {calls['padding']:,} calls (wcswidth)",
+            f"  output  {seconds['output']:8.3f}s  {calls['output']:,} lines",
+            "slowest directories:",
+        ]
+        for dir_seconds, directory in sorted(self.slowest, reverse=True):
+            lines.append(f"  {dir_seconds:8.3f}s  {directory}")
+
+        print("\n".join(lines), file=out)
+
+
+class TopN:
+    """
+    --top 옵션에서 쓰는 가장 큰 디렉토리와 파일 N개씩.
+
+    크기 N개짜리 min-heap 두 개만 유지하므로 항목당 비용은 O(log N)이고,
+    heap이 찬 뒤에는 가장 작은 값보다 작은 항목은 비교 한 번으로 버린다.
+    scan_parallel의 작업 스레드에서도 호출하므로 heap은 잠금으로 보호한다.
+    """
+
+    def __init__(self, n):
+        self.n = n
+        self.lock = threading.Lock()
+        self.dirs = []  # (size, path, size_error) min-heap
+        self.files = []  # (size, path, 0) min-heap
+
+    def push(self, heap, size, path, size_error=0):
+        with self.lock:
+            if len(heap) < self.n:
+                heapq.heappush(heap, (size, path, size_error))
+            elif (size, path) > heap[0][:2]:
+                heapq.heapreplace(heap, (size, path, size_error))
+
+    def merge(self, dirs, files):
+        for size, path, size_error in dirs:
+            self.push(self.dirs, size, path, size_error)
+        for size, path, size_error in files:
+            self.push(self.files, size, path, size_error)
+
+    def add_file(self, directory, name, size):
+        # 잠금 없이 먼저 걸러 낸다. 경합이 있어도 push()에서 다시 비교하므로 결과는 같다
+        if len(self.files) >= self.n and size < self.files[0][0]:
+            return
+        self.push(self.files, size, os.path.join(directory, name))
+
+    def add_dir(self, node):
+        if len(self.dirs) >= self.n and node.size < self.dirs[0][0]:
+            return
+        self.push(self.dirs, node.size, node.path, Z_95 * node.size_var**0.5)
+
+    def report(self, out=sys.stdout):
+        lines = []
+        for title, heap in [("가장 큰 디렉토리", self.dirs), ("가장 큰 파일", self.files)]:
+            lines.append(f"\n{title} {len(heap)}개")
+            ranked = sorted(heap, key=lambda item: (-item[0], item[1]))
+            for rank, (size, path, size_error) in enumerate(ranked, start=1):
+                size_str = human_readable_size(size)
+                if size_error:
+                    size_str = "≈" + size_str
+                lines.append(f"{rank:>4}  {size_str:>7}  {path}")
+
+        print("\n".join(lines), file=out)
+
+
+class NdjsonWriter:
+    """
+    스캔 중에 집계가 끝난 디렉토리부터 한 줄에 하나씩 JSON 레코드를 쓴다.
+
+    Scanner(on_dir_done=writer.write_dir)로 dir_done()에서 호출되므로 레코드는 post-order(하위 항목이 먼저)로 나오며,
+    -j 옵션을 쓰면 형제 디렉토리 사이의 순서는 정해져 있지 않다.
+    기록한 하위 항목은 바로 놓아 주므로 트리 전체를 메모리에 들고 있지 않는다.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, record):
+        self.stream.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def write_dir(self, node):
+        if not node.displayed:
+            return
+
+        for name, size, mtime in node.files:
+            self.write(
+                {
+                    "type": "file",
+                    "path": os.path.join(node.path, name),
+                    "depth": node.depth + 1,
+                    "size": size,
+                    "mtime": mtime,
+                }
+            )
+
+        record = {
+            "type": "dir",
+            "path": node.path,
+            "depth": node.depth,
+            "size": node.size,
+            "file_count": node.num_files,
+            "mtime": node.mtime,
+        }
+        if node.size_var:
+            record["size_error"] = round(Z_95 * node.size_var**0.5)
+        if node.histogram is not None:
+            record["histogram"] = node.histogram.to_dict()
+        self.write(record)
+
+        node.files = []
+        node.dirs = []
+
+
+def make_renderer(output_format, out, options, stats=None):
+    if output_format == "text":
+        return TextRenderer(out, files_first=options.files_first, stats=stats)
+    return RENDERERS[output_format](out)
+
+
+class Tree:
+    """
+    디렉토리 하나를 스캔해서 표준 출력에 텍스트 트리로 출력한다.
+
+    Scanner와 TextRenderer를 묶은 것으로, 다른 형식이나 여러 출력이 필요하면 둘을 직접 쓴다.
+    """
+
+    def __init__(self, options=None, stats=None):
+        self.options = ScanOptions() if options is None else options
+        self.dirCount = 0
+        self.fileCount = 0
+        self.stats = stats  # ScanStats
 
-            self.register(absolute)
+    def summary(self):
+        return str(self.dirCount) + " directories, " + str(self.fileCount) + " files"
+
+    def scan(self, directory):
+        return Scanner(self.options, stats=self.stats).scan(directory)
+
+    def walk(self, directory):
+        scanner = Scanner(self.options, stats=self.stats)
+        root = scanner.scan(directory)
+        renderer = TextRenderer(
+            sys.stdout, files_first=self.options.files_first, stats=self.stats
+        )
+
+        started = time.perf_counter()
+        render(scanner.entries(root), [renderer])
+        if self.stats is not None:
+            self.stats.add("render", time.perf_counter() - started)
+
+        self.dirCount += renderer.dirCount
+        self.fileCount += renderer.fileCount
+
+
+class WatchedDir:
+    """
+    --watch에서 감시하는 디렉토리 하나. 출력하지 않는 깊은 디렉토리도 모두 가진다.
+
+    children은 하위 디렉토리 이름 -> WatchedDir (디렉토리 심볼릭 링크는 감시하지 않으므로 없다).
+    """
+
+    __slots__ = ("node", "parent", "children")
+
+    def __init__(self, node, children):
+        self.node = node
+        self.parent = None
+        self.children = children
+
+
+class TreeWatcher:
+    """
+    --watch. 한 번 스캔한 뒤 디렉토리 변경을 감시하면서, 바뀐 디렉토리만 다시 읽고
+    그 크기 변화량을 조상 디렉토리의 합계에만 더한다. 새로 생긴 하위 디렉토리만 새로 스캔하고,
+    없어진 것은 감시 목록에서 뺀다. 따라서 갱신 비용은 트리 크기가 아니라 변경량에 비례한다.
+
+    감시자는 _watch.make_watcher() (inotify, 안 되면 mtime 폴링)를 쓴다.
+    디렉토리 심볼릭 링크로 따라간 부분은 감시하지 않고, 링크가 있는 디렉토리가 바뀔 때 다시 읽는다.
+    하드 링크는 디렉토리 하나만 다시 읽어서는 한 번만 셀 수 없으므로 options.count_links여야 한다.
+    아니면 ValueError.
+    """
+
+    def __init__(self, scanner, watcher):
+        if not scanner.options.count_links:
+            raise ValueError("watching needs count_links")
+
+        self.scanner = scanner
+        self.watcher = watcher
+        self.dirs = {}  # 디렉토리 경로 -> WatchedDir
+        self.pending = {}  # 정규화한 부모 경로 -> {이름: 아직 부모가 끝나지 않은 WatchedDir}
+        self.root = None
+        scanner.on_dir_done = self.register
+
+    def scan(self, directory):
+        for path in self.dirs:
+            self.watcher.remove(path)
+        self.dirs = {}
+
+        self.root = self.scanner.scan(directory)
+        self.pending.clear()
+        return self.root
+
+    def register(self, node):
+        """
+        Scanner의 on_dir_done. post-order이므로 하위 디렉토리가 먼저 등록되어 있다.
+        """
+        if node.linked:
+            return
+
+        children = self.pending.pop(os.path.normpath(node.path), {})
+        watched = WatchedDir(node, children)
+        for child in children.values():
+            child.parent = watched
+
+        self.dirs[node.path] = watched
+        parent_path = os.path.normpath(os.path.dirname(node.path))
+        self.pending.setdefault(parent_path, {})[node.name] = watched
+        self.watch(node.path)
+
+    def watch(self, path):
+        try:
+            self.watcher.add(path)
+        except OSError as e:
+            # inotify watch 수 제한에 걸리면 지금까지의 디렉토리와 함께 폴링으로 바꾼다
+            print(f"can't watch {path} ({e.strerror}), falling back to polling", file=sys.stderr)
+            self.watcher.close()
+            self.watcher = PollingWatcher()
+            for watched_path in self.dirs:
+                self.watcher.add(watched_path)
 
-            if index == len(filepaths) - 1:  # 마지막 항목인 경우
-                if PRINT_FILES_FIRST and not is_dir_path:
-                    print(f"{prefix}{'' if is_root else '  '} {formatted_output}")
+    def forget(self, watched):
+        stack = [watched]
+        while stack:
+            watched = stack.pop()
+            del self.dirs[watched.node.path]
+            self.watcher.remove(watched.node.path)
+            stack.extend(watched.children.values())
+
+    def discard(self, node):
+        """
+        스캔하다 만 새 디렉토리 node 아래에서 이미 등록된 디렉토리를 지운다.
+        """
+        prefix = node.path.rstrip(os.sep) + os.sep
+        for path in [path for path in self.dirs if path.startswith(prefix)]:
+            del self.dirs[path]
+            self.watcher.remove(path)
+        top = os.path.normpath(node.path)
+        for key in [
+            key
+            for key in self.pending
+            if key == top or key.startswith(top + os.sep)
+        ]:
+            del self.pending[key]
+
+    def refresh(self, path):
+        """
+        디렉토리 하나를 다시 읽고 크기 변화량을 조상에 더한다. 이미 없어진 디렉토리면 False.
+        """
+        watched = self.dirs.get(path)
+        if watched is None:
+            return False
+
+        scanner = self.scanner
+        node = watched.node
+        old_size = node.size
+        old_dirs = {child.name: child for child in node.dirs}
+
+        node.size = 0
+        node.size_var = 0.0
+        node.dirs = []
+        try:
+            subdirs = scanner.scan_entries(node)
+        except FileNotFoundError:
+            # 부모 디렉토리의 이벤트로 지워진다
+            node.size = old_size
+            node.dirs = list(old_dirs.values())
+            return False
+
+        children = {}
+        reused = {}
+        for child, counted in subdirs:
+            existing = watched.children.get(child.name)
+            if not counted:
+                # 디렉토리 심볼릭 링크. 같은 링크였으면 전에 집계한 것을 그대로 쓴다
+                old = old_dirs.get(child.name)
+                if old is not None and old.linked == child.linked:
+                    reused[child] = old
                 else:
-                    print(f"{prefix}{'' if is_root else '└──'} {formatted_output}")
-                new_prefix = prefix + "    "
+                    scanner.scan_node(child)
+                continue
+
+            if existing is None:
+                # 새로 생긴 디렉토리는 하위 전체를 스캔하고 감시 목록에 넣는다
+                try:
+                    scanner.scan_node(child)
+                except FileNotFoundError:
+                    # 스캔하는 사이에 지워졌다. 이 디렉토리의 다음 이벤트에서 다시 읽는다
+                    self.discard(child)
+                    continue
+                existing = self.pending[os.path.normpath(path)].pop(child.name)
+                existing.parent = watched
             else:
-                if PRINT_FILES_FIRST and not is_dir_path:
-                    if dir_only_paths:
-                        print(f"{prefix}{'' if is_root else '│  '} {formatted_output}")
-                    else:
-                        print(f"{prefix}   {formatted_output}")
-                else:
-                    print(f"{prefix}├── {formatted_output}")
-                new_prefix = prefix + "│   "
-
-            if is_dir_path:
-                self.walk(
-                    absolute,
-                    new_prefix,
-                    depth=depth + 1,
-                    is_root=False,
-                )
+                reused[child] = existing.node
+            children[child.name] = existing
+            node.size += existing.node.size
+            node.size_var += existing.node.size_var
 
-    def list_files(self, directory, all_filepaths):
-        return [
-            filepath
-            for filepath in all_filepaths
-            if not os.path.isdir(os.path.join(directory, filepath))
-            and filepath not in ("_.DS_Store", ".DS_Store")
-            and filepath[0] != "."  # 숨김파일 제외
+        self.pending.pop(os.path.normpath(path), None)
+        node.dirs = [
+            reused.get(child, child)
+            for child in node.dirs
+            if child.linked or child.name in children
         ]
+        for name, child in watched.children.items():
+            if name not in children:
+                self.forget(child)
+        watched.children = children
 
-    def get_padding(self, prefix, is_root, directory_title):
-        paddding = 40 - (
-            wcswidth(prefix) + len("" if is_root else "└──") + len(directory_title)
-        )
+        delta = node.size - old_size
+        ancestor = watched.parent
+        while delta and ancestor is not None:
+            ancestor.node.size += delta
+            ancestor = ancestor.parent
+        return True
 
-        return paddding
+    def update(self, paths):
+        """
+        바뀐 디렉토리들을 갱신하고, 다시 읽은 디렉토리 수를 돌려준다.
+        얕은 디렉토리부터 읽어서, 지워진 하위 디렉토리는 다시 읽지 않는다.
+        """
+        refreshed = 0
+        for path in sorted(paths, key=lambda path: path.count(os.sep)):
+            if self.refresh(path):
+                refreshed += 1
+        return refreshed
+
+    def run(self, directory, interval, out=sys.stdout):
+        """
+        처음 스캔한 트리를 출력한 뒤, 바뀐 디렉토리가 있을 때만 최대 interval초에 한 번씩 다시 출력한다.
+        Ctrl+C로 끝낸다.
+        """
+        self.scan(directory)
+        self.draw(out, f"{len(self.dirs):,} directories")
+
+        while True:
+            deadline = time.monotonic() + interval
+            dirty = set()
+            # 이벤트가 몰려도 interval 동안 모아서 디렉토리마다 한 번만 다시 읽는다
+            while True:
+                changed = self.watcher.wait(max(deadline - time.monotonic(), 0))
+                if changed is None:
+                    dirty = None
+                    break
+                dirty |= changed
+                if time.monotonic() >= deadline:
+                    break
+
+            if dirty is None:
+                # 이벤트를 놓쳤으므로 처음부터 다시 스캔한다
+                self.scan(directory)
+                self.draw(out, "rescanned")
+            elif dirty:
+                refreshed = self.update(dirty)
+                if refreshed:
+                    self.draw(out, f"{refreshed:,} directories refreshed")
+
+    def draw(self, out, status):
+        if out.isatty():
+            out.write("\x1b[H\x1b[2J")
+        renderer = TextRenderer(out, files_first=self.scanner.options.files_first)
+        render(self.scanner.entries(self.root), [renderer])
+        out.write(
+            f"\n{time.strftime('%H:%M:%S')} {status}, watching with {self.watcher.kind}\n"
+        )
+        out.flush()
 
 
 if __name__ == "__main__":
@@ -191,23 +1690,379 @@ if __name__ == "__main__":
         default=False,
     )
 
+    # 하위 디렉토리를 N개의 스레드로 동시에 읽는 옵션. 네트워크 파일시스템에서 유용
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        help="Scan directories with N threads",
+        default=1,
+    )
+
+    # 최상위 하위 디렉토리들을 N개의 프로세스로 나눠서 스캔하는 옵션. 로컬 NVMe에서 유용
+    parser.add_argument(
+        "-p",
+        "--processes",
+        type=int,
+        help="Scan top-level subdirectories in N processes (needs --count-links)",
+        default=1,
+    )
+
+    # 스캔 결과를 저장해 두고, 다음 실행에서는 mtime이 바뀐 디렉토리만 다시 읽는 옵션
+    parser.add_argument(
+        "--index",
+        help="Reuse and update a scan index file (SQLite). Directories whose mtime is unchanged are not re-read, so a file that grew in place keeps its old size. Needs --count-links",
+        default=None,
+    )
+
+    # 텍스트 트리 대신 JSON(중첩), NDJSON(한 줄에 레코드 하나), HTML로 출력하는 옵션
+    parser.add_argument(
+        "--format",
+        choices=["text", "json", "ndjson", "html"],
+        help="Output format",
+        default="text",
+    )
+
+    # 같은 스캔 결과를 다른 형식으로 파일에도 쓰는 옵션. 여러 번 줄 수 있다
+    parser.add_argument(
+        "-o",
+        "--output",
+        action="append",
+        metavar="FORMAT=PATH",
+        help="Also write the tree as FORMAT (text, json or html) to PATH",
+        default=[],
+    )
+
+    # 파일을 모두 stat하지 않고 디렉토리마다 표본만 stat해서 크기를 추정하는 옵션
+    parser.add_argument(
+        "--estimate",
+        action="store_true",
+        help="Estimate sizes from a random sample of files in each directory",
+        default=False,
+    )
+    parser.add_argument(
+        "--sample-size",
+        type=int,
+        help="With --estimate, files to stat per directory (default: 100)",
+        default=100,
+    )
+    parser.add_argument(
+        "--time-budget",
+        type=float,
+        help="With --estimate, seconds to spend on stat per directory (default: 1.0)",
+        default=1.0,
+    )
+
+    # 가장 큰 디렉토리와 파일 N개씩을 트리 다음에 출력하는 옵션
+    parser.add_argument(
+        "--top",
+        type=int,
+        metavar="N",
+        help="Also list the N largest directories and files",
+        default=0,
+    )
+
+    # 확장자별, 크기 구간별 파일 수와 크기를 같은 스캔에서 집계하는 옵션
+    parser.add_argument(
+        "--histogram",
+        action="store_true",
+        help="Break down files by extension and size bucket (per directory in json/ndjson)",
+        default=False,
+    )
+
+    # 디렉토리별 크기와 파일 수를 스냅샷 파일로 저장하는 옵션
+    parser.add_argument(
+        "--snapshot",
+        metavar="PATH",
+        help="Save directory sizes and file counts to a snapshot file",
+        default=None,
+    )
+
+    # 저장된 스냅샷과 비교해서 크기나 파일 수가 바뀐 디렉토리만 출력하는 옵션
+    parser.add_argument(
+        "--diff",
+        metavar="SNAPSHOT",
+        help="Print only directories that changed since SNAPSHOT",
+        default=None,
+    )
+
+    # 패턴에 맞는 파일과 디렉토리를 읽지도, 크기에 더하지도 않는 옵션. 여러 번 줄 수 있다
+    parser.add_argument(
+        "--exclude",
+        action="append",
+        metavar="PATTERN",
+        help="Skip files and directories matching a .gitignore-style PATTERN (repeatable)",
+        default=[],
+    )
+    parser.add_argument(
+        "--gitignore",
+        action="store_true",
+        help="Also skip what .gitignore files exclude",
+        default=False,
+    )
+    parser.add_argument(
+        "--no-default-excludes",
+        action="store_true",
+        help="Don't skip .git, node_modules, venv etc. and ignore .treeviewignore files",
+        default=False,
+    )
+
+    # 다른 파일시스템이 마운트된 디렉토리로 내려가지 않는 옵션
+    parser.add_argument(
+        "-x",
+        "--one-file-system",
+        action="store_true",
+        help="Stay on the file system of the directory (skip mount points)",
+        default=False,
+    )
+
+    # 파일 크기 대신 디스크에 실제로 할당된 크기를 세는 옵션
+    parser.add_argument(
+        "--allocated",
+        action="store_true",
+        help="Report allocated disk usage (st_blocks) instead of apparent sizes",
+        default=False,
+    )
+
+    # 하드 링크를 링크마다 세는 옵션. 기본은 du처럼 한 번만 센다
+    parser.add_argument(
+        "--count-links",
+        action="store_true",
+        help="Count hard-linked files once per link instead of once",
+        default=False,
+    )
+
+    # 스캔한 뒤 변경을 감시하면서 트리를 다시 출력하는 옵션
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Keep watching the directory and redraw the tree when it changes (needs --count-links)",
+        default=False,
+    )
+    parser.add_argument(
+        "--interval",
+        type=float,
+        help="With --watch, minimum seconds between redraws (default: 1.0)",
+        default=1.0,
+    )
+
+    # 스캔하지 않고 상주 서버(treeviewd.py)에 묻는 옵션
+    parser.add_argument(
+        "--server",
+        metavar="ADDRESS",
+        nargs="?",
+        const=default_address(),
+        help="Ask a running treeviewd (Unix socket path or HOST:PORT) instead of scanning here",
+        default=None,
+    )
+
+    # 단계별 시간과 호출 횟수를 stderr로 출력하는 옵션
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="Print per-phase timings and counters to stderr",
+        default=False,
+    )
+
     args = parser.parse_args()
 
-    DIRS_ONLY = args.d
-    LEVEL = args.level
-    if args.max_files < 0:
-        MAX_FILES = 1000000  # 100만개로 제한
-    else:
-        MAX_FILES = args.max_files
+    outputs = []
+    for output in args.output:
+        output_format, _, path = output.partition("=")
+        if output_format not in RENDERERS or not path:
+            parser.error(f"invalid --output {output!r}, expected FORMAT=PATH")
+        outputs.append((output_format, path))
+    if args.format == "ndjson":
+        # NDJSON은 스캔 중에 출력한 노드를 놓아 주므로 스캔이 끝나면 트리가 남지 않는다
+        for option, value in [
+            ("--output", outputs),
+            ("--snapshot", args.snapshot),
+            ("--diff", args.diff),
+        ]:
+            if value:
+                parser.error(f"{option} can't be combined with --format ndjson")
+
+    if args.estimate and args.index:
+        parser.error("--estimate can't be combined with --index")
+    if args.top and args.index:
+        # 인덱스에서 재사용한 디렉토리는 파일별 크기를 다시 읽지 않는다
+        parser.error("--top can't be combined with --index")
+    if args.index and (args.exclude or args.gitignore or args.no_default_excludes):
+        # 인덱스에 저장된 목록은 저장할 때의 규칙을 적용한 것이다
+        parser.error(
+            "--exclude, --gitignore and --no-default-excludes can't be combined with --index"
+        )
+    if args.index and (args.one_file_system or args.allocated):
+        parser.error("--one-file-system and --allocated can't be combined with --index")
+    if args.histogram and (args.index or args.estimate):
+        # 인덱스에서 재사용하거나 표본만 stat한 디렉토리는 파일별 크기를 모른다
+        parser.error("--histogram can't be combined with --index or --estimate")
+    if args.index and not args.count_links:
+        # 재사용한 디렉토리의 하드 링크는 다른 디렉토리에서 이미 셌는지 알 수 없다
+        parser.error(
+            "--index needs --count-links (hard links in reused directories can't be counted once)"
+        )
+    if args.processes > 1 and not args.count_links:
+        # 프로세스마다 따로 세면 다른 최상위 디렉토리에 걸친 하드 링크를 두 번 센다
+        parser.error(
+            "--processes needs --count-links (hard links can't be counted once across processes)"
+        )
+    if args.processes > 1:
+        for option, value in [
+            ("--index", args.index),
+            ("--stats", args.stats),
+            ("--format ndjson", args.format == "ndjson"),
+        ]:
+            if value:
+                parser.error(f"--processes can't be combined with {option}")
+    if args.watch and not args.count_links:
+        # 디렉토리 하나씩 다시 읽어서는 다른 디렉토리에 있는 링크를 이미 셌는지 알 수 없다
+        parser.error(
+            "--watch needs --count-links (hard links can't be counted once when directories are re-read one at a time)"
+        )
+    if args.watch:
+        # 디렉토리 하나만 다시 읽어서는 갱신할 수 없는 집계와, 한 번만 쓰는 출력
+        for option, value in [
+            ("--format " + args.format, args.format != "text"),
+            ("--output", outputs),
+            ("--processes", args.processes > 1),
+            ("--index", args.index),
+            ("--estimate", args.estimate),
+            ("--top", args.top),
+            ("--histogram", args.histogram),
+            ("--snapshot", args.snapshot),
+            ("--diff", args.diff),
+            ("--stats", args.stats),
+        ]:
+            if value:
+                parser.error(f"--watch can't be combined with {option}")
+    if args.server:
+        # 서버는 캐시한 트리의 출력만 바꿔서 답한다
+        for option, value in [
+            ("--format ndjson", args.format == "ndjson"),
+            ("--output", outputs),
+            ("--index", args.index),
+            ("--estimate", args.estimate),
+            ("--top", args.top),
+            ("--histogram", args.histogram),
+            ("--snapshot", args.snapshot),
+            ("--diff", args.diff),
+            ("--watch", args.watch),
+            ("--stats", args.stats),
+        ]:
+            if value:
+                parser.error(f"--server can't be combined with {option}")
+    if args.interval <= 0:
+        parser.error("--interval must be positive")
+    if args.sample_size < 2:
+        parser.error("--sample-size must be at least 2")
 
-    PRINT_FILES_FIRST = args.files_first
+    options = ScanOptions(
+        dirs_only=args.d,
+        level=args.level,
+        # 100만개로 제한
+        max_files=1000000 if args.max_files < 0 else args.max_files,
+        files_first=args.files_first,
+        jobs=args.jobs,
+        with_mtime=any(
+            output_format != "text"
+            for output_format in [args.format] + [output[0] for output in outputs]
+        ),
+        sample_size=args.sample_size if args.estimate else 0,
+        time_budget=args.time_budget,
+        with_histogram=args.histogram,
+        processes=args.processes,
+        excludes=args.exclude,
+        default_excludes=not args.no_default_excludes,
+        gitignore=args.gitignore,
+        one_file_system=args.one_file_system,
+        allocated=args.allocated,
+        count_links=args.count_links,
+    )
+
+    if args.server:
+        params = [
+            ("path", os.path.abspath(args.directory)),
+            ("directory", args.directory),
+            ("format", args.format),
+            ("level", options.level),
+            ("max_files", options.max_files),
+        ]
+        for name, value in [
+            ("dirs_only", options.dirs_only),
+            ("files_first", options.files_first),
+            ("gitignore", options.gitignore),
+            ("no_default_excludes", not options.default_excludes),
+            ("one_file_system", options.one_file_system),
+            ("allocated", options.allocated),
+            ("count_links", options.count_links),
+        ]:
+            if value:
+                params.append((name, "1"))
+        params.extend(("exclude", pattern) for pattern in options.excludes)
+        run_client(args.server, "/tree", params)
 
     # check if the directory exists
     if not os.path.isdir(args.directory):
         print("The directory does not exists.")
         sys.exit
 
-    tree = Tree()
-    tree.walk(args.directory)
+    index = ScanIndex(args.index) if args.index else None
+    stats = ScanStats() if args.stats else None
+    top = TopN(args.top) if args.top > 0 else None
+
+    if args.watch:
+        watcher = TreeWatcher(Scanner(options), make_watcher())
+        try:
+            watcher.run(args.directory, args.interval)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            watcher.watcher.close()
+        sys.exit(0)
+
+    if args.format == "ndjson":
+        exporter = NdjsonWriter(sys.stdout)
+        root = Scanner(
+            options, index=index, stats=stats, on_dir_done=exporter.write_dir, top=top
+        ).scan(args.directory)
+    else:
+        scanner = Scanner(options, index=index, stats=stats, top=top)
+        root = scanner.scan(args.directory)
+
+        with contextlib.ExitStack() as files:
+            if args.diff:
+                # 바뀐 디렉토리는 --format 대신 텍스트 트리로 출력한다
+                print_diff(args.diff, root, root_name=root.name)
+                renderers = []
+            else:
+                renderers = [make_renderer(args.format, sys.stdout, options, stats)]
+            for output_format, path in outputs:
+                out = files.enter_context(open(path, "w", encoding="utf-8"))
+                renderers.append(make_renderer(output_format, out, options))
+
+            started = time.perf_counter()
+            render(scanner.entries(root), renderers)
+            if stats is not None:
+                stats.add("render", time.perf_counter() - started)
+
+        # --diff와 같은 파일이어도 되도록 비교가 끝난 뒤에 쓴다
+        if args.snapshot:
+            write_snapshot(
+                root, args.snapshot, source=os.path.abspath(args.directory)
+            )
+
+    # 텍스트 트리가 아니면 stdout은 JSON 등으로 파싱할 수 있게 남겨 둔다
+    report_out = sys.stdout if args.format == "text" else sys.stderr
+    if top is not None:
+        top.report(report_out)
+    if root.histogram is not None:
+        root.histogram.report(report_out)
+
+    if index is not None:
+        index.close()
+
+    if stats is not None:
+        stats.report()
 
     # print("\n" + tree.summary())
@@ -1,14 +1,8 @@
 import functools
 import typing
 
-import boto3
 import hyperlink
 
-from botocore import UNSIGNED
-from botocore.config import Config
-
-from botocore.handlers import disable_signing
-
 ACCOUNT_NAMES = {
     "760097843905": "platform",
     "299497370133": "workflow",
@@ -18,6 +12,10 @@ ACCOUNT_NAMES = {
 
 @functools.cache
 def get_aws_session(*, role_arn):
+    # boto3 is slow to import, so it's only imported when we need a
+    # client -- the thin ``s3tree --server`` client never does.
+    import boto3
+
     # sts_client = boto3.client("s3", config=Config(signature_version=UNSIGNED))
     sts_client = boto3.client("sts")
     assumed_role_object = sts_client.assume_role(
@@ -33,9 +31,6 @@ def get_aws_session(*, role_arn):
 
 
 def guess_account(s3_identifier, role_name):
-    resource = boto3.resource("s3")
-    resource.meta.client.meta.events.register("choose-signer.s3.*", disable_signing)
-
     """
     Given the name of an S3 bucket, guess the account it belongs to.
 
@@ -73,6 +68,8 @@ def guess_account(s3_identifier, role_name):
 
 
 def create_s3_session(s3_identifier, *, role_name="read_only"):
+    import boto3
+
     account = guess_account(s3_identifier, role_name)
     if account:
         return get_aws_session(role_arn=account["role_arn"])
@@ -80,6 +77,109 @@ def create_s3_session(s3_identifier, *, role_name="read_only"):
         return boto3.Session()
 
 
+def s3_client_config(config_class, *, unsigned, max_pool_connections, max_attempts):
+    from botocore import UNSIGNED
+
+    # "adaptive" retries back off on SlowDown and other throttling errors,
+    # and also rate-limit the client itself once it starts seeing them, so
+    # many concurrent LIST streams slow down together instead of failing.
+    config = config_class(
+        max_pool_connections=max_pool_connections,
+        retries={"mode": "adaptive", "max_attempts": max_attempts},
+    )
+
+    if unsigned:
+        config = config.merge(config_class(signature_version=UNSIGNED))
+
+    return config
+
+
+def create_s3_client(
+    s3_identifier,
+    *,
+    unsigned=False,
+    max_pool_connections=10,
+    max_attempts=10,
+    endpoint_url=None,
+):
+    """
+    Create the S3 client used for the whole run.
+
+    With ``unsigned=True`` requests are sent without credentials, which
+    is how you read public buckets (and skips the assume-role dance).
+    ``endpoint_url`` points the client at an S3-compatible server, e.g.
+    MinIO or ``moto_server``.
+    """
+    import boto3
+    from botocore.config import Config
+
+    config = s3_client_config(
+        Config,
+        unsigned=unsigned,
+        max_pool_connections=max_pool_connections,
+        max_attempts=max_attempts,
+    )
+
+    if unsigned:
+        return boto3.client("s3", config=config, endpoint_url=endpoint_url)
+
+    sess = create_s3_session(s3_identifier)
+    return sess.client("s3", config=config, endpoint_url=endpoint_url)
+
+
+def create_async_s3_client(
+    s3_identifier,
+    *,
+    unsigned=False,
+    max_pool_connections=10,
+    max_attempts=10,
+    endpoint_url=None,
+):
+    """
+    Create an aiobotocore S3 client with the same settings as
+    ``create_s3_client``.  Use it with ``async with``.
+
+    aiobotocore is an optional dependency, so it's only imported here.
+    The credentials come from the same boto3 session, so the assumed
+    role is the same as for the synchronous client.
+    """
+    from aiobotocore.config import AioConfig
+    from aiobotocore.session import get_session
+
+    config = s3_client_config(
+        AioConfig,
+        unsigned=unsigned,
+        max_pool_connections=max_pool_connections,
+        max_attempts=max_attempts,
+    )
+
+    if unsigned:
+        return get_session().create_client(
+            "s3", config=config, endpoint_url=endpoint_url
+        )
+
+    sess = create_s3_session(s3_identifier)
+    credentials = sess.get_credentials()
+    if credentials is None:
+        return get_session().create_client(
+            "s3",
+            region_name=sess.region_name,
+            config=config,
+            endpoint_url=endpoint_url,
+        )
+
+    credentials = credentials.get_frozen_credentials()
+    return get_session().create_client(
+        "s3",
+        region_name=sess.region_name,
+        aws_access_key_id=credentials.access_key,
+        aws_secret_access_key=credentials.secret_key,
+        aws_session_token=credentials.token,
+        config=config,
+        endpoint_url=endpoint_url,
+    )
+
+
 class S3Uri(typing.TypedDict):
     Bucket: str
     Path: str
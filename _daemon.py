@@ -0,0 +1,94 @@
+import os
+import sys
+import socket
+import tempfile
+import http.client
+import urllib.parse
+
+"""
+treeviewd(상주 서버)와 thin client(Main.py --server, s3tree.py --server) 사이의 공통 부분.
+
+프로토콜은 HTTP GET 하나다. 쿼리 문자열로 경로와 옵션을 보내면 서버는 출력할 내용을
+그대로 본문으로 돌려주고, 클라이언트의 종료 코드는 X-Exit-Status 헤더로 알려 준다.
+주소는 Unix 소켓 경로이거나, 로컬 TCP면 "http://127.0.0.1:8765" 또는 "127.0.0.1:8765".
+"""
+
+EXIT_STATUS_HEADER = "X-Exit-Status"
+
+
+def default_address():
+    """
+    기본 Unix 소켓 경로. XDG_RUNTIME_DIR(사용자 전용)이 있으면 거기에, 없으면 임시 디렉토리에
+    사용자 id를 붙여 만든다.
+    """
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        return os.path.join(runtime_dir, "treeviewd.sock")
+    uid = os.getuid() if hasattr(os, "getuid") else os.getlogin()
+    return os.path.join(tempfile.gettempdir(), f"treeviewd-{uid}.sock")
+
+
+def parse_address(address):
+    """
+    주소를 ("unix", 경로) 또는 ("tcp", (호스트, 포트))로 바꾼다.
+    """
+    if address.startswith("http://"):
+        address = urllib.parse.urlsplit(address).netloc
+    elif "/" in address or not address.rpartition(":")[2].isdigit():
+        return "unix", address
+
+    host, _, port = address.rpartition(":")
+    return "tcp", (host or "127.0.0.1", int(port))
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout=None):
+        super().__init__("localhost", timeout=timeout)
+        self.unix_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.unix_path)
+
+
+def request(address, path, params):
+    """
+    서버에 질의하고 (종료 코드, 본문)을 돌려준다. params는 (이름, 값) 목록으로, 같은 이름을
+    여러 번 쓸 수 있다. 서버에 연결할 수 없으면 OSError.
+    """
+    kind, target = parse_address(address)
+    if kind == "unix":
+        conn = UnixHTTPConnection(target)
+    else:
+        conn = http.client.HTTPConnection(*target)
+
+    try:
+        conn.request("GET", f"{path}?{urllib.parse.urlencode(params)}")
+        response = conn.getresponse()
+        body = response.read().decode("utf-8")
+    finally:
+        conn.close()
+
+    status = response.getheader(EXIT_STATUS_HEADER)
+    if status is None:
+        # 서버 오류 등. 본문이 오류 메시지다
+        return (0 if response.status == 200 else 1), body
+    return int(status), body
+
+
+def run_client(address, path, params):
+    """
+    thin client의 본체. 결과를 출력하고 서버가 알려 준 종료 코드로 끝낸다.
+    오류 메시지(종료 코드가 0이 아닌 경우의 본문)는 stderr로 쓴다.
+    """
+    try:
+        status, body = request(address, path, params)
+    except OSError as e:
+        sys.exit(f"can't connect to treeviewd at {address}: {e}")
+
+    out = sys.stdout if status == 0 or not body.startswith("error: ") else sys.stderr
+    out.write(body)
+    out.flush()
+    sys.exit(status)
@@ -0,0 +1,225 @@
+import os
+import re
+
+"""
+제외 규칙(--exclude, .gitignore, .treeviewignore).
+
+패턴은 .gitignore 문법을 따른다. '#'으로 시작하는 줄은 주석, '!'는 다시 포함,
+'/'로 끝나면 디렉토리에만 적용, 중간이나 앞에 '/'가 있으면 규칙 파일이 있는 디렉토리
+기준의 경로, 없으면 어느 깊이의 이름이든 맞춘다. '*', '?', '[...]', '**'를 쓸 수 있다.
+
+규칙은 정규식 하나로 컴파일해 두고, 스캔 루트 기준의 상대 경로(디렉토리는 '/'로 끝남)를
+fullmatch 한 번으로 판정한다. 패턴은 뒤의 것이 우선이므로 역순으로 이어 붙이고,
+맞은 그룹 번호로 '!' 패턴인지 확인한다.
+제외된 디렉토리는 scandir 단계에서 버리므로 그 아래는 읽지도, 크기에 더하지도 않는다.
+"""
+
+# 예전에 코드에 박혀 있던 제외 목록
+DEFAULT_EXCLUDES = (
+    "__MACOSX/",
+    "venv/",
+    ".git/",
+    ".idea/",
+    "node_modules/",
+    ".DS_Store",
+    "_.DS_Store",
+)
+
+TREEVIEW_IGNORE = ".treeviewignore"
+GITIGNORE = ".gitignore"
+
+
+def translate_segment(segment):
+    """
+    '/'가 없는 패턴 조각 하나를 정규식으로 바꾼다.
+    """
+    result = []
+    i = 0
+    while i < len(segment):
+        char = segment[i]
+        i += 1
+        if char == "*":
+            result.append("[^/]*")
+        elif char == "?":
+            result.append("[^/]")
+        elif char == "\\" and i < len(segment):
+            result.append(re.escape(segment[i]))
+            i += 1
+        elif char == "[":
+            end = segment.find("]", i + 1)
+            if end < 0:
+                result.append(re.escape(char))
+                continue
+            chars = segment[i:end].replace("\\", "\\\\")
+            if chars[0] in "!^":
+                chars = "^" + chars[1:]
+            result.append(f"[{chars}]")
+            i = end + 1
+        else:
+            result.append(re.escape(char))
+    return "".join(result)
+
+
+def translate(pattern, base=""):
+    """
+    패턴 한 줄을 (정규식, '!' 패턴인지)로 바꾼다. 빈 줄과 주석이면 None.
+
+    base는 패턴이 나온 디렉토리의 상대 경로로, 루트면 "", 아니면 '/'로 끝난다.
+    """
+    if pattern.endswith("\n"):
+        pattern = pattern[:-1]
+    # 끝의 공백은 '\'로 감싸지 않았으면 무시한다
+    stripped = pattern.rstrip(" ")
+    if stripped.endswith("\\") and len(stripped) < len(pattern):
+        stripped += " "
+    pattern = stripped
+
+    if not pattern or pattern.startswith("#"):
+        return None
+
+    # 앞의 "\#", "\!"는 주석이나 '!' 패턴이 아니고, 그 문자 그대로다 (translate_segment가 처리)
+    negated = pattern.startswith("!")
+    if negated:
+        pattern = pattern[1:]
+
+    dir_only = pattern.endswith("/")
+    pattern = pattern.rstrip("/")
+    if not pattern:
+        return None
+
+    anchored = "/" in pattern
+    parts = pattern.lstrip("/").split("/")
+
+    regex = [re.escape(base)]
+    if not anchored:
+        regex.append("(?:.*/)?")
+    for i, part in enumerate(parts):
+        last = i == len(parts) - 1
+        if part == "**":
+            # 끝의 "/**"는 그 안의 모든 것이고 디렉토리 자신은 아니다 (git과 같음)
+            regex.append(".+" if last else "(?:.*/)?")
+        else:
+            regex.append(translate_segment(part) + ("" if last else "/"))
+    # 디렉토리의 경로는 '/'로 끝나므로, 디렉토리 전용 패턴은 '/'까지 맞아야 한다
+    regex.append("/" if dir_only else "/?")
+
+    return "".join(regex), negated
+
+
+class IgnoreRules:
+    """
+    컴파일된 제외 규칙. 스캔 루트(root)마다 하나를 만들고, 규칙 파일이 있는 디렉토리에서는
+    for_directory()가 그 규칙을 더한 새 IgnoreRules를 돌려준다. 규칙 파일이 없는 디렉토리는
+    부모의 것을 그대로 쓰므로 규칙은 파일마다 한 번만 컴파일된다.
+
+    pickle할 수 있으므로 --processes의 작업 프로세스에도 넘길 수 있다.
+    """
+
+    __slots__ = ("root", "rules", "ignore_files", "regex", "negated")
+
+    def __init__(self, root="", rules=(), ignore_files=()):
+        self.root = root
+        self.rules = list(rules)  # (정규식, '!' 패턴인지), 나온 순서
+        self.ignore_files = tuple(ignore_files)  # 디렉토리마다 읽을 규칙 파일 이름
+
+        if self.rules:
+            # 뒤의 패턴이 우선이므로 역순으로 이어 붙여 처음 맞는 그룹이 마지막 패턴이 되게 한다
+            self.regex = re.compile(
+                "|".join(f"({regex})" for regex, _ in reversed(self.rules)), re.DOTALL
+            )
+            self.negated = [negated for _, negated in reversed(self.rules)]
+        else:
+            self.regex = None
+            self.negated = []
+
+    @classmethod
+    def load(cls, root, *, patterns=(), defaults=True, gitignore=False):
+        """
+        기본 제외 목록, --exclude 패턴 순으로 규칙을 만든다. 규칙 파일은 for_directory()가 읽는다.
+        """
+        ignore_files = [TREEVIEW_IGNORE] if defaults else []
+        if gitignore:
+            ignore_files.insert(0, GITIGNORE)
+
+        rules = cls(root, ignore_files=ignore_files)
+        return rules.extend((DEFAULT_EXCLUDES if defaults else ()) + tuple(patterns))
+
+    def extend(self, patterns, base=""):
+        rules = list(self.rules)
+        for pattern in patterns:
+            rule = translate(pattern, base)
+            if rule is not None:
+                rules.append(rule)
+
+        if len(rules) == len(self.rules):
+            return self
+        return IgnoreRules(self.root, rules, self.ignore_files)
+
+    def relative(self, directory):
+        """
+        스캔 루트 기준의 상대 경로. 루트면 "", 아니면 '/'로 끝난다.
+        """
+        rel = directory[len(self.root) :].lstrip(os.sep)
+        if not rel:
+            return ""
+        if os.sep != "/":
+            rel = rel.replace(os.sep, "/")
+        return rel + "/"
+
+    def for_directory(self, directory, names=None):
+        """
+        directory에 규칙 파일이 있으면 그 규칙을 더한 IgnoreRules, 없으면 self.
+
+        names는 directory에 있는 것으로 알고 있는 규칙 파일 이름들이다. 주면 그것만 열고,
+        주지 않으면 ignore_files를 모두 열어 본다 (없는 파일마다 실패하는 시스템 콜이 하나씩 든다).
+        """
+        rules = self
+        for name in self.ignore_files:
+            if names is not None and name not in names:
+                continue
+            try:
+                with open(os.path.join(directory, name), encoding="utf-8") as f:
+                    lines = f.readlines()
+            except (FileNotFoundError, NotADirectoryError, UnicodeDecodeError):
+                continue
+            rules = rules.extend(lines, self.relative(directory))
+        return rules
+
+    def match(self, path, is_dir=False):
+        """
+        상대 경로 path가 제외 대상인지. 디렉토리면 is_dir을 준다.
+        """
+        if self.regex is None:
+            return False
+
+        m = self.regex.fullmatch(path + "/" if is_dir else path)
+        return m is not None and not self.negated[m.lastindex - 1]
+
+    def key_matcher(self):
+        """
+        S3 키용 판정 함수. 키의 '폴더'는 디렉토리로, 마지막 이름은 파일로 맞추며,
+        제외된 폴더 아래의 키는 모두 제외한다. 목록은 키 순서로 오므로 폴더별 판정을 캐시한다.
+        """
+        folders = {"": False}
+
+        def folder_excluded(folder):
+            # 캐시에 있는 가장 가까운 조상까지 올라간 뒤 내려오면서 판정한다 (깊은 키에도 재귀 없이)
+            pending = []
+            while folder not in folders:
+                pending.append(folder)
+                folder = folder.rpartition("/")[0]
+
+            excluded = folders[folder]
+            for folder in reversed(pending):
+                excluded = excluded or self.match(folder, is_dir=True)
+                folders[folder] = excluded
+            return excluded
+
+        def is_excluded(key):
+            folder, _, name = key.rpartition("/")
+            if folder_excluded(folder):
+                return True
+            # 콘솔이 만든 빈 "폴더" 객체(키가 '/'로 끝남)는 폴더로 판정한 것으로 충분하다
+            return bool(name) and self.match(key)
+
+        return is_excluded
@@ -0,0 +1,244 @@
+"""
+Read S3 Inventory reports from local files, for ``s3tree --inventory``.
+
+An inventory report is a ``manifest.json`` plus a set of data files
+(CSV.gz or Parquet) listing every object in the source bucket.  For a
+bucket with hundreds of millions of keys, reading a downloaded report is
+much faster and cheaper than LISTing it.
+
+``iter_inventory_objects()`` streams ``(key, size, last_modified)``
+tuples one data file at a time -- CSV line by line, Parquet in record
+batches -- so the report is never held in memory, and the tuples can go
+straight into ``s3tree.S3TreeBuilder``.
+
+Parquet needs pyarrow, which is an optional dependency and only imported
+when a Parquet file is read.
+"""
+
+import csv
+import datetime
+import gzip
+import json
+import os
+import urllib.parse
+
+# Columns in the Parquet schema, which are fixed by S3
+PARQUET_COLUMNS = ["key", "size", "last_modified_date"]
+PARQUET_VERSION_COLUMNS = ["is_latest", "is_delete_marker"]
+
+DATA_SUFFIXES = (".csv.gz", ".csv", ".parquet")
+
+
+class InventoryError(ValueError):
+    pass
+
+
+def find_manifest(path):
+    """
+    Find the manifest for ``path``, which is either a manifest.json, a
+    directory containing one, or an inventory configuration directory
+    with one dated folder per report -- then the latest report is used.
+
+    Returns None if ``path`` is a directory of data files without a
+    manifest.
+    """
+    if not os.path.isdir(path):
+        return path
+
+    manifest_path = os.path.join(path, "manifest.json")
+    if os.path.exists(manifest_path):
+        return manifest_path
+
+    # The report folders are named by date, e.g. 2024-01-01T01-00Z, so
+    # the last one in name order is the latest.
+    for name in sorted(os.listdir(path), reverse=True):
+        manifest_path = os.path.join(path, name, "manifest.json")
+        if os.path.exists(manifest_path):
+            return manifest_path
+
+    return None
+
+
+def resolve_data_file(manifest_dir, key):
+    """
+    Find the local copy of a data file listed in the manifest.
+
+    The manifest lists the keys of the data files in the destination
+    bucket, e.g. ``prefix/source-bucket/config-id/data/<uuid>.csv.gz``,
+    and the manifest itself sits in a dated folder next to ``data/``.
+    We try the key relative to the manifest's folder and its parents,
+    dropping leading components until one exists, so it works whether
+    the whole destination prefix or only the configuration was
+    downloaded.
+    """
+    parts = key.split("/")
+    bases = [manifest_dir]
+    for _ in range(2):
+        bases.append(os.path.dirname(bases[-1]))
+
+    for i in range(len(parts)):
+        for base in bases:
+            candidate = os.path.join(base, *parts[i:])
+            if os.path.isfile(candidate):
+                return candidate
+
+    raise InventoryError(f"can't find inventory data file {key!r} near {manifest_dir}")
+
+
+def read_inventory(path):
+    """
+    Return ``(manifest, data_files)`` for an inventory at ``path``.
+
+    Without a manifest, ``manifest`` is None and ``data_files`` are the
+    data files in the directory, in name order.
+    """
+    manifest_path = find_manifest(path)
+
+    if manifest_path is None:
+        data_files = [
+            os.path.join(path, name)
+            for name in sorted(os.listdir(path))
+            if name.endswith(DATA_SUFFIXES)
+        ]
+        if not data_files:
+            raise InventoryError(f"no manifest.json or inventory data files in {path}")
+        return None, data_files
+
+    with open(manifest_path, encoding="utf-8") as f:
+        manifest = json.load(f)
+
+    file_format = manifest.get("fileFormat", "CSV")
+    if file_format not in ("CSV", "Parquet"):
+        raise InventoryError(f"unsupported inventory format: {file_format}")
+
+    manifest_dir = os.path.dirname(os.path.abspath(manifest_path))
+    data_files = [
+        resolve_data_file(manifest_dir, data_file["key"])
+        for data_file in manifest.get("files", [])
+    ]
+    return manifest, data_files
+
+
+def parse_last_modified(value):
+    # e.g. 2024-01-01T12:00:00.000Z; fromisoformat() only accepts "Z"
+    # from Python 3.11
+    if value.endswith("Z"):
+        value = value[:-1] + "+00:00"
+    return datetime.datetime.fromisoformat(value)
+
+
+def iter_csv_objects(path, *, file_schema, Prefix=""):
+    """
+    Stream the objects in one CSV data file.  The files have no header
+    row; the column names come from the manifest's ``fileSchema``.
+    Keys are URL-encoded in CSV reports.
+    """
+    columns = [name.strip() for name in file_schema.split(",")]
+    try:
+        key_column = columns.index("Key")
+        size_column = columns.index("Size")
+        last_modified_column = columns.index("LastModifiedDate")
+    except ValueError:
+        raise InventoryError(
+            "the inventory needs the Key, Size and LastModifiedDate fields"
+        ) from None
+
+    # Versioned reports have a row per version; only count the current
+    # versions, like a LIST would.
+    is_latest_column = columns.index("IsLatest") if "IsLatest" in columns else None
+    is_delete_marker_column = (
+        columns.index("IsDeleteMarker") if "IsDeleteMarker" in columns else None
+    )
+
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8", newline="") as f:
+        for row in csv.reader(f):
+            if is_latest_column is not None and row[is_latest_column] != "true":
+                continue
+            if (
+                is_delete_marker_column is not None
+                and row[is_delete_marker_column] == "true"
+            ):
+                continue
+
+            key = urllib.parse.unquote_plus(row[key_column])
+            if not key.startswith(Prefix):
+                continue
+
+            yield (
+                key,
+                int(row[size_column] or 0),
+                parse_last_modified(row[last_modified_column]),
+            )
+
+
+def iter_parquet_objects(path, *, Prefix="", batch_size=65536):
+    """
+    Stream the objects in one Parquet data file, a record batch at a
+    time.  Only the columns we need are read, and the filtering and
+    conversions are done on whole columns with pyarrow.compute before
+    anything becomes a Python object.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+
+    parquet_file = pq.ParquetFile(path)
+    names = parquet_file.schema_arrow.names
+    columns = PARQUET_COLUMNS + [
+        name for name in PARQUET_VERSION_COLUMNS if name in names
+    ]
+    utc = pa.timestamp("ms", tz="UTC")
+
+    for batch in parquet_file.iter_batches(batch_size=batch_size, columns=columns):
+        keys = batch.column("key")
+        mask = pc.starts_with(keys, Prefix) if Prefix else None
+
+        if "is_latest" in columns:
+            is_latest = pc.fill_null(batch.column("is_latest"), False)
+            mask = is_latest if mask is None else pc.and_(mask, is_latest)
+        if "is_delete_marker" in columns:
+            is_live = pc.invert(pc.fill_null(batch.column("is_delete_marker"), False))
+            mask = is_live if mask is None else pc.and_(mask, is_live)
+
+        if mask is not None:
+            batch = batch.filter(mask)
+            keys = batch.column("key")
+
+        # The timestamps are stored without a time zone but are UTC
+        sizes = pc.fill_null(batch.column("size"), 0)
+        last_modified = batch.column("last_modified_date").cast(utc)
+
+        yield from zip(keys.to_pylist(), sizes.to_pylist(), last_modified.to_pylist())
+
+
+def iter_inventory_objects(path, *, Bucket=None, Prefix=""):
+    """
+    Stream ``(key, size, last_modified)`` for every current object under
+    ``Prefix`` in the inventory at ``path``, one data file at a time.
+    """
+    manifest, data_files = read_inventory(path)
+
+    if manifest is not None and Bucket is not None:
+        source_bucket = manifest.get("sourceBucket")
+        if source_bucket and source_bucket != Bucket:
+            raise InventoryError(
+                f"the inventory is for bucket {source_bucket!r}, not {Bucket!r}"
+            )
+
+    for data_file in data_files:
+        if manifest is None:
+            is_parquet = data_file.endswith(".parquet")
+        else:
+            is_parquet = manifest.get("fileFormat") == "Parquet"
+
+        if is_parquet:
+            yield from iter_parquet_objects(data_file, Prefix=Prefix)
+        elif manifest is None:
+            raise InventoryError(
+                f"{data_file}: CSV inventories need the manifest.json for their columns"
+            )
+        else:
+            yield from iter_csv_objects(
+                data_file, file_schema=manifest["fileSchema"], Prefix=Prefix
+            )
@@ -0,0 +1,343 @@
+import os
+import sys
+import json
+import math
+import html
+import time
+from typing import NamedTuple, Optional
+from wcwidth import wcswidth
+
+"""
+스캐너와 렌더러 사이의 공통 형식.
+
+스캐너(Main.Scanner, s3tree.S3Scanner)는 크기 집계가 끝난 트리를 만들고,
+iter_entries()가 그 트리를 출력 순서(pre-order)의 Entry 스트림으로 펼친다.
+렌더러는 Entry를 하나씩 받아 바로 출력하므로, render()로 스트림 하나를 여러 렌더러에
+흘려 보내면 스캔을 반복하지 않고 여러 형식으로 출력할 수 있다.
+
+트리의 노드는 name, path, size, num_files, mtime, dirs(하위 노드 목록, 출력 순서),
+files((name, size, mtime) 목록, 출력 순서) 속성만 있으면 된다.
+"""
+
+
+def human_readable_size(size):
+    for unit in ["B", "KB", "MB", "GB", "TB"]:
+        if size < 1024:
+            return f"{size:.0f}{unit}"
+        size /= 1024
+
+
+def format_size(entry):
+    """
+    크기를 추정한 항목은 "≈2TB ±40GB"처럼 근사값임을 표시한다.
+    """
+    if entry.size_error:
+        return f"≈{human_readable_size(entry.size)} ±{human_readable_size(entry.size_error)}"
+    return human_readable_size(entry.size)
+
+
+class Entry(NamedTuple):
+    """
+    출력할 디렉토리 또는 파일 하나. 루트의 depth는 0.
+
+    is_last는 형제 중 마지막 항목인지, has_dirs는 출력할 하위 디렉토리가 있는지(디렉토리만).
+    파일의 file_count는 None. size_error는 크기를 추정한 경우 95% 신뢰구간의 반폭으로,
+    정확한 값이면 0. histogram은 노드에 집계된 Histogram이 있으면 그것(디렉토리만).
+    """
+
+    kind: str  # "dir" 또는 "file"
+    name: str
+    path: str
+    depth: int
+    size: int
+    file_count: Optional[int]
+    mtime: Optional[float]
+    is_last: bool
+    has_dirs: bool
+    size_error: float = 0.0
+    histogram: Optional[object] = None
+
+
+# 정규분포에서 95% 신뢰구간의 z 값
+Z_95 = 1.96
+
+
+def dir_entry(node, depth, is_last, name=None):
+    return Entry(
+        "dir",
+        node.name if name is None else name,
+        node.path,
+        depth,
+        node.size,
+        node.num_files,
+        node.mtime,
+        is_last,
+        bool(node.dirs),
+        Z_95 * math.sqrt(getattr(node, "size_var", 0.0)),
+        getattr(node, "histogram", None),
+    )
+
+
+def iter_entries(
+    root, *, max_files=4, dirs_only=False, files_first=False, level=-1, root_name=None
+):
+    """
+    트리를 출력 순서대로 Entry 스트림으로 펼친다.
+
+    재귀 대신 디렉토리별 제너레이터의 스택을 쓰므로 깊은 트리에서도 안전하다.
+    root_name을 주면 루트의 이름 대신 쓴다.
+    """
+
+    def children(node, depth):
+        if level > -1 and depth > level:
+            return
+
+        dirs = [(child, None) for child in node.dirs]
+        files = [] if dirs_only else [(None, file) for file in node.files[:max_files]]
+        entries = files + dirs if files_first else dirs + files
+
+        for index, (child, file) in enumerate(entries):
+            is_last = index == len(entries) - 1
+            if child is not None:
+                yield dir_entry(child, depth, is_last), child
+            else:
+                name, size, mtime = file
+                path = os.path.join(node.path, name)
+                yield Entry(
+                    "file", name, path, depth, size, None, mtime, is_last, False
+                ), None
+
+    yield dir_entry(root, 0, True, root_name)
+    stack = [children(root, 1)]
+
+    while stack:
+        item = next(stack[-1], None)
+        if item is None:
+            stack.pop()
+            continue
+
+        entry, child = item
+        yield entry
+        if child is not None:
+            stack.append(children(child, entry.depth + 1))
+
+
+def render(entries, renderers):
+    """
+    Entry 스트림 하나를 여러 렌더러에 동시에 넘긴다.
+    """
+    for entry in entries:
+        for renderer in renderers:
+            renderer.write(entry)
+
+    for renderer in renderers:
+        renderer.close()
+
+
+class TextRenderer:
+    """
+    박스 문자로 된 텍스트 트리. treeview의 기본 출력.
+
+    stats(Main.ScanStats)를 주면 패딩 계산과 출력에 걸린 시간을 기록한다.
+    """
+
+    def __init__(self, out=None, *, files_first=False, stats=None):
+        self.out = sys.stdout if out is None else out
+        self.files_first = files_first
+        self.stats = stats
+        self.dirCount = 0
+        self.fileCount = 0
+        self.stack = []  # depth별 (자식 항목의 prefix, 출력할 하위 디렉토리가 있는지)
+
+    def register(self, is_dir):
+        if is_dir:
+            self.dirCount += 1
+        else:
+            self.fileCount += 1
+
+    def write(self, entry):
+        is_dir_path = entry.kind == "dir"
+        self.register(is_dir_path)
+
+        if entry.depth == 0:
+            self.stack = [("    ", entry.has_dirs)]
+            self.output(f" {self.format_dir(entry, '', True)}")
+            return
+
+        prefix, dir_entries = self.stack[entry.depth - 1]
+        if is_dir_path:
+            # directory 출력
+            formatted_output = self.format_dir(entry, prefix, False)
+        else:
+            # file 출력
+            emoji = "📄"
+            dir_size_str = f"{human_readable_size(entry.size)}"
+            formatted_output = f"{emoji} {entry.name} [{dir_size_str}]"
+
+        if entry.is_last:
+            if self.files_first and not is_dir_path:
+                self.output(f"{prefix}   {formatted_output}")
+            else:
+                self.output(f"{prefix}└── {formatted_output}")
+            new_prefix = prefix + "    "
+        else:
+            if self.files_first and not is_dir_path:
+                if dir_entries:
+                    self.output(f"{prefix}│   {formatted_output}")
+                else:
+                    self.output(f"{prefix}   {formatted_output}")
+            else:
+                self.output(f"{prefix}├── {formatted_output}")
+            new_prefix = prefix + "│   "
+
+        if is_dir_path:
+            del self.stack[entry.depth :]
+            self.stack.append((new_prefix, entry.has_dirs))
+
+    def close(self):
+        self.out.flush()
+
+    def format_dir(self, entry, prefix, is_root):
+        emoji = "📂"
+        num_files = entry.file_count
+        file_count_str = f" {num_files:,}개의 파일" if num_files > 0 else ""
+        dir_size_str = format_size(entry)
+
+        if self.stats is None:
+            paddding = self.get_padding(prefix, is_root, entry.name)
+        else:
+            started = time.perf_counter()
+            paddding = self.get_padding(prefix, is_root, entry.name)
+            self.stats.add("padding", time.perf_counter() - started)
+
+        return f"{emoji} {entry.name}{' ' * paddding} [{dir_size_str}{file_count_str}]"
+
+    def output(self, line):
+        if self.stats is None:
+            print(line, file=self.out)
+            return
+
+        started = time.perf_counter()
+        print(line, file=self.out)
+        self.stats.add("output", time.perf_counter() - started)
+
+    def get_padding(self, prefix, is_root, directory_title):
+        paddding = 40 - (
+            wcswidth(prefix) + len("" if is_root else "└──") + len(directory_title)
+        )
+
+        return paddding
+
+
+class JsonRenderer:
+    """
+    트리 전체를 중첩된 JSON 객체 하나로 출력한다. 디렉토리의 children에 하위 항목이 들어간다.
+
+    JSON 객체 하나로 쓰려면 끝까지 모아야 하므로 close()에서 출력한다.
+    """
+
+    def __init__(self, out=None):
+        self.out = sys.stdout if out is None else out
+        self.root = None
+        self.stack = []  # depth별 디렉토리 dict
+
+    def write(self, entry):
+        if entry.kind == "dir":
+            record = {
+                "type": "dir",
+                "name": entry.name,
+                "path": entry.path,
+                "size": entry.size,
+                "file_count": entry.file_count,
+                "mtime": entry.mtime,
+                "children": [],
+            }
+            if entry.size_error:
+                record["size_error"] = round(entry.size_error)
+            if entry.histogram is not None:
+                record["histogram"] = entry.histogram.to_dict()
+        else:
+            record = {
+                "type": "file",
+                "name": entry.name,
+                "path": entry.path,
+                "size": entry.size,
+                "mtime": entry.mtime,
+            }
+
+        if entry.depth == 0:
+            self.root = record
+            self.stack = [record]
+            return
+
+        self.stack[entry.depth - 1]["children"].append(record)
+        if entry.kind == "dir":
+            del self.stack[entry.depth :]
+            self.stack.append(record)
+
+    def close(self):
+        json.dump(self.root, self.out, ensure_ascii=False, indent=2)
+        print(file=self.out)
+        self.out.flush()
+
+
+class HtmlRenderer:
+    """
+    중첩된 <ul> 목록으로 된 HTML 문서. 항목이 오는 대로 바로 출력한다.
+    """
+
+    HEAD = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<style>
+ul.tree, ul.tree ul {{ list-style: none; padding-left: 1.5em; }}
+ul.tree .size {{ color: #888; }}
+</style>
+</head>
+<body>
+<ul class="tree">
+"""
+
+    TAIL = """</ul>
+</body>
+</html>
+"""
+
+    def __init__(self, out=None):
+        self.out = sys.stdout if out is None else out
+        self.open_dirs = []  # 아직 </ul>을 쓰지 않은 디렉토리의 depth
+
+    def write(self, entry):
+        if entry.depth == 0:
+            self.out.write(self.HEAD.format(title=html.escape(entry.name)))
+
+        while self.open_dirs and self.open_dirs[-1] >= entry.depth:
+            self.open_dirs.pop()
+            self.out.write("</ul></li>\n")
+
+        name = html.escape(entry.name)
+        size = format_size(entry)
+        if entry.kind == "dir":
+            file_count = f" {entry.file_count:,}개의 파일" if entry.file_count > 0 else ""
+            self.out.write(
+                f'<li>📂 <span class="name" title="{html.escape(entry.path)}">{name}</span>'
+                f' <span class="size">[{size}{file_count}]</span>\n<ul>\n'
+            )
+            self.open_dirs.append(entry.depth)
+        else:
+            self.out.write(
+                f'<li>📄 <span class="name">{name}</span>'
+                f' <span class="size">[{size}]</span></li>\n'
+            )
+
+    def close(self):
+        while self.open_dirs:
+            self.open_dirs.pop()
+            self.out.write("</ul></li>\n")
+        self.out.write(self.TAIL)
+        self.out.flush()
+
+
+RENDERERS = {"text": TextRenderer, "json": JsonRenderer, "html": HtmlRenderer}
@@ -0,0 +1,216 @@
+import json
+from _render import TextRenderer, human_readable_size, iter_entries, render
+
+"""
+스냅샷 저장과 비교(--snapshot, --diff).
+
+스냅샷은 디렉토리마다 한 줄씩 [상대 경로의 구성요소 목록, 크기, 파일 수]를 쓴 NDJSON
+파일로, 첫 줄은 헤더다. S3 키에는 빈 구성요소("a//b")도 있을 수 있으므로 경로를
+문자열로 합치지 않고 목록으로 저장한다. 디렉토리는 경로를 '/'로 나눈 구성요소의 튜플 순서로 정렬되어 있는데,
+이는 하위 디렉토리를 이름순으로 방문하는 pre-order 순서와 같다.
+그래서 저장된 스냅샷과 현재 트리를 각각 스트림으로 읽으면서 병합하듯이 한 번에 비교할 수 있고,
+비교 중에 들고 있는 것은 현재 경로의 조상 목록과 바뀐 디렉토리뿐이다.
+"""
+
+VERSION = 1
+
+
+def iter_dir_records(root):
+    """
+    트리의 디렉토리를 (구성요소 튜플, 크기, 파일 수)로 정렬 순서대로 돌려준다. 루트는 ().
+
+    노드는 _render.iter_entries와 같은 인터페이스(name, size, num_files, dirs)를 쓴다.
+    """
+    yield (), root.size, root.num_files
+    stack = [((), iter(sorted(root.dirs, key=lambda child: child.name)))]
+
+    while stack:
+        parts, children = stack[-1]
+        child = next(children, None)
+        if child is None:
+            stack.pop()
+            continue
+
+        child_parts = parts + (child.name,)
+        yield child_parts, child.size, child.num_files
+        stack.append(
+            (child_parts, iter(sorted(child.dirs, key=lambda node: node.name)))
+        )
+
+
+def write_snapshot(root, path, *, source):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(json.dumps({"snapshot": VERSION, "source": source}) + "\n")
+        for parts, size, num_files in iter_dir_records(root):
+            f.write(json.dumps([parts, size, num_files], ensure_ascii=False))
+            f.write("\n")
+
+
+def read_snapshot(path):
+    """
+    write_snapshot()으로 저장한 파일을 (구성요소 튜플, 크기, 파일 수)로 한 줄씩 읽는다.
+    """
+    with open(path, encoding="utf-8") as f:
+        header = json.loads(f.readline() or "{}")
+        if header.get("snapshot") != VERSION:
+            raise ValueError(f"{path} is not a snapshot file")
+
+        last = None
+        for line in f:
+            parts, size, num_files = json.loads(line)
+            parts = tuple(parts)
+            # 병합 비교는 정렬 순서에 기대므로, 손으로 고친 파일 등은 여기서 걸러낸다
+            if last is not None and parts <= last:
+                raise ValueError(f"{path} is not sorted at {'/'.join(parts)!r}")
+            last = parts
+            yield parts, size, num_files
+
+
+def merge_records(old_records, new_records):
+    """
+    정렬된 두 스트림을 병합해 (경로, 이전 값, 현재 값)을 돌려준다. 한쪽에만 있으면 다른 쪽은 None.
+    """
+    old_records = iter(old_records)
+    new_records = iter(new_records)
+    old = next(old_records, None)
+    new = next(new_records, None)
+
+    while old is not None or new is not None:
+        if new is None or (old is not None and old[0] < new[0]):
+            yield old[0], old[1:], None
+            old = next(old_records, None)
+        elif old is None or new[0] < old[0]:
+            yield new[0], None, new[1:]
+            new = next(new_records, None)
+        else:
+            yield new[0], old[1:], new[1:]
+            old = next(old_records, None)
+            new = next(new_records, None)
+
+
+class DiffNode:
+    """
+    비교 결과 트리의 디렉토리 하나. iter_entries()에 넘길 수 있는 노드 인터페이스를 따른다.
+
+    status는 "added", "removed", "changed", 또는 바뀐 하위 디렉토리를 보여주기 위해 넣은
+    조상이면 None.
+    """
+
+    __slots__ = (
+        "name",
+        "path",
+        "size",
+        "num_files",
+        "old_size",
+        "old_num_files",
+        "status",
+        "attached",
+        "dirs",
+    )
+
+    mtime = None
+    files = ()
+
+    def __init__(self, name, path, old, new):
+        self.name = name
+        self.path = path
+        self.old_size, self.old_num_files = old if old is not None else (0, 0)
+        # 삭제된 디렉토리는 이전 값을 보여준다
+        self.size, self.num_files = new if new is not None else old
+        if old is None:
+            self.status = "added"
+        elif new is None:
+            self.status = "removed"
+        elif tuple(old) != tuple(new):
+            self.status = "changed"
+        else:
+            self.status = None
+        self.attached = False
+        self.dirs = []
+
+    def describe(self):
+        size = human_readable_size(self.size)
+        file_count = f" {self.num_files:,}개의 파일" if self.num_files > 0 else ""
+
+        if self.status == "added":
+            return f"{size}{file_count} 추가"
+        if self.status == "removed":
+            return f"{size}{file_count} 삭제"
+
+        size_delta = self.size - self.old_size
+        if size_delta:
+            sign = "+" if size_delta > 0 else "-"
+            size += f" ({sign}{human_readable_size(abs(size_delta))})"
+
+        count_delta = self.num_files - self.old_num_files
+        if count_delta:
+            file_count = f" {self.num_files:,}개의 파일 ({count_delta:+,})"
+
+        return f"{size}{file_count}"
+
+
+def diff_tree(old_records, new_records, *, root_name):
+    """
+    두 스트림을 병합하면서 크기나 파일 수가 바뀐 디렉토리만 남긴 DiffNode 트리를 만든다.
+
+    바뀐 디렉토리의 조상은 트리 모양을 위해 함께 남긴다. 추가되거나 삭제된 디렉토리의
+    하위 디렉토리는 모두 같은 상태이므로 맨 위의 것만 남긴다.
+    """
+    root = None
+    stack = []  # 현재 경로의 조상 DiffNode, stack[depth]
+
+    for parts, old, new in merge_records(old_records, new_records):
+        depth = len(parts)
+        del stack[depth:]
+        if depth > len(stack):
+            # 부모 없이 나온 경로. 정렬된 스트림이면 일어나지 않는다
+            raise ValueError(f"missing parent directory for {'/'.join(parts)!r}")
+
+        node = DiffNode(parts[-1] if parts else root_name, parts, old, new)
+        stack.append(node)
+
+        if depth == 0:
+            root = node
+            node.attached = True
+            continue
+
+        parent = stack[-2]
+        if parent.status in ("added", "removed") and parent.status == node.status:
+            continue
+        if node.status is None:
+            continue
+
+        for ancestor, child in zip(stack, stack[1:]):
+            if not child.attached:
+                ancestor.dirs.append(child)
+                child.attached = True
+
+    return root
+
+
+class DiffRenderer(TextRenderer):
+    """
+    diff_tree()의 결과를 Tree.walk와 같은 박스 문자 배치로 출력한다. 크기와 파일 수 옆에 변화량을 붙인다.
+    """
+
+    def __init__(self, root, out=None, *, stats=None):
+        super().__init__(out, stats=stats)
+        self.nodes = {}
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            self.nodes[node.path] = node
+            stack.extend(node.dirs)
+
+    def format_dir(self, entry, prefix, is_root):
+        emoji = "📂"
+        paddding = self.get_padding(prefix, is_root, entry.name)
+        description = self.nodes[entry.path].describe()
+        return f"{emoji} {entry.name}{' ' * paddding} [{description}]"
+
+
+def print_diff(snapshot_path, root, *, root_name, out=None):
+    diff_root = diff_tree(
+        read_snapshot(snapshot_path), iter_dir_records(root), root_name=root_name
+    )
+    render(iter_entries(diff_root, max_files=0), [DiffRenderer(diff_root, out)])
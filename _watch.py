@@ -0,0 +1,172 @@
+import os
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+
+"""
+--watch에서 쓰는 디렉토리 변경 감시.
+
+리눅스에서는 inotify로 디렉토리마다 watch를 걸어 항목이 추가/삭제/수정된 디렉토리만 알려 주고,
+inotify를 쓸 수 없으면(리눅스가 아니거나 watch 수 제한에 걸린 경우) 디렉토리의 mtime을
+주기적으로 확인하는 PollingWatcher로 대신한다.
+
+두 감시자 모두 add(path), remove(path), wait(timeout), close()를 제공하며, wait()는
+timeout초까지 기다린 뒤 바뀐 디렉토리 경로의 집합을 돌려준다. 이벤트를 놓쳤으면(inotify 큐가
+넘침) None을 돌려주므로, 호출하는 쪽은 전체를 다시 스캔해야 한다.
+"""
+
+# <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_ONLYDIR = 0x01000000
+
+# 디렉토리의 항목이 바뀌거나, 그 안의 파일 크기가 바뀌는 이벤트
+WATCH_MASK = (
+    IN_MODIFY
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_ONLYDIR
+)
+
+# struct inotify_event { int wd; uint32_t mask, cookie, len; char name[]; }
+EVENT = struct.Struct("iIII")
+
+
+class InotifyWatcher:
+    """
+    inotify watch. 이벤트는 디렉토리 단위로만 모으므로, 파일 하나에 쓰기가 아무리 많아도
+    wait() 한 번에 그 디렉토리는 한 번만 나온다. 비용은 트리 크기가 아니라 변경량에 비례한다.
+    """
+
+    kind = "inotify"
+
+    def __init__(self):
+        path = ctypes.util.find_library("c")
+        libc = ctypes.CDLL(path, use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError(errno.ENOSYS, "inotify is not available")
+
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, os.strerror(code))
+
+        self.libc = libc
+        self.fd = fd
+        self.paths = {}  # wd -> 디렉토리 경로
+        self.wds = {}  # 디렉토리 경로 -> wd
+
+    def add(self, path):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            code = ctypes.get_errno()
+            # 추가하는 사이에 지워진 디렉토리는 부모의 이벤트로 처리된다
+            if code in (errno.ENOENT, errno.ENOTDIR):
+                return
+            # ENOSPC: fs.inotify.max_user_watches에 걸림
+            raise OSError(code, os.strerror(code), path)
+
+        self.paths[wd] = path
+        self.wds[path] = wd
+
+    def remove(self, path):
+        wd = self.wds.pop(path, None)
+        # 옮겨진 디렉토리는 새 경로로 add()해도 같은 wd가 나오므로, 그 경우 watch는 남긴다
+        if wd is None or self.paths.get(wd) != path:
+            return
+        del self.paths[wd]
+        # 디렉토리가 지워졌으면 커널이 이미 watch를 없앴으므로 실패해도 된다
+        self.libc.inotify_rm_watch(self.fd, wd)
+
+    def wait(self, timeout):
+        dirty = set()
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return dirty
+
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                return dirty
+
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = EVENT.unpack_from(data, offset)
+                offset += EVENT.size + length
+                if mask & IN_Q_OVERFLOW:
+                    return None
+                path = self.paths.get(wd)
+                if path is not None:
+                    dirty.add(path)
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """
+    inotify를 쓸 수 없을 때의 대안. wait()마다 알고 있는 디렉토리의 mtime을 stat하므로
+    비용이 디렉토리 수에 비례한다.
+
+    디렉토리의 mtime은 항목이 추가/삭제/이름변경될 때만 바뀌므로, 바뀐 디렉토리는 settle초
+    동안 조용해질 때까지 매번 다시 읽어서 쓰는 중인 파일의 크기도 따라간다.
+    """
+
+    kind = "polling"
+
+    def __init__(self, settle=10.0):
+        self.settle = settle
+        self.mtimes = {}  # 디렉토리 경로 -> st_mtime_ns
+        self.active = {}  # 최근에 바뀐 디렉토리 경로 -> 바뀐 시각
+
+    def add(self, path):
+        try:
+            self.mtimes[path] = os.stat(path).st_mtime_ns
+        except OSError:
+            pass
+
+    def remove(self, path):
+        self.mtimes.pop(path, None)
+        self.active.pop(path, None)
+
+    def wait(self, timeout):
+        time.sleep(timeout)
+        now = time.monotonic()
+
+        for path, mtime in self.mtimes.items():
+            try:
+                current = os.stat(path).st_mtime_ns
+            except OSError:  # 지워진 디렉토리는 부모의 mtime이 바뀌므로 부모에서 처리된다
+                continue
+            if current != mtime:
+                self.mtimes[path] = current
+                self.active[path] = now
+
+        for path, changed in list(self.active.items()):
+            if now - changed > self.settle:
+                del self.active[path]
+
+        return set(self.active)
+
+    def close(self):
+        pass
+
+
+def make_watcher():
+    try:
+        return InotifyWatcher()
+    except (OSError, AttributeError, TypeError):
+        # TypeError: find_library()가 None을 돌려주는 환경
+        return PollingWatcher()
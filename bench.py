@@ -0,0 +1,359 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import datetime
+import subprocess
+import contextlib
+import tracemalloc
+
+"""
+treeview / s3tree 구현별 성능 측정.
+
+합성 파일시스템 트리(tmpfs 권장)와 합성 S3 객체 목록을 만들고,
+구현마다 별도의 프로세스에서 실행 시간, 메모리 최대 사용량, 시스템 콜 수를 잰다.
+
+    python bench.py --shape wide --files 100000
+    python bench.py --shape small --strace > bench_output.txt
+    python bench.py --impl s3tree --moto
+
+시스템 콜 수는 strace가 설치되어 있고 --strace 옵션을 준 경우에만 측정한다.
+같은 프로세스를 측정 대상 없이 한 번 더 실행해서, 인터프리터 시작과 import에
+드는 시스템 콜은 빼고 계산한다.
+"""
+
+SHAPES = ["wide", "deep", "small"]
+
+FS_IMPLS = [
+    "Main.Tree.walk",
+    "Main.Tree.walk --jobs 8",
+    "Main.Tree.walk --processes 4",
+    "Main_slow.print_dir",
+]
+
+S3_IMPLS = [
+    "s3tree.build_s3_tree",
+    "s3tree.pprint_s3tree",
+]
+
+# 객체를 하나씩 올려야 해서 준비가 오래 걸리므로 --moto를 줄 때만 실행한다
+MOTO_IMPLS = [
+    "s3tree.list_s3_objects (moto)",
+]
+
+
+def shape_dirs(shape, files, depth, fanout):
+    """
+    shape에 따라 (디렉토리 경로, 그 디렉토리의 파일 수) 목록을 만든다. 경로는 '/'로 구분.
+
+    wide:  디렉토리 하나에 파일 files개
+    deep:  depth 단계의 한 줄짜리 디렉토리, 단계마다 파일을 고르게 나눔
+    small: fanout개씩 갈라지는 트리, 디렉토리마다 작은 파일 4개
+    """
+    if shape == "wide":
+        return [("wide", files)]
+
+    if shape == "deep":
+        per_level = max(files // depth, 1)
+        return [
+            ("deep/" + "/".join(f"d{i}" for i in range(level + 1)), per_level)
+            for level in range(depth)
+        ]
+
+    # small
+    per_dir = 4
+    dirs = []
+    queue = ["small"]
+    while queue and len(dirs) * per_dir < files:
+        path = queue.pop(0)
+        dirs.append((path, per_dir))
+        queue.extend(f"{path}/s{i}" for i in range(fanout))
+    return dirs
+
+
+def make_fs_tree(root, shape, files, depth, fanout):
+    rng = random.Random(0)
+    for path, num_files in shape_dirs(shape, files, depth, fanout):
+        directory = os.path.join(root, path)
+        os.makedirs(directory, exist_ok=True)
+        for i in range(num_files):
+            # 내용을 쓰지 않고 크기만 지정한 sparse 파일. st_size는 실제 값이 나온다
+            with open(os.path.join(directory, f"file_{i}.dat"), "wb") as f:
+                f.truncate(rng.randint(0, 4096))
+
+    return os.path.join(root, shape)
+
+
+def make_s3_objects(shape, files, depth, fanout):
+    rng = random.Random(0)
+    last_modified = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+
+    objects = []
+    for path, num_files in shape_dirs(shape, files, depth, fanout):
+        for i in range(num_files):
+            objects.append(
+                {
+                    "Key": f"{path}/file_{i}.dat",
+                    "Size": rng.randint(0, 4096),
+                    "LastModified": last_modified,
+                }
+            )
+
+    # S3는 키 순서로 돌려준다
+    objects.sort(key=lambda s3_obj: s3_obj["Key"])
+    return objects
+
+
+def prepare(impl, args):
+    """
+    측정할 함수를 준비해서 돌려준다. 준비(import, 입력 생성)는 측정에 포함하지 않는다.
+    """
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    if impl.startswith("Main."):
+        import Main
+
+        options = Main.ScanOptions(
+            jobs=8 if "--jobs" in impl else 1,
+            processes=4 if "--processes" in impl else 1,
+            # 프로세스마다 스캔하려면 하드 링크를 링크마다 세야 한다
+            count_links="--processes" in impl,
+        )
+        return lambda: Main.Tree(options).walk(args.target)
+
+    if impl == "Main_slow.print_dir":
+        import Main_slow
+
+        return lambda: Main_slow.print_dir(args.target)
+
+    import s3tree
+
+    objects = make_s3_objects(args.shape, args.files, args.depth, args.fanout)
+
+    if impl == "s3tree.build_s3_tree":
+        return lambda: s3tree.build_s3_tree(objects)
+
+    if impl == "s3tree.pprint_s3tree":
+        tree = s3tree.build_s3_tree(objects)
+        return lambda: s3tree.pprint_s3tree(bucket="bench", tree=tree)
+
+    # moto로 띄운 가짜 S3에 객체를 올려 두고 목록 조회부터 트리 생성까지 잰다
+    import boto3
+    from moto import mock_aws
+
+    for name in ("AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY"):
+        os.environ.setdefault(name, "bench")
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+    mock = mock_aws()
+    mock.start()
+    s3 = boto3.client("s3")
+    s3.create_bucket(Bucket="bench")
+    for s3_obj in objects:
+        s3.put_object(Bucket="bench", Key=s3_obj["Key"], Body=b"")
+
+    return lambda: s3tree.build_s3_tree(s3tree.list_s3_objects(s3, Bucket="bench"))
+
+
+def run_child(args):
+    """
+    측정 대상 프로세스. 결과는 JSON 한 줄로 stdout에 쓰고, 구현의 출력은 버린다.
+    """
+    import resource
+
+    fn = prepare(args.child, args)
+    result = {}
+
+    if not args.setup_only:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            if args.tracemalloc:
+                tracemalloc.start()
+                fn()
+                result["peak_bytes"] = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            else:
+                started = time.perf_counter()
+                fn()
+                result["seconds"] = time.perf_counter() - started
+
+    # ru_maxrss의 단위는 Linux에서 KB, macOS에서 byte
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    result["maxrss_bytes"] = maxrss if sys.platform == "darwin" else maxrss * 1024
+
+    print(json.dumps(result))
+
+
+def spawn(impl, args, *, tracemalloc=False, setup_only=False, strace=False):
+    cmd = [
+        sys.executable,
+        os.path.abspath(__file__),
+        "--child",
+        impl,
+        "--target",
+        args.target or "",
+        "--shape",
+        args.shape,
+        "--files",
+        str(args.files),
+        "--depth",
+        str(args.depth),
+        "--fanout",
+        str(args.fanout),
+    ]
+    if tracemalloc:
+        cmd.append("--tracemalloc")
+    if setup_only:
+        cmd.append("--setup-only")
+
+    syscalls = None
+    if strace:
+        with tempfile.NamedTemporaryFile("r", suffix=".strace") as summary:
+            cmd = ["strace", "-f", "-c", "-o", summary.name] + cmd
+            output = subprocess.run(cmd, capture_output=True, text=True, check=True).stdout
+            for line in summary:
+                fields = line.split()
+                if fields and fields[-1] == "total":
+                    syscalls = int(fields[3])
+    else:
+        output = subprocess.run(cmd, capture_output=True, text=True, check=True).stdout
+
+    result = json.loads(output.splitlines()[-1])
+    result["syscalls"] = syscalls
+    return result
+
+
+def measure(impl, args):
+    # tracemalloc은 실행을 느리게 하므로 시간과 메모리는 따로 잰다
+    runs = [spawn(impl, args) for _ in range(args.repeat)]
+    memory = spawn(impl, args, tracemalloc=True)
+
+    syscalls = None
+    if args.strace:
+        total = spawn(impl, args, strace=True)["syscalls"]
+        setup = spawn(impl, args, strace=True, setup_only=True)["syscalls"]
+        syscalls = total - setup
+
+    return {
+        "seconds": min(run["seconds"] for run in runs),
+        "peak_bytes": memory["peak_bytes"],
+        "maxrss_bytes": max(run["maxrss_bytes"] for run in runs),
+        "syscalls": syscalls,
+    }
+
+
+def default_tmpdir():
+    # tmpfs에 만들어야 디스크 I/O가 아니라 구현 자체의 비용을 잴 수 있다
+    if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK):
+        return "/dev/shm"
+    return tempfile.gettempdir()
+
+
+def print_table(rows):
+    header = f"{'implementation':<32} {'shape':<6} {'wall':>10} {'peak mem':>10} {'max RSS':>10} {'syscalls':>10}"
+    print(header)
+    print("-" * len(header))
+    for impl, shape, result in rows:
+        if "error" in result:
+            print(f"{impl:<32} {shape:<6} {result['error']}")
+            continue
+
+        syscalls = "-" if result["syscalls"] is None else f"{result['syscalls']:,}"
+        print(
+            f"{impl:<32} {shape:<6} {result['seconds']:>9.3f}s"
+            f" {result['peak_bytes'] / 1024 / 1024:>8.1f}MB"
+            f" {result['maxrss_bytes'] / 1024 / 1024:>8.1f}MB"
+            f" {syscalls:>10}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark treeview and s3tree on synthetic trees.",
+        epilog="github: https://github.com/gisman/tree-view",
+    )
+
+    parser.add_argument(
+        "--shape",
+        choices=SHAPES + ["all"],
+        help="Shape of the synthetic tree",
+        default="all",
+    )
+    parser.add_argument(
+        "--files", type=int, help="Approximate number of files", default=10000
+    )
+    parser.add_argument(
+        "--depth", type=int, help="Depth of the 'deep' shape", default=50
+    )
+    parser.add_argument(
+        "--fanout", type=int, help="Fan-out of the 'small' shape", default=10
+    )
+    parser.add_argument(
+        "--impl",
+        action="append",
+        help="Only run implementations containing this text (repeatable)",
+        default=None,
+    )
+    parser.add_argument(
+        "--repeat", type=int, help="Take the best wall time of N runs", default=3
+    )
+    parser.add_argument(
+        "--tmpdir", help="Where to create the synthetic trees", default=default_tmpdir()
+    )
+    parser.add_argument(
+        "--moto",
+        action="store_true",
+        help="Also benchmark S3 listing against a moto stub",
+        default=False,
+    )
+    parser.add_argument(
+        "--strace",
+        action="store_true",
+        help="Count system calls with strace",
+        default=False,
+    )
+
+    # 측정 대상 프로세스에서만 쓰는 옵션
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--target", help=argparse.SUPPRESS)
+    parser.add_argument("--tracemalloc", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--setup-only", action="store_true", help=argparse.SUPPRESS)
+
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args)
+        sys.exit(0)
+
+    if args.strace and shutil.which("strace") is None:
+        print("strace is not installed.")
+        sys.exit(1)
+
+    impls = FS_IMPLS + S3_IMPLS
+    if args.moto:
+        impls += MOTO_IMPLS
+    if args.impl:
+        impls = [impl for impl in impls if any(text in impl for text in args.impl)]
+
+    shapes = SHAPES if args.shape == "all" else [args.shape]
+
+    rows = []
+    with tempfile.TemporaryDirectory(prefix="treeview-bench-", dir=args.tmpdir) as root:
+        for shape in shapes:
+            args.shape = shape
+            args.target = None
+            if any(impl in FS_IMPLS for impl in impls):
+                args.target = make_fs_tree(root, shape, args.files, args.depth, args.fanout)
+
+            for impl in impls:
+                try:
+                    rows.append((impl, shape, measure(impl, args)))
+                except subprocess.CalledProcessError as e:
+                    # 예: Python 3.12 미만에서 Main_slow, moto가 없는 환경
+                    error = e.stderr.strip().splitlines()[-1] if e.stderr.strip() else str(e)
+                    rows.append((impl, shape, {"error": f"skipped: {error}"}))
+
+    print_table(rows)
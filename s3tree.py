@@ -33,26 +33,79 @@ objects in more detail if useful.
 *   It tries to pick an appropriate IAM role based on the bucket name
     (this only works for some buckets, and ones I have access to).
 
+*   With --unsigned, it reads public buckets without any credentials.
+
 *   The folder names are all clickable links that go to the S3 console,
     so I can jump into more detailed inspection.
 
 *   It does natural sorting of S3 keys rather than alphabetical, which is
     useful when I have lots of numeric-esque keys like in the example.
 
+*   With --lazy, it walks the "folders" level by level with delimiter
+    listings and only fetches the first page of each folder, so exploring
+    a huge bucket costs a request per displayed folder rather than a
+    request per 1000 keys.  Use -L to limit the depth.
+
+*   With --concurrency N, it finds the first levels of "folders" with
+    delimiter listings and then lists each of them in parallel, which is
+    much faster than a single paginator on buckets with millions of keys.
+
+*   With --async, the listing runs on asyncio (aiobotocore) instead of
+    threads, so --concurrency can go to tens of LIST streams cheaply.
+    Both clients use adaptive retries, which back off and rate-limit
+    themselves when S3 answers SlowDown.  --endpoint-url points them at
+    MinIO or moto_server for testing.
+
+*   With --snapshot PATH it saves the size and object count of every
+    folder, and --diff PATH prints only the folders that changed since,
+    with the deltas.
+
+*   With --inventory PATH, it reads a downloaded S3 Inventory report
+    (CSV.gz, or Parquet with pyarrow) instead of listing the bucket, which
+    is much cheaper for buckets with hundreds of millions of keys.  Point
+    it at the manifest.json, or the folder it's in.
+
+*   With --exclude PATTERN (or --exclude-from a .gitignore-style file),
+    matching keys and whole "folders" are left out of the tree and the
+    totals.  With --lazy, excluded folders aren't even listed.
+
+*   With --server, it asks a running treeviewd instead, which keeps the
+    S3 client, the assumed role and recent listings warm between calls,
+    so repeated calls on the same (or an enclosing) prefix come back in
+    milliseconds without importing boto3.
+
+*   With --format text, json or html, the same tree is rendered by the
+    treeview renderers in ``_render`` instead.  ``S3Scanner`` is the
+    library entry point for this.
+
 """
 
 import argparse
+import asyncio
 import collections
 import datetime
 import sys
-from typing import List
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
 
 import attrs
 import humanize
 import natsort
 import termcolor
 
-from _common import create_link_text, create_s3_session, parse_s3_uri
+from _common import (
+    create_async_s3_client,
+    create_link_text,
+    create_s3_client,
+    parse_s3_uri,
+)
+from _daemon import default_address, run_client
+from _ignore import IgnoreRules
+from _inventory import InventoryError, iter_inventory_objects
+from _render import RENDERERS, iter_entries, render
+from _snapshot import print_diff, write_snapshot
 
 
 def parse_args():
@@ -61,104 +114,773 @@ def parse_args():
     )
 
     parser.add_argument("S3_URI")
+    parser.add_argument(
+        "--unsigned",
+        action="store_true",
+        help="send unsigned requests, for reading public buckets without credentials",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=1,
+        help="number of prefixes to list in parallel (default: 1, no sharding)",
+    )
+    parser.add_argument(
+        "--shard-depth",
+        type=int,
+        default=1,
+        help="how many levels of folders to discover before listing them in parallel",
+    )
+    parser.add_argument(
+        "--async",
+        dest="use_async",
+        action="store_true",
+        help="list with asyncio and aiobotocore rather than threads (needs aiobotocore)",
+    )
+    parser.add_argument(
+        "--max-attempts",
+        type=int,
+        default=10,
+        help="attempts per request, retrying throttled requests with adaptive backoff (default: 10)",
+    )
+    parser.add_argument(
+        "--endpoint-url",
+        help="use an S3-compatible endpoint, e.g. MinIO or moto_server",
+    )
+    parser.add_argument(
+        "--inventory",
+        metavar="PATH",
+        help="read a downloaded S3 Inventory report (manifest.json or its folder) instead of listing the bucket",
+    )
+    parser.add_argument(
+        "--lazy",
+        action="store_true",
+        help="only list the folders that will be displayed, one page per folder",
+    )
+    parser.add_argument(
+        "-L",
+        "--level",
+        type=int,
+        default=-1,
+        help="with --lazy, descend only this many folders below the prefix",
+    )
+    parser.add_argument(
+        "--exact-counts",
+        action="store_true",
+        help="with --lazy, page through each folder to get exact object counts",
+    )
+    parser.add_argument(
+        "--exclude",
+        action="append",
+        metavar="PATTERN",
+        default=[],
+        help="skip keys matching a .gitignore-style PATTERN, relative to the bucket (repeatable)",
+    )
+    parser.add_argument(
+        "--exclude-from",
+        metavar="FILE",
+        help="read exclude patterns from FILE, e.g. a .gitignore or .treeviewignore",
+    )
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="print request counts and per-phase timings to stderr",
+    )
+    parser.add_argument(
+        "--format",
+        choices=["tree"] + list(RENDERERS),
+        default="tree",
+        help="output format: this script's tree (default), or the treeview text, JSON or HTML layout",
+    )
+    parser.add_argument(
+        "--snapshot",
+        metavar="PATH",
+        help="save folder sizes and object counts to a snapshot file",
+    )
+    parser.add_argument(
+        "--diff",
+        metavar="SNAPSHOT",
+        help="print only the folders that changed since SNAPSHOT",
+    )
+    parser.add_argument(
+        "--server",
+        metavar="ADDRESS",
+        nargs="?",
+        const=default_address(),
+        help="ask a running treeviewd (Unix socket path or HOST:PORT) instead of listing the bucket here",
+    )
 
     return parser.parse_args()
 
 
-def list_s3_objects(sess, **kwargs):
-    import boto3
-    from botocore.handlers import disable_signing
+def list_s3_objects(s3, **kwargs):
+    for page in s3.get_paginator("list_objects_v2").paginate(**kwargs):
+        yield from page.get("Contents", [])
 
-    resource = boto3.resource("s3")
-    resource.meta.client.meta.events.register("choose-signer.s3.*", disable_signing)
-    bucket = resource.Bucket("pit30m")
 
-    for item in bucket.objects.all():
-        print(item.key)
+def list_s3_objects_concurrently(
+    s3, *, Bucket, Prefix="", shard_depth=1, max_workers=10
+):
+    """
+    List the same objects as ``list_s3_objects``, but in parallel.
 
-    s3 = sess.client("s3")
+    We walk the first ``shard_depth`` levels of common prefixes with
+    ``Delimiter="/"``, then list everything under each of the prefixes
+    we found on a thread pool.  Objects are yielded shard by shard, in
+    no particular order -- ``build_s3_tree`` sorts them anyway.
+    """
+    def list_level(prefix):
+        objects = []
+        prefixes = []
+        for page in s3.get_paginator("list_objects_v2").paginate(
+            Bucket=Bucket, Prefix=prefix, Delimiter="/"
+        ):
+            objects.extend(page.get("Contents", []))
+            prefixes.extend(cp["Prefix"] for cp in page.get("CommonPrefixes", []))
+        return objects, prefixes
 
-    for page in s3.get_paginator("list_objects_v2").paginate(**kwargs):
-        yield from page.get("Contents", [])
+    def list_shard(prefix):
+        objects = []
+        for page in s3.get_paginator("list_objects_v2").paginate(
+            Bucket=Bucket, Prefix=prefix
+        ):
+            objects.extend(page.get("Contents", []))
+        return objects
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        shards = [Prefix]
+
+        for _ in range(shard_depth):
+            next_shards = []
+            for objects, prefixes in executor.map(list_level, shards):
+                yield from objects
+                next_shards.extend(prefixes)
+            shards = next_shards
+
+        for objects in executor.map(list_shard, shards):
+            yield from objects
+
+
+async def list_s3_objects_async(
+    s3, *, Bucket, Prefix="", shard_depth=1, max_concurrency=10
+):
+    """
+    List the same objects as ``list_s3_objects_concurrently``, on asyncio.
+
+    ``s3`` is an aiobotocore client.  The first ``shard_depth`` levels are
+    listed with ``Delimiter="/"``, and each common prefix starts another
+    listing as soon as we see it, rather than waiting for the whole level.
+    At most ``max_concurrency`` listings are in flight at once; the
+    connection pool on the client should be at least that big.
+
+    Pages are passed through a bounded queue, so a slow consumer holds
+    back the listings rather than buffering the whole bucket.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+    queue = asyncio.Queue(maxsize=2 * max_concurrency)
+    tasks = set()
+    pending = 0
+
+    def start(prefix, depth):
+        nonlocal pending
+        pending += 1
+        task = asyncio.create_task(list_prefix(prefix, depth))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    async def list_prefix(prefix, depth):
+        nonlocal pending
+        kwargs = {"Bucket": Bucket, "Prefix": prefix}
+        if depth < shard_depth:
+            kwargs["Delimiter"] = "/"
+
+        try:
+            async with semaphore:
+                async for page in s3.get_paginator("list_objects_v2").paginate(
+                    **kwargs
+                ):
+                    for cp in page.get("CommonPrefixes", []):
+                        start(cp["Prefix"], depth + 1)
+                    await queue.put(page.get("Contents", []))
+        except Exception as e:
+            await queue.put(e)
+        finally:
+            pending -= 1
+            if not pending:
+                await queue.put(None)
+
+    start(Prefix, 0)
+
+    try:
+        while True:
+            contents = await queue.get()
+            if contents is None:
+                return
+            if isinstance(contents, Exception):
+                raise contents
+
+            for s3_obj in contents:
+                yield s3_obj
+    finally:
+        for task in list(tasks):
+            task.cancel()
+
+
+class S3Stats:
+    """
+    Counts and timings for --stats.
+
+    LIST requests are counted with botocore event hooks on the client,
+    so they include the requests made on worker threads.  Time spent
+    waiting for the listing is measured by wrapping the object stream,
+    so whatever is left over was spent building the tree.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.list_requests = 0
+        self.request_seconds = 0.0
+        self.phase_seconds = collections.Counter()
+
+    def attach(self, s3):
+        s3.meta.events.register("before-call.s3.ListObjectsV2", self.before_call)
+        s3.meta.events.register("after-call.s3.ListObjectsV2", self.after_call)
+
+    def before_call(self, context, **kwargs):
+        context["stats_started"] = time.perf_counter()
+
+    def after_call(self, context, **kwargs):
+        elapsed = time.perf_counter() - context["stats_started"]
+        with self.lock:
+            self.list_requests += 1
+            self.request_seconds += elapsed
+
+    def timed(self, s3_objects, phase):
+        """
+        Pass through an iterable, adding the time spent waiting for each
+        item to ``phase``.
+        """
+        waited = 0.0
+        iterator = iter(s3_objects)
+
+        try:
+            while True:
+                started = time.perf_counter()
+                s3_obj = next(iterator, None)
+                waited += time.perf_counter() - started
+
+                if s3_obj is None:
+                    return
+                yield s3_obj
+        finally:
+            self.phase_seconds[phase] += waited
+
+    def report(self, *, tree, out=sys.stderr):
+        seconds = self.phase_seconds
+        listing_and_build = seconds["list"] + seconds["build"]
+        rate = tree.total_objects / listing_and_build if listing_and_build else 0
+
+        lines = [
+            f"list requests: {self.list_requests:,}"
+            f" ({self.request_seconds:.3f}s in requests, summed over threads)",
+            f"keys:          {tree.total_objects:,} ({rate:,.0f} keys/s)",
+            f"listing:       {seconds['list']:.3f}s",
+            f"building:      {seconds['build']:.3f}s",
+            f"rendering:     {seconds['render']:.3f}s",
+        ]
+        print("\n".join(lines), file=out)
 
 
 # @attr.s
 @attrs.define
 class S3Folder:
     path: str = attrs.field()
-    objects: List[str] = attrs.field(factory=list)
+
+    # The first few objects in this folder as (name, size, last_modified),
+    # in natural order.  We don't keep every object -- `object_count` is
+    # the real number of objects.
+    objects: List[Tuple[str, int, datetime.datetime]] = attrs.field(factory=list)
     folders = attrs.field(factory=dict)  # Mapping[str, S3Folder]
 
+    # Set by the lazy builder if we only looked at the first page of
+    # this folder, so `objects` (and `folders`) may be incomplete.
+    is_truncated: bool = attrs.field(default=False)
 
-def build_s3_tree(keys, path=None):
-    path = path or []
+    # Objects directly in this folder
+    object_count: int = attrs.field(default=0)
 
-    tree = S3Folder(path="/".join(path))
+    # Totals for everything under this folder, including sub-folders
+    # and the empty "folder" objects created by the console
+    total_objects: int = attrs.field(default=0)
+    size: int = attrs.field(default=0)
+    last_modified: Optional[datetime.datetime] = attrs.field(default=None)
 
-    per_folder_keys = collections.defaultdict(list)
+    # The node interface used by `_render.iter_entries`, so the S3 tree
+    # can go through the same renderers as a local directory tree.
 
-    for k in keys:
-        if "/" in k:
-            folder_name, entry_name = k.split("/", 1)
-            per_folder_keys[folder_name].append(entry_name)
-        else:
-            per_folder_keys["."].append(k)
+    @property
+    def name(self):
+        return self.path.rpartition("/")[2]
+
+    @property
+    def num_files(self):
+        return self.object_count
+
+    @property
+    def mtime(self):
+        if self.last_modified is None:
+            return None
+        return self.last_modified.timestamp()
+
+    @property
+    def dirs(self):
+        return [self.folders[name] for name in natsort.natsorted(self.folders)]
+
+    @property
+    def files(self):
+        return [
+            (name, size, last_modified.timestamp())
+            for name, size, last_modified in self.objects
+        ]
+
+
+class S3TreeBuilder:
+    """
+    Builds an S3Folder tree from a stream of objects in a single pass.
+
+    Each object is added to its folder without copying or re-splitting
+    the other keys, and each folder only keeps the first ``max_objects``
+    names, so memory grows with the number of folders rather than the
+    number of keys.  Totals are rolled up into the parent folders once,
+    in ``finish()``.
+    """
+
+    def __init__(self, *, max_objects=4):
+        self.tree = S3Folder(path="")
+        self.max_objects = max_objects
+        name_key = natsort.natsort_keygen()
+        self.sort_key = lambda s3_obj: name_key(s3_obj[0])
+
+        # Listings come back in key order, so consecutive keys are
+        # usually in the same folder -- remember the last one we saw.
+        self.last_folder_path = ""
+        self.last_folder = self.tree
+
+        # (folder path, last modified) of the console's "folder" objects
+        self.markers = []
+
+    def get_folder(self, folder_path):
+        if folder_path == self.last_folder_path:
+            return self.last_folder
+
+        folder = self.tree
+        if folder_path:
+            for name in folder_path.split("/"):
+                try:
+                    folder = folder.folders[name]
+                except KeyError:
+                    if folder.path == "":
+                        path = name
+                    else:
+                        path = f"{folder.path}/{name}"
+                    folder.folders[name] = folder = S3Folder(path=path)
+
+        self.last_folder_path = folder_path
+        self.last_folder = folder
+        return folder
+
+    def add(self, s3_obj):
+        self.add_object(s3_obj["Key"], s3_obj["Size"], s3_obj["LastModified"])
+
+    def add_object(self, key, size, last_modified):
+        folder_path, _, name = key.rpartition("/")
 
-    assert sum(len(entries) for entries in per_folder_keys.values()) == len(keys)
+        # The empty "folder" objects created by the console aren't shown
+        # and don't create a folder of their own, but they still count
+        # towards the totals -- see ``finish()``.
+        if name == "" and size == 0:
+            self.markers.append((folder_path, last_modified))
+            return
 
-    tree.objects = natsort.natsort(per_folder_keys.pop(".", []))
+        folder = self.get_folder(folder_path)
 
-    for folder_name, folder_keys in per_folder_keys.items():
-        tree.folders[folder_name] = build_s3_tree(
-            folder_keys, path=path + [folder_name]
+        folder.total_objects += 1
+        folder.size += size
+        if folder.last_modified is None or last_modified > folder.last_modified:
+            folder.last_modified = last_modified
+
+        folder.object_count += 1
+        folder.objects.append((name, size, last_modified))
+        if len(folder.objects) >= 2 * self.max_objects:
+            folder.objects.sort(key=self.sort_key)
+            del folder.objects[self.max_objects :]
+
+    def finish(self):
+        # Count each "folder" object in the folder it marks, or in its
+        # closest ancestor if the folder has nothing else in it.
+        for folder_path, last_modified in self.markers:
+            folder = self.tree
+            for name in folder_path.split("/"):
+                if name not in folder.folders:
+                    break
+                folder = folder.folders[name]
+
+            folder.total_objects += 1
+            if folder.last_modified is None or last_modified > folder.last_modified:
+                folder.last_modified = last_modified
+
+        # Walk the folders iteratively (deep prefixes would blow the
+        # recursion limit), then roll the totals up in reverse order so
+        # every child is done before its parent.
+        folders = [self.tree]
+        for folder in folders:
+            folders.extend(folder.folders.values())
+
+        for folder in reversed(folders):
+            folder.objects.sort(key=self.sort_key)
+            del folder.objects[self.max_objects :]
+
+            for sub_folder in folder.folders.values():
+                folder.total_objects += sub_folder.total_objects
+                folder.size += sub_folder.size
+                if sub_folder.last_modified is not None and (
+                    folder.last_modified is None
+                    or sub_folder.last_modified > folder.last_modified
+                ):
+                    folder.last_modified = sub_folder.last_modified
+
+        return self.tree
+
+
+def build_s3_tree(s3_objects):
+    builder = S3TreeBuilder()
+
+    for s3_obj in s3_objects:
+        builder.add(s3_obj)
+
+    return builder.finish()
+
+
+def build_s3_tree_from_rows(rows):
+    """
+    Like ``build_s3_tree``, but from ``(key, size, last_modified)``
+    tuples, e.g. from ``_inventory.iter_inventory_objects``, so we don't
+    make a dict per object.
+    """
+    builder = S3TreeBuilder()
+
+    for key, size, last_modified in rows:
+        builder.add_object(key, size, last_modified)
+
+    return builder.finish()
+
+
+def prefix_view(tree, prefix):
+    """
+    The tree ``S3Scanner.scan()`` would build for ``prefix``, cut out of
+    ``tree``, the tree of a shorter prefix: the folder for ``prefix``,
+    shared rather than copied, under a chain of new folders that hold
+    nothing else and carry its totals.  ``prefix`` must end with "/".
+
+    Returns an empty tree if there's no such folder.
+    """
+    names = prefix[:-1].split("/")
+
+    folder = tree
+    for name in names:
+        folder = folder.folders.get(name)
+        if folder is None:
+            return S3Folder(path="")
+
+    view = folder
+    for depth in range(len(names) - 1, -1, -1):
+        view = S3Folder(
+            path="/".join(names[:depth]),
+            folders={names[depth]: view},
+            total_objects=folder.total_objects,
+            size=folder.size,
+            last_modified=folder.last_modified,
         )
+    return view
 
-    return tree
 
+def build_s3_tree_lazily(
+    s3,
+    *,
+    Bucket,
+    Prefix="",
+    max_depth=-1,
+    exact_counts=False,
+    max_workers=1,
+    is_excluded=None,
+):
+    """
+    Build the same shape of tree as ``build_s3_tree``, but by walking the
+    folders with ``Delimiter="/"`` rather than listing every key.
 
-def pprint_s3tree(*, bucket, tree):
-    lines = []
+    Only folders less than ``max_depth`` levels below the prefix are
+    listed (-1 means no limit).  Unless ``exact_counts`` is set, we only
+    fetch the first page of each folder; if there are more, the folder is
+    marked as truncated and its count is shown as a lower bound.
 
-    # If we're at the top of the tree, we want to print a '.'
-    if tree.path == "":
-        lines.append(".")
+    Folders that ``is_excluded`` rejects are never listed.
+    """
+    builder = S3TreeBuilder()
+    base_depth = len(Prefix.rstrip("/").split("/")) if Prefix else 0
 
+    def list_folder(prefix):
+        pages = s3.get_paginator("list_objects_v2").paginate(
+            Bucket=Bucket, Prefix=prefix, Delimiter="/"
+        )
+
+        objects = []
+        prefixes = []
+        is_truncated = False
+        for page in pages:
+            objects.extend(page.get("Contents", []))
+            prefixes.extend(cp["Prefix"] for cp in page.get("CommonPrefixes", []))
+            if not exact_counts and page.get("IsTruncated"):
+                is_truncated = True
+                break
+
+        return prefix, objects, prefixes, is_truncated
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        level = [Prefix]
+
+        while level:
+            next_level = []
+
+            for prefix, objects, prefixes, is_truncated in executor.map(
+                list_folder, level
+            ):
+                # The keys listed under "a/b/" live in folder "a/b", but those
+                # under an unslashed prefix like "a/b" (or "") live in "a" ("")
+                folder_path = prefix.rpartition("/")[0]
+                builder.get_folder(folder_path).is_truncated = is_truncated
+
+                for s3_obj in objects:
+                    if is_excluded is None or not is_excluded(s3_obj["Key"]):
+                        builder.add(s3_obj)
+
+                for cp in prefixes:
+                    if is_excluded is not None and is_excluded(cp):
+                        continue
+                    builder.get_folder(cp[:-1])
+                    if max_depth < 0 or cp.count("/") - base_depth < max_depth:
+                        next_level.append(cp)
+
+            level = next_level
+
+    return builder.finish()
+
+
+class S3Scanner:
+    """
+    The S3 backend of the scanner API in ``_render``.
+
+    ``scan()`` lists the prefix and returns an S3Folder tree, and
+    ``entries()`` flattens that tree into the same stream of Entry
+    records as ``Main.Scanner``, so the text, JSON and HTML renderers
+    work on either.  All the settings live on the instance, so several
+    scans can run at once in one process.
+
+    With ``inventory`` (the path of a downloaded S3 Inventory report),
+    ``scan()`` reads the report instead of listing the bucket, and ``s3``
+    can be None.
+
+    ``exclude`` is an ``_ignore.IgnoreRules`` with paths relative to the
+    root of the bucket; matching keys (and everything in matching
+    folders) are left out of the tree, as ``Main.Scanner`` does for
+    files.
+    """
+
+    def __init__(
+        self,
+        s3,
+        *,
+        Bucket,
+        Prefix="",
+        concurrency=1,
+        shard_depth=1,
+        lazy=False,
+        max_depth=-1,
+        exact_counts=False,
+        inventory=None,
+        exclude=None,
+        stats=None,
+    ):
+        self.s3 = s3
+        self.bucket = Bucket
+        self.prefix = Prefix
+        self.concurrency = concurrency
+        self.shard_depth = shard_depth
+        self.lazy = lazy
+        self.max_depth = max_depth
+        self.exact_counts = exact_counts
+        self.inventory = inventory
+        self.exclude = exclude  # IgnoreRules
+        self.stats = stats  # S3Stats
+
+    def key_matcher(self):
+        if self.exclude is None or self.exclude.regex is None:
+            return None
+        return self.exclude.key_matcher()
+
+    def list_objects(self):
+        if self.concurrency > 1:
+            return list_s3_objects_concurrently(
+                self.s3,
+                Bucket=self.bucket,
+                Prefix=self.prefix,
+                shard_depth=self.shard_depth,
+                max_workers=self.concurrency,
+            )
+
+        return list_s3_objects(self.s3, Bucket=self.bucket, Prefix=self.prefix)
+
+    def scan(self):
+        stats = self.stats
+        started = time.perf_counter()
+
+        is_excluded = self.key_matcher()
+
+        if self.lazy:
+            tree = build_s3_tree_lazily(
+                self.s3,
+                Bucket=self.bucket,
+                Prefix=self.prefix,
+                max_depth=self.max_depth,
+                exact_counts=self.exact_counts,
+                max_workers=self.concurrency,
+                is_excluded=is_excluded,
+            )
+
+            if stats is not None:
+                # The lazy builder interleaves listing and building
+                stats.phase_seconds["list"] += time.perf_counter() - started
+            return tree
+
+        if self.inventory is not None:
+            s3_objects = iter_inventory_objects(
+                self.inventory, Bucket=self.bucket, Prefix=self.prefix
+            )
+            if is_excluded is not None:
+                s3_objects = (row for row in s3_objects if not is_excluded(row[0]))
+            build = build_s3_tree_from_rows
+        else:
+            s3_objects = self.list_objects()
+            if is_excluded is not None:
+                s3_objects = (
+                    s3_obj for s3_obj in s3_objects if not is_excluded(s3_obj["Key"])
+                )
+            build = build_s3_tree
+
+        if stats is not None:
+            listed_before = stats.phase_seconds["list"]
+            s3_objects = stats.timed(s3_objects, "list")
+
+        # The objects are streamed straight into the tree, so we never hold
+        # the whole listing in memory.
+        tree = build(s3_objects)
+
+        if stats is not None:
+            listing = stats.phase_seconds["list"] - listed_before
+            stats.phase_seconds["build"] += time.perf_counter() - started - listing
+        return tree
+
+    async def scan_async(self):
+        """
+        Like ``scan()``, but ``self.s3`` is an aiobotocore client and the
+        listing runs on asyncio.  ``concurrency`` caps the number of LIST
+        streams in flight.
+        """
+        stats = self.stats
+        started = time.perf_counter()
+        building = 0.0
+        is_excluded = self.key_matcher()
+
+        builder = S3TreeBuilder()
+        async for s3_obj in list_s3_objects_async(
+            self.s3,
+            Bucket=self.bucket,
+            Prefix=self.prefix,
+            shard_depth=self.shard_depth,
+            max_concurrency=self.concurrency,
+        ):
+            if is_excluded is not None and is_excluded(s3_obj["Key"]):
+                continue
+            if stats is None:
+                builder.add(s3_obj)
+            else:
+                added = time.perf_counter()
+                builder.add(s3_obj)
+                building += time.perf_counter() - added
+
+        tree = builder.finish()
+
+        if stats is not None:
+            finished = time.perf_counter()
+            stats.phase_seconds["list"] += finished - started - building
+            stats.phase_seconds["build"] += building
+        return tree
+
+    def entries(self, tree, *, max_files=4, dirs_only=False, files_first=False):
+        # The tree always starts at the root of the bucket, even if we
+        # only listed a prefix.
+        return iter_entries(
+            tree,
+            max_files=max_files,
+            dirs_only=dirs_only,
+            files_first=files_first,
+            root_name=self.bucket,
+        )
+
+
+def iter_folder_lines(*, bucket, tree, prefix, links):
+    """
+    Yield the lines for the contents of one folder, each starting with
+    ``prefix``.  Sub-folders are yielded as ``(folder, prefix)`` pairs
+    for the caller to expand, so this never recurses.
+    """
     # Start by printing any objects that are in this folder.  Print up to
     # 4 objects, otherwise print 3 and then '...X other objects'
-    if len(tree.objects) == 4:
+    if tree.object_count == 4 and not tree.is_truncated:
         tree_object_count = 4
     else:
         tree_object_count = 3
 
-    for i, object_key in enumerate(sorted(tree.objects[:tree_object_count]), start=1):
-        if tree.folders or len(tree.objects) > i:
+    object_keys = sorted(name for name, _, _ in tree.objects[:tree_object_count])
+    for i, object_key in enumerate(object_keys, start=1):
+        if tree.folders or tree.object_count > i or tree.is_truncated:
             prefix_char = "├─"
         else:
             prefix_char = "└─"
 
-        lines.append(f"{prefix_char} {termcolor.colored(object_key, 'blue')}")
+        yield f"{prefix}{prefix_char} {termcolor.colored(object_key, 'blue')}"
 
-    if len(tree.objects) > tree_object_count:
+    if tree.object_count > tree_object_count or tree.is_truncated:
         if tree.folders:
             prefix_char = "├─"
         else:
             prefix_char = "└─"
 
-        # if there's only one more object left in the folder, we should
-        # just print it rather than '...1 other object'
-        assert len(tree.objects) - 3 > 1
+        if tree.is_truncated:
+            # We only saw the first page of this folder, so we don't know
+            # how many more objects (or folders) there are.
+            extra_count = max(tree.object_count - 3, 0)
+            extra_objects = f"...{extra_count}+ other objects"
+        else:
+            # if there's only one more object left in the folder, we should
+            # just print it rather than '...1 other object'
+            assert tree.object_count - 3 > 1
 
-        extra_objects = f"...{len(tree.objects) - 3} other objects"
-        lines.append(f"{prefix_char} {termcolor.colored(extra_objects, 'blue')}")
+            extra_objects = f"...{tree.object_count - 3} other objects"
+        yield f"{prefix}{prefix_char} {termcolor.colored(extra_objects, 'blue')}"
 
-    for i, folder_name in enumerate(natsort.natsort(tree.folders), start=1):
+    for i, folder_name in enumerate(natsort.natsorted(tree.folders), start=1):
         folder_tree = tree.folders[folder_name]
 
-        if tree.path == "":
-            full_path = folder_name
-        else:
-            full_path = "/".join([tree.path, folder_name])
-
         if len(tree.folders) > i:
             folder_prefix_char = "├─"
             sub_prefix_char = "│   "
@@ -166,51 +888,70 @@ def pprint_s3tree(*, bucket, tree):
             folder_prefix_char = "└─"
             sub_prefix_char = "    "
 
-        lines.append(
-            folder_prefix_char
-            + " "
-            + create_link_text(
-                url=f"https://eu-west-1.console.aws.amazon.com/s3/buckets/{bucket}?prefix={full_path}/&showversions=false",
-                label=f"{folder_name}/",
+        label = f"{folder_name}/"
+        if links:
+            label = create_link_text(
+                url=f"https://eu-west-1.console.aws.amazon.com/s3/buckets/{bucket}?prefix={folder_tree.path}/&showversions=false",
+                label=label,
             )
-        )
-        lines.extend(
-            [
-                f"{sub_prefix_char}{ln}"
-                for ln in pprint_s3tree(bucket=bucket, tree=folder_tree)
-            ]
-        )
 
-    return lines
+        yield f"{prefix}{folder_prefix_char} {label}"
+        yield folder_tree, prefix + sub_prefix_char
 
 
-if __name__ == "__main__":
-    args = parse_args()
+def iter_s3tree_lines(*, bucket, tree, links=True):
+    """
+    Yield the lines of the tree one at a time, so the caller can start
+    writing output straight away.
 
-    s3_location = parse_s3_uri(args.S3_URI)
-    s3_prefix = {"Bucket": s3_location["Bucket"], "Prefix": s3_location["Path"]}
+    Each folder's prefix is built once and shared by all of its lines,
+    and we keep an explicit stack of folders rather than recursing, so
+    the work is linear in the size of the output even for deep prefixes.
+    """
+    # If we're at the top of the tree, we want to print a '.'
+    if tree.path == "":
+        yield "."
 
-    sess = create_s3_session(args.S3_URI)
+    stack = [iter_folder_lines(bucket=bucket, tree=tree, prefix="", links=links)]
 
-    s3_objects = list(list_s3_objects(sess, **s3_prefix))
+    while stack:
+        item = next(stack[-1], None)
 
-    if not s3_objects:
-        print("(no objects)")
-        sys.exit(1)
+        if item is None:
+            stack.pop()
+        elif isinstance(item, str):
+            yield item
+        else:
+            folder_tree, prefix = item
+            stack.append(
+                iter_folder_lines(
+                    bucket=bucket, tree=folder_tree, prefix=prefix, links=links
+                )
+            )
+
+
+def pprint_s3tree(*, bucket, tree):
+    return list(iter_s3tree_lines(bucket=bucket, tree=tree))
 
-    keys = [
-        s3_obj["Key"]
-        for s3_obj in s3_objects
-        if s3_obj["Size"] > 0 or not s3_obj["Key"].endswith("/")
-    ]
 
-    tree = build_s3_tree(keys)
+def write_s3tree(*, bucket, tree, out=sys.stdout):
+    # The console links are only useful in a terminal; skip them when
+    # the output is redirected to a file or another program.
+    links = out.isatty()
+    out.writelines(
+        f"{line}\n"
+        for line in iter_s3tree_lines(bucket=bucket, tree=tree, links=links)
+    )
 
-    print("\n".join(pprint_s3tree(bucket=s3_prefix["Bucket"], tree=tree)))
 
-    print("")
-    total_size = sum(s3_obj["Size"] for s3_obj in s3_objects)
-    last_modified = max(s3_obj["LastModified"] for s3_obj in s3_objects)
+def write_s3tree_summary(tree, out=sys.stdout):
+    """
+    Write the line under the tree with the total count and size, and
+    when the newest object was modified.
+    """
+    total_objects = tree.total_objects
+    total_size = tree.size
+    last_modified = tree.last_modified
 
     if last_modified.date() == datetime.date.today():
         last_modified_message = "today"
@@ -219,11 +960,157 @@ if __name__ == "__main__":
     else:
         last_modified_message = last_modified.strftime("%-d %B")
 
-    print(
+    out.write("\n")
+    out.write(
         termcolor.colored(
-            f'{humanize.intcomma(len(s3_objects))} object{"s" if len(s3_objects) > 1 else ""}, '
+            f'{humanize.intcomma(total_objects)} object{"s" if total_objects > 1 else ""}, '
             f"totalling {humanize.naturalsize(total_size)}, "
             f"last modified {last_modified_message}",
             "green",
         )
+        + "\n"
     )
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    s3_location = parse_s3_uri(args.S3_URI)
+    s3_prefix = {"Bucket": s3_location["Bucket"], "Prefix": s3_location["Path"]}
+
+    client_options = {
+        "unsigned": args.unsigned,
+        "max_pool_connections": max(args.concurrency, 10),
+        "max_attempts": args.max_attempts,
+        "endpoint_url": args.endpoint_url,
+    }
+    exclude_patterns = list(args.exclude)
+    if args.exclude_from:
+        with open(args.exclude_from, encoding="utf-8") as f:
+            exclude_patterns.extend(line.rstrip("\n") for line in f)
+
+    if args.lazy:
+        # Lazy totals only cover the folders we listed, and their first
+        # page, so a snapshot would store lower bounds as exact counts
+        # and a diff against one would report changes that aren't there.
+        for option, value in [("--snapshot", args.snapshot), ("--diff", args.diff)]:
+            if value:
+                sys.exit(f"--lazy can't be combined with {option}")
+
+    if args.server:
+        # The daemon keeps the listing (and the S3 client) warm between
+        # calls, so we only send it the query.
+        for option, value in [
+            ("--lazy", args.lazy),
+            ("--async", args.use_async),
+            ("--inventory", args.inventory),
+            ("--snapshot", args.snapshot),
+            ("--diff", args.diff),
+            ("--stats", args.stats),
+        ]:
+            if value:
+                sys.exit(f"--server can't be combined with {option}")
+
+        params = [("uri", args.S3_URI), ("format", args.format)]
+        if args.unsigned:
+            params.append(("unsigned", "1"))
+        if args.endpoint_url:
+            params.append(("endpoint_url", args.endpoint_url))
+        params.extend(("exclude", pattern) for pattern in exclude_patterns)
+        run_client(args.server, "/s3", params)
+
+    exclude = None
+    if exclude_patterns:
+        exclude = IgnoreRules().extend(exclude_patterns)
+
+    scanner_options = {
+        "exclude": exclude,
+        "concurrency": args.concurrency,
+        "shard_depth": args.shard_depth,
+        "lazy": args.lazy,
+        "max_depth": args.level,
+        "exact_counts": args.exact_counts,
+    }
+
+    stats = S3Stats() if args.stats else None
+
+    if args.inventory:
+        if args.lazy or args.use_async:
+            sys.exit("--inventory can't be combined with --lazy or --async")
+
+        # Nothing is fetched from S3, so we don't need a client
+        scanner = S3Scanner(
+            None, **s3_prefix, **scanner_options, inventory=args.inventory, stats=stats
+        )
+        try:
+            tree = scanner.scan()
+        except (InventoryError, OSError) as e:
+            sys.exit(f"can't read the inventory: {e}")
+        except ImportError:
+            sys.exit("Parquet inventories need pyarrow: pip install pyarrow")
+    elif args.use_async:
+        if args.lazy:
+            sys.exit("--async can't be combined with --lazy")
+
+        async def scan_async():
+            async with create_async_s3_client(args.S3_URI, **client_options) as s3:
+                if stats is not None:
+                    stats.attach(s3)
+                scanner = S3Scanner(s3, **s3_prefix, **scanner_options, stats=stats)
+                return scanner, await scanner.scan_async()
+
+        try:
+            scanner, tree = asyncio.run(scan_async())
+        except ImportError:
+            sys.exit("--async needs aiobotocore: pip install aiobotocore")
+    else:
+        # boto3 clients are thread-safe, so we share one client (with a
+        # connection per worker) for every request in the run.
+        s3 = create_s3_client(args.S3_URI, **client_options)
+        if stats is not None:
+            stats.attach(s3)
+
+        scanner = S3Scanner(s3, **s3_prefix, **scanner_options, stats=stats)
+        tree = scanner.scan()
+
+    built = time.perf_counter()
+
+    if args.diff:
+        print_diff(args.diff, tree, root_name=s3_prefix["Bucket"])
+    elif args.format != "tree":
+        render(scanner.entries(tree), [RENDERERS[args.format]()])
+
+    # Saved after the comparison, so --snapshot can overwrite the --diff file
+    if args.snapshot:
+        write_snapshot(tree, args.snapshot, source=args.S3_URI)
+
+    if args.diff or args.format != "tree":
+        if stats is not None:
+            stats.phase_seconds["render"] += time.perf_counter() - built
+            stats.report(tree=tree)
+
+        sys.exit(0)
+
+    if args.lazy:
+        # We haven't seen every object, so there's no total to print
+        write_s3tree(bucket=s3_prefix["Bucket"], tree=tree)
+
+        if stats is not None:
+            stats.phase_seconds["render"] += time.perf_counter() - built
+            stats.report(tree=tree)
+
+        sys.exit(0)
+
+    if not tree.total_objects:
+        print("(no objects)")
+        sys.exit(1)
+
+    write_s3tree(bucket=s3_prefix["Bucket"], tree=tree)
+
+    if stats is not None:
+        stats.phase_seconds["render"] += time.perf_counter() - built
+
+    write_s3tree_summary(tree)
+
+    if stats is not None:
+        stats.report(tree=tree)
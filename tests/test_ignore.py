@@ -0,0 +1,152 @@
+import pytest
+
+from _ignore import IgnoreRules, translate
+
+
+def matcher(*patterns, base=""):
+    rules = IgnoreRules().extend(patterns, base)
+    return rules.match
+
+
+@pytest.mark.parametrize("line", ["", "\n", "   ", "# comment", "/", "!"])
+def test_blank_lines_and_comments(line):
+    assert translate(line) is None
+
+
+def test_unanchored_pattern_matches_at_any_depth():
+    match = matcher("*.log")
+    assert match("a.log")
+    assert match("x/y/a.log")
+    assert match("logs.log", is_dir=True)
+    assert not match("a.log.txt")
+    assert not match("a.log/b")
+
+
+def test_leading_slash_anchors_to_the_root():
+    match = matcher("/build")
+    assert match("build")
+    assert match("build", is_dir=True)
+    assert not match("src/build")
+    assert not match("src/build", is_dir=True)
+
+
+def test_slash_in_the_middle_anchors_to_the_root():
+    match = matcher("doc/*.txt")
+    assert match("doc/a.txt")
+    assert not match("x/doc/a.txt")
+    # "*" doesn't cross directories
+    assert not match("doc/sub/a.txt")
+
+
+def test_anchored_pattern_is_relative_to_its_rule_file():
+    match = matcher("/out", "*.tmp", base="sub/")
+    assert match("sub/out", is_dir=True)
+    assert match("sub/x.tmp")
+    assert match("sub/d/x.tmp")
+    assert not match("out", is_dir=True)
+    assert not match("x.tmp")
+
+
+def test_leading_double_star():
+    match = matcher("**/foo")
+    assert match("foo")
+    assert match("a/b/foo", is_dir=True)
+    assert not match("a/foobar")
+
+
+def test_double_star_in_the_middle():
+    match = matcher("a/**/b")
+    assert match("a/b")
+    assert match("a/x/b")
+    assert match("a/x/y/b")
+    assert not match("ab")
+    assert not match("x/a/b")
+
+
+def test_trailing_double_star_matches_the_contents_but_not_the_directory():
+    match = matcher("logs/**")
+    assert not match("logs", is_dir=True)
+    assert match("logs/a")
+    assert match("logs/sub", is_dir=True)
+    assert match("logs/sub/b")
+
+
+def test_trailing_double_star_lets_contents_be_re_included():
+    match = matcher("logs/**", "!logs/keep")
+    assert not match("logs", is_dir=True)
+    assert not match("logs/keep")
+    assert match("logs/other")
+
+
+def test_dir_only_pattern():
+    match = matcher("foo/")
+    assert match("foo", is_dir=True)
+    assert match("x/foo", is_dir=True)
+    assert not match("foo")
+    assert not match("x/foo")
+
+
+def test_negation_later_patterns_win():
+    match = matcher("*.log", "!keep.log")
+    assert match("a.log")
+    assert not match("keep.log")
+    assert not match("x/keep.log")
+
+    match = matcher("!keep.log", "*.log")
+    assert match("keep.log")
+
+
+def test_negated_dir_only_pattern():
+    match = matcher("build*", "!build-tools/")
+    assert match("build", is_dir=True)
+    assert not match("build-tools", is_dir=True)
+    # Only the directory is re-included
+    assert match("build-tools")
+
+
+@pytest.mark.parametrize(
+    "pattern, path, expected",
+    [
+        # A backslash keeps a leading "#" or "!" literal
+        ("\\#notes", "#notes", True),
+        ("\\!important", "!important", True),
+        ("\\!important", "important", False),
+        # Other escaped characters are matched literally
+        ("\\*", "*", True),
+        ("\\*", "a", False),
+        ("a\\?", "a?", True),
+        ("a\\?", "ab", False),
+        ("\\[x]", "[x]", True),
+        ("\\[x]", "x", False),
+        # Trailing spaces are ignored unless escaped
+        ("foo  ", "foo", True),
+        ("foo\\ ", "foo ", True),
+        ("foo\\ ", "foo", False),
+        # Other regex metacharacters aren't special
+        ("a.b", "a.b", True),
+        ("a.b", "axb", False),
+        ("(x)+", "(x)+", True),
+    ],
+)
+def test_escapes(pattern, path, expected):
+    assert matcher(pattern)(path) is expected
+
+
+@pytest.mark.parametrize(
+    "pattern, path, expected",
+    [
+        ("?.txt", "a.txt", True),
+        ("?.txt", "ab.txt", False),
+        ("a?b", "a/b", False),
+        ("[ab].txt", "a.txt", True),
+        ("[ab].txt", "c.txt", False),
+        ("[!ab].txt", "c.txt", True),
+        ("[!ab].txt", "a.txt", False),
+        ("[a-c]x", "bx", True),
+        ("[a-c]x", "dx", False),
+        # An unclosed bracket is a literal
+        ("[ab", "[ab", True),
+    ],
+)
+def test_wildcards(pattern, path, expected):
+    assert matcher(pattern)(path) is expected
@@ -0,0 +1,96 @@
+import datetime
+import os
+
+import pytest
+
+from _inventory import InventoryError, find_manifest, iter_inventory_objects
+
+# The fixtures are laid out like a downloaded inventory configuration:
+# one folder per report, named by date, next to a shared data/ folder.
+# The CSV configuration has two reports -- the older one only lists
+# "stale.txt" -- and the Parquet one has a single report.
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures", "inventory")
+CSV_CONFIG = os.path.join(FIXTURES, "csv", "example-bucket", "daily")
+PARQUET_CONFIG = os.path.join(FIXTURES, "parquet", "example-bucket", "daily")
+
+
+def utc(*args):
+    return datetime.datetime(*args, tzinfo=datetime.timezone.utc)
+
+
+# Both reports list the same versioned bucket.  Non-current versions and
+# the delete marker on "photos/old.jpg" must be left out.
+CURRENT_OBJECTS = [
+    ("photos/2024/cat.jpg", 100, utc(2024, 1, 1, 12, 0, 0)),
+    ("photos/my holiday/été 1+1%.txt", 7, utc(2024, 1, 1, 10, 15, 30)),
+    ("readme.txt", 0, utc(2023, 11, 5, 23, 59, 59)),
+]
+
+
+def test_find_manifest_picks_the_latest_report():
+    assert find_manifest(CSV_CONFIG) == os.path.join(
+        CSV_CONFIG, "2024-01-02T01-00Z", "manifest.json"
+    )
+
+
+def test_find_manifest_in_a_report_folder():
+    report = os.path.join(CSV_CONFIG, "2024-01-01T01-00Z")
+    manifest = os.path.join(report, "manifest.json")
+    assert find_manifest(report) == manifest
+    assert find_manifest(manifest) == manifest
+
+
+def test_find_manifest_without_one():
+    assert find_manifest(os.path.join(CSV_CONFIG, "data")) is None
+
+
+def test_csv_inventory():
+    assert list(iter_inventory_objects(CSV_CONFIG)) == CURRENT_OBJECTS
+
+
+def test_csv_inventory_of_an_older_report():
+    report = os.path.join(CSV_CONFIG, "2024-01-01T01-00Z")
+    assert list(iter_inventory_objects(report)) == [
+        ("stale.txt", 1, utc(2023, 12, 31, 12, 0, 0)),
+    ]
+
+
+def test_parquet_inventory():
+    pytest.importorskip("pyarrow")
+    assert list(iter_inventory_objects(PARQUET_CONFIG)) == CURRENT_OBJECTS
+
+
+def test_parquet_data_files_without_a_manifest():
+    pytest.importorskip("pyarrow")
+    data = os.path.join(PARQUET_CONFIG, "data")
+    assert list(iter_inventory_objects(data)) == CURRENT_OBJECTS
+
+
+@pytest.mark.parametrize("config", [CSV_CONFIG, PARQUET_CONFIG])
+@pytest.mark.parametrize(
+    "prefix, expected",
+    [
+        ("photos/", CURRENT_OBJECTS[:2]),
+        # A prefix doesn't have to end on a folder, and it's matched
+        # against the decoded key
+        ("photos/my h", CURRENT_OBJECTS[1:2]),
+        ("photos/old", []),
+        ("read", CURRENT_OBJECTS[2:]),
+    ],
+)
+def test_prefix(config, prefix, expected):
+    if config == PARQUET_CONFIG:
+        pytest.importorskip("pyarrow")
+    assert list(iter_inventory_objects(config, Prefix=prefix)) == expected
+
+
+def test_bucket_must_match_the_manifest():
+    assert list(iter_inventory_objects(CSV_CONFIG, Bucket="example-bucket"))
+
+    with pytest.raises(InventoryError, match="not 'another-bucket'"):
+        list(iter_inventory_objects(CSV_CONFIG, Bucket="another-bucket"))
+
+
+def test_csv_needs_the_manifest():
+    with pytest.raises(InventoryError, match="need the manifest.json"):
+        list(iter_inventory_objects(os.path.join(CSV_CONFIG, "data")))
@@ -0,0 +1,100 @@
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+import pytest
+
+from conftest import ROOT
+
+boto3 = pytest.importorskip("boto3")
+pytest.importorskip("moto.server")
+
+KEYS = (
+    ["top.txt", "a/1.txt", "a/2.txt", "a/b/c/deep.bin", "a/b/x.txt", "z/"]
+    + [f"wide/f{i}.jpg" for i in range(12)]
+    + [f"big/part-{i}/k{j}" for i in range(5) for j in range(250)]
+)
+
+# Fake credentials for the moto server -- without them boto3 and
+# aiobotocore would go looking for real ones.
+AWS_ENV = {
+    "AWS_ACCESS_KEY_ID": "testing",
+    "AWS_SECRET_ACCESS_KEY": "testing",
+    "AWS_DEFAULT_REGION": "us-east-1",
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture(scope="module")
+def endpoint_url():
+    # moto's in-process mock doesn't work with aiobotocore, so run the
+    # standalone server and talk to it over HTTP like a real endpoint.
+    port = free_port()
+    url = f"http://127.0.0.1:{port}"
+    server = subprocess.Popen(
+        [sys.executable, "-m", "moto.server", "-p", str(port)],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        for _ in range(100):
+            try:
+                urllib.request.urlopen(f"{url}/moto-api/")
+                break
+            except OSError:
+                time.sleep(0.1)
+        else:
+            pytest.fail("moto server didn't start")
+
+        s3 = boto3.client(
+            "s3",
+            endpoint_url=url,
+            aws_access_key_id="testing",
+            aws_secret_access_key="testing",
+            region_name="us-east-1",
+        )
+        s3.create_bucket(Bucket="example-bucket")
+        for i, key in enumerate(KEYS):
+            s3.put_object(Bucket="example-bucket", Key=key, Body=b"x" * (i % 7))
+
+        yield url
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def s3tree(*args):
+    result = subprocess.run(
+        [sys.executable, os.path.join(ROOT, "s3tree.py"), *args],
+        env={**os.environ, **AWS_ENV},
+        capture_output=True,
+        text=True,
+    )
+    assert result.returncode == 0, result.stderr
+    return result.stdout
+
+
+@pytest.mark.parametrize("uri", ["s3://example-bucket/", "s3://example-bucket/big/"])
+def test_async_listing_matches_sync_listing(endpoint_url, uri):
+    pytest.importorskip("aiobotocore")
+
+    expected = s3tree("--endpoint-url", endpoint_url, uri)
+    assert "object" in expected
+
+    for args in (["--async"], ["--async", "--concurrency", "4", "--shard-depth", "2"]):
+        assert s3tree("--endpoint-url", endpoint_url, *args, uri) == expected
+
+
+def test_async_listing_matches_sync_listing_as_json(endpoint_url):
+    pytest.importorskip("aiobotocore")
+
+    args = ["--endpoint-url", endpoint_url, "--format", "json", "s3://example-bucket/"]
+    assert s3tree("--async", *args) == s3tree(*args)
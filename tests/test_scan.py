@@ -0,0 +1,42 @@
+import os
+
+import pytest
+
+from Main import ScanOptions, Scanner
+
+
+def sizes(root):
+    return {node.name: node.size for node in root.dirs} | {"": root.size}
+
+
+@pytest.fixture
+def linked_tree(tmp_path):
+    # One file hard-linked into many sibling directories, and deeper down
+    original = tmp_path / "original"
+    original.write_bytes(b"x" * 5000)
+    for i in range(30):
+        directory = tmp_path / f"d{i:02}"
+        (directory / "deep").mkdir(parents=True)
+        os.link(original, directory / "f")
+        os.link(original, directory / "deep" / "g")
+        (directory / "small").write_bytes(b"y" * i)
+    original.unlink()
+    return tmp_path
+
+
+def test_hard_links_are_counted_once(linked_tree):
+    root = Scanner(ScanOptions(level=1)).scan(str(linked_tree))
+    assert root.size == 5000 + sum(range(30))
+    assert sizes(root)["d00"] == 5000
+
+
+def test_count_links_counts_every_link(linked_tree):
+    root = Scanner(ScanOptions(level=1, count_links=True)).scan(str(linked_tree))
+    assert root.size == 60 * 5000 + sum(range(30))
+
+
+def test_parallel_scan_puts_hard_links_where_the_sequential_scan_does(linked_tree):
+    expected = sizes(Scanner(ScanOptions(level=1)).scan(str(linked_tree)))
+    for _ in range(5):
+        root = Scanner(ScanOptions(level=1, jobs=16)).scan(str(linked_tree))
+        assert sizes(root) == expected
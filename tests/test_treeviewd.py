@@ -0,0 +1,59 @@
+import threading
+import time
+
+from treeviewd import CachedTree, TreeCache
+
+
+def test_concurrent_requests_for_a_key_never_build_at_the_same_time():
+    cache = TreeCache(max_entries=4, ttl=60)
+    lock = threading.Lock()
+    building = 0
+    overlaps = []
+
+    def build():
+        nonlocal building
+        with lock:
+            building += 1
+            overlaps.append(building)
+        time.sleep(0.02)
+        with lock:
+            building -= 1
+        return CachedTree(None, "/root", max_files=1)
+
+    # Every request wants more files than the cached tree kept, so each one
+    # rebuilds -- but only ever one at a time.
+    threads = [
+        threading.Thread(target=cache.get, args=(("tree", "/root"), build, lambda _: False))
+        for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.005)
+    for thread in threads:
+        thread.join()
+
+    assert len(overlaps) == 8
+    assert max(overlaps) == 1
+    assert cache.building == {}
+
+
+def test_waiters_reuse_the_tree_built_while_they_waited():
+    cache = TreeCache(max_entries=4, ttl=60)
+    builds = []
+
+    def build():
+        builds.append(1)
+        time.sleep(0.05)
+        return CachedTree(None, "/root")
+
+    threads = [
+        threading.Thread(target=cache.get, args=(("tree", "/root"), build))
+        for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(builds) == 1
+    assert (cache.hits, cache.misses) == (7, 1)
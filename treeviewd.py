@@ -0,0 +1,533 @@
+import io
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import argparse
+import threading
+import traceback
+import collections
+import http.server
+import socketserver
+import urllib.parse
+
+import Main
+import s3tree
+from _common import create_s3_client, get_aws_session, parse_s3_uri
+from _daemon import EXIT_STATUS_HEADER, default_address, parse_address
+from _ignore import IgnoreRules
+from _render import RENDERERS, TextRenderer, iter_entries, render
+
+"""
+treeview / s3tree 상주 서버.
+
+같은 루트를 하루에도 수천 번 보는 도구는 호출마다 인터프리터와 boto3 import,
+STS assume_role, 처음부터 다시 하는 스캔 비용을 낸다. treeviewd는 스캔한 트리를 메모리에 두고
+같은 루트나 그 아래 경로에 대한 질의에 다시 스캔하지 않고 답한다.
+
+    python treeviewd.py &
+    python Main.py --server -L 2 /data/project
+    python s3tree.py --server s3://bucket/prefix/
+
+로컬 디렉토리는 출력 옵션(-L, -n, -d, -f)과 무관하게 전체 깊이로, 디렉토리마다 파일을
+--max-files개까지 남겨서 스캔해 두므로 같은 루트에 대한 어떤 출력 질의에도 답할 수 있다.
+이미 스캔한 루트의 하위 경로를 물으면 그 부분 트리로 답하는데, 직접 스캔한 것과 같은 결과일
+때만이다: --count-links를 주었고, --exclude 패턴이 없고(패턴은 루트 기준이다), 루트와 그
+경로 사이에 규칙 파일(.treeviewignore, .gitignore)이 없어야 한다. S3는 '/'로 끝나는 prefix면 그 상위 prefix의 트리에서 잘라 준다.
+
+캐시는 루트 --max-roots개까지 마지막으로 쓴 순서로 남기고(LRU), 스캔한 지 --ttl초가 지난
+루트는 다음 질의에서 다시 스캔한다. S3 클라이언트(와 assume_role로 받은 세션)는 버킷마다
+만들어 두고, 임시 자격 증명이 만료되기 전에 새로 만든다.
+"""
+
+# assume_role의 임시 자격 증명은 기본 1시간 동안 유효하다
+CLIENT_TTL = 45 * 60
+
+
+class QueryError(ValueError):
+    pass
+
+
+class CachedTree:
+    """
+    캐시에 넣은 스캔 결과. max_files는 디렉토리마다 남긴 파일 수 (S3는 0).
+    """
+
+    __slots__ = ("tree", "path", "scanned_at", "max_files")
+
+    def __init__(self, tree, path, max_files=0):
+        self.tree = tree
+        self.path = path  # 스캔한 루트 (로컬은 실제 경로, S3는 prefix)
+        self.scanned_at = time.monotonic()
+        self.max_files = max_files
+
+
+class TreeCache:
+    """
+    스캔 결과의 LRU 캐시. 스캔한 지 ttl초가 지난 항목은 없는 것으로 본다.
+
+    같은 키를 동시에 물으면 한 스레드만 스캔하고 나머지는 그 결과를 기다린다. 키마다의 잠금은
+    그 키를 기다리는 스레드가 모두 끝날 때까지 남겨 두므로, 나중에 온 질의도 같은 잠금에서
+    기다리고 같은 키를 두 스레드가 동시에 스캔하는 일은 없다.
+    """
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = collections.OrderedDict()  # 키 -> CachedTree, 오래 안 쓴 것부터
+        self.lock = threading.Lock()
+        self.building = {}  # 키 -> [그 키를 스캔하는 동안 잡는 Lock, 쓰고 있는 스레드 수]
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, key):
+        with self.lock:
+            cached = self.entries.get(key)
+            if cached is None:
+                return None
+            if time.monotonic() - cached.scanned_at > self.ttl:
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return cached
+
+    def store(self, key, cached):
+        with self.lock:
+            self.entries[key] = cached
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def get(self, key, build, usable=None):
+        """
+        key의 스캔 결과. 없거나, usable(CachedTree)이 False면 build()로 새로 스캔한다.
+        """
+        cached = self.lookup(key)
+        if cached is not None and (usable is None or usable(cached)):
+            self.hits += 1
+            return cached
+
+        with self.lock:
+            building = self.building.setdefault(key, [threading.Lock(), 0])
+            building[1] += 1
+        try:
+            with building[0]:
+                # 기다리는 동안 다른 스레드가 스캔했을 수 있다
+                cached = self.lookup(key)
+                if cached is None or not (usable is None or usable(cached)):
+                    self.misses += 1
+                    cached = build()
+                    self.store(key, cached)
+                else:
+                    self.hits += 1
+        finally:
+            with self.lock:
+                building[1] -= 1
+                if not building[1]:
+                    del self.building[key]
+        return cached
+
+    def status(self):
+        now = time.monotonic()
+        with self.lock:
+            roots = [
+                {"key": list(key), "age": round(now - cached.scanned_at, 1)}
+                for key, cached in self.entries.items()
+                if now - cached.scanned_at <= self.ttl
+            ]
+        return {"hits": self.hits, "misses": self.misses, "roots": roots}
+
+
+def first(params, name, default=None):
+    values = params.get(name)
+    return values[0] if values else default
+
+
+def flag(params, name):
+    return first(params, name, "") in ("1", "true")
+
+
+def integer(params, name, default):
+    try:
+        return int(first(params, name, default))
+    except ValueError:
+        raise QueryError(f"{name} must be an integer") from None
+
+
+def find_node(root, root_path, path):
+    """
+    root_path를 스캔한 DirNode 트리에서 path의 노드. 출력하지 않았거나 제외되어 없으면 None.
+    """
+    rel = os.path.relpath(path, root_path)
+    node = root
+    if rel == os.curdir:
+        return node
+
+    for name in rel.split(os.sep):
+        # path는 실제 경로이므로 심볼릭 링크를 따라온 노드는 보지 않는다
+        node = next(
+            (child for child in node.dirs if child.name == name and not child.linked),
+            None,
+        )
+        if node is None:
+            return None
+    return node
+
+
+def display_paths(entries, root_path, directory):
+    """
+    캐시한 트리의 실제 경로를 클라이언트가 준 directory 기준으로 바꿔서, Main.py가 직접
+    스캔한 것과 같은 이름과 경로로 출력되게 한다.
+    """
+    for entry in entries:
+        if entry.depth == 0:
+            name = os.path.basename(os.path.normpath(directory))
+            yield entry._replace(name=name, path=directory)
+        else:
+            rel = entry.path[len(root_path) :].lstrip(os.sep)
+            yield entry._replace(path=os.path.join(directory, rel))
+
+
+def folder_prefixes(prefix):
+    """
+    prefix를 포함하는 더 짧은 '폴더' prefix들, 긴 것부터. 예: "a/b/" -> "a/", "".
+    """
+    names = prefix.split("/")[:-1]
+    return [
+        "".join(f"{name}/" for name in names[:i])
+        for i in range(len(names) - 1, -1, -1)
+    ]
+
+
+class TreeServer:
+    """
+    질의를 처리하는 서버 상태. HTTP 처리 스레드들이 함께 쓴다.
+    """
+
+    def __init__(self, *, max_roots, ttl, max_files, jobs, concurrency):
+        self.cache = TreeCache(max_roots, ttl)
+        self.max_files = max_files
+        self.jobs = jobs
+        self.concurrency = concurrency
+        self.clients = {}  # (버킷, unsigned, endpoint_url) -> (S3 클라이언트, 만든 시각)
+        self.clients_lock = threading.Lock()
+
+    def query_tree(self, params):
+        """
+        Main.py --server. 로컬 디렉토리 트리를 Main.py와 같은 형식으로 출력한다.
+        """
+        path = first(params, "path")
+        if not path or not os.path.isabs(path):
+            raise QueryError("path must be an absolute path")
+        path = os.path.realpath(path)
+        if not os.path.isdir(path):
+            return 1, "The directory does not exists.\n"
+
+        output_format = first(params, "format", "text")
+        if output_format not in RENDERERS:
+            raise QueryError(f"unknown format {output_format!r}")
+        level = integer(params, "level", -1)
+        max_files = integer(params, "max_files", 4)
+        files_first = flag(params, "files_first")
+
+        excludes = tuple(params.get("exclude", []))
+        default_excludes = not flag(params, "no_default_excludes")
+        gitignore = flag(params, "gitignore")
+        count_links = flag(params, "count_links")
+        scan_options = (
+            excludes,
+            default_excludes,
+            gitignore,
+            flag(params, "one_file_system"),
+            flag(params, "allocated"),
+            count_links,
+        )
+
+        def usable(cached):
+            return cached.max_files >= max_files
+
+        # 상위 디렉토리를 스캔해 둔 것이 있으면 그 부분 트리로 답한다. 단, 하드 링크를 한 번만
+        # 세면 부분 트리 밖의 링크가 먼저 세어졌을 수 있고, 사이 디렉토리의 규칙 파일은 path를
+        # 직접 스캔할 때는 읽지 않으므로, 그런 경우에는 path를 따로 스캔한다
+        node = None
+        if not excludes and count_links:
+            ignore_files = IgnoreRules.load(
+                path, defaults=default_excludes, gitignore=gitignore
+            ).ignore_files
+            ancestor = path
+            while node is None and os.path.dirname(ancestor) != ancestor:
+                ancestor = os.path.dirname(ancestor)
+                if any(
+                    os.path.exists(os.path.join(ancestor, name)) for name in ignore_files
+                ):
+                    break
+                cached = self.cache.lookup(("tree", ancestor) + scan_options)
+                if cached is not None and usable(cached):
+                    node = find_node(cached.tree, cached.path, path)
+            if node is not None:
+                self.cache.hits += 1
+        if node is None:
+            cached = self.cache.get(
+                ("tree", path) + scan_options,
+                lambda: self.scan_tree(path, max_files, scan_options),
+                usable,
+            )
+            node = cached.tree
+
+        out = io.StringIO()
+        if output_format == "text":
+            renderer = TextRenderer(out, files_first=files_first)
+        else:
+            renderer = RENDERERS[output_format](out)
+        entries = iter_entries(
+            node,
+            max_files=max_files,
+            dirs_only=flag(params, "dirs_only"),
+            files_first=files_first,
+            level=level,
+        )
+        directory = first(params, "directory")
+        if directory is not None:
+            entries = display_paths(entries, node.path, directory)
+        render(entries, [renderer])
+        return 0, out.getvalue()
+
+    def scan_tree(self, path, max_files, scan_options):
+        (
+            excludes,
+            default_excludes,
+            gitignore,
+            one_file_system,
+            allocated,
+            count_links,
+        ) = scan_options
+        options = Main.ScanOptions(
+            max_files=max(max_files, self.max_files),
+            jobs=self.jobs,
+            with_mtime=True,
+            excludes=excludes,
+            default_excludes=default_excludes,
+            gitignore=gitignore,
+            one_file_system=one_file_system,
+            allocated=allocated,
+            count_links=count_links,
+        )
+        tree = Main.Scanner(options).scan(path)
+        return CachedTree(tree, path, options.max_files)
+
+    def s3_client(self, uri, bucket, unsigned, endpoint_url):
+        key = (bucket, unsigned, endpoint_url)
+        with self.clients_lock:
+            client, created = self.clients.get(key, (None, 0))
+            if client is None or time.monotonic() - created > CLIENT_TTL:
+                if client is not None:
+                    # 캐시된 assume_role 세션도 곧 만료되므로 같이 버린다
+                    get_aws_session.cache_clear()
+                client = create_s3_client(
+                    uri,
+                    unsigned=unsigned,
+                    max_pool_connections=max(self.concurrency, 10),
+                    endpoint_url=endpoint_url,
+                )
+                self.clients[key] = (client, time.monotonic())
+            return client
+
+    def query_s3(self, params):
+        """
+        s3tree.py --server. S3 prefix의 트리를 s3tree.py와 같은 형식으로 출력한다.
+        """
+        uri = first(params, "uri")
+        try:
+            location = parse_s3_uri(uri or "")
+        except ValueError as e:
+            raise QueryError(str(e)) from None
+        bucket, prefix = location["Bucket"], location["Path"]
+
+        output_format = first(params, "format", "tree")
+        if output_format != "tree" and output_format not in RENDERERS:
+            raise QueryError(f"unknown format {output_format!r}")
+        unsigned = flag(params, "unsigned")
+        endpoint_url = first(params, "endpoint_url") or None
+        excludes = tuple(params.get("exclude", []))
+        scan_options = (unsigned, endpoint_url, excludes)
+
+        def scan():
+            exclude = IgnoreRules().extend(excludes) if excludes else None
+            scanner = s3tree.S3Scanner(
+                self.s3_client(uri, bucket, unsigned, endpoint_url),
+                Bucket=bucket,
+                Prefix=prefix,
+                concurrency=self.concurrency,
+                exclude=exclude,
+            )
+            return CachedTree(scanner.scan(), prefix)
+
+        # 제외 규칙은 버킷 기준이므로 상위 prefix의 트리에서 잘라도 결과가 같다
+        tree = None
+        if prefix.endswith("/"):
+            for ancestor in folder_prefixes(prefix):
+                cached = self.cache.lookup(("s3", bucket, ancestor) + scan_options)
+                if cached is not None:
+                    self.cache.hits += 1
+                    tree = s3tree.prefix_view(cached.tree, prefix)
+                    break
+        if tree is None:
+            tree = self.cache.get(("s3", bucket, prefix) + scan_options, scan).tree
+
+        out = io.StringIO()
+        if output_format != "tree":
+            render(
+                iter_entries(tree, root_name=bucket), [RENDERERS[output_format](out)]
+            )
+            return 0, out.getvalue()
+
+        if not tree.total_objects:
+            return 1, "(no objects)\n"
+        s3tree.write_s3tree(bucket=bucket, tree=tree, out=out)
+        s3tree.write_s3tree_summary(tree, out)
+        return 0, out.getvalue()
+
+    def query_status(self, params):
+        return 0, json.dumps(self.cache.status(), indent=2) + "\n"
+
+
+ROUTES = {
+    "/tree": TreeServer.query_tree,
+    "/s3": TreeServer.query_s3,
+    "/status": TreeServer.query_status,
+}
+
+
+class RequestHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        query = ROUTES.get(url.path)
+        if query is None:
+            self.reply(404, 2, f"error: unknown path {url.path}\n")
+            return
+
+        params = urllib.parse.parse_qs(url.query, keep_blank_values=True)
+        try:
+            status, body = query(self.server.tree_server, params)
+        except QueryError as e:
+            self.reply(400, 2, f"error: {e}\n")
+        except Exception as e:
+            traceback.print_exc()
+            self.reply(500, 2, f"error: {e}\n")
+        else:
+            self.reply(200, status, body)
+
+    def reply(self, code, exit_status, body):
+        data = body.encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header(EXIT_STATUS_HEADER, str(exit_status))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        # Unix 소켓이면 client_address가 비어 있다
+        if self.server.verbose:
+            sys.stderr.write(f"{self.log_date_time_string()} {format % args}\n")
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def make_server(address, handler):
+    kind, target = parse_address(address)
+    if kind == "tcp":
+        return http.server.ThreadingHTTPServer(target, handler)
+
+    if os.path.exists(target):
+        # 전에 실행한 서버가 남긴 소켓 파일이면 지우고, 살아 있는 서버면 그만둔다
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(target)
+        except OSError:
+            os.unlink(target)
+        else:
+            sys.exit(f"treeviewd is already running at {target}")
+        finally:
+            probe.close()
+
+    server = UnixHTTPServer(target, handler)
+    os.chmod(target, 0o600)
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Serve treeview and s3tree queries from warm in-memory scans.",
+        epilog="github: https://github.com/gisman/tree-view",
+    )
+
+    parser.add_argument(
+        "--listen",
+        metavar="ADDRESS",
+        help=f"Unix socket path, or HOST:PORT for local HTTP (default: {default_address()})",
+        default=default_address(),
+    )
+    parser.add_argument(
+        "--max-roots",
+        type=int,
+        help="Keep at most N scanned roots in memory (default: 16)",
+        default=16,
+    )
+    parser.add_argument(
+        "--ttl",
+        type=float,
+        help="Rescan a root when its scan is older than SECONDS (default: 300)",
+        default=300.0,
+    )
+    parser.add_argument(
+        "--max-files",
+        type=int,
+        help="Files to keep per directory, the largest -n a query can use without a rescan (default: 100)",
+        default=100,
+    )
+    parser.add_argument(
+        "-j", "--jobs", type=int, help="Scan directories with N threads", default=1
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        help="Number of S3 prefixes to list in parallel (default: 1)",
+        default=1,
+    )
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        action="store_true",
+        help="Log every request to stderr",
+        default=False,
+    )
+
+    args = parser.parse_args()
+
+    server = make_server(args.listen, RequestHandler)
+    server.verbose = args.verbose
+    server.tree_server = TreeServer(
+        max_roots=args.max_roots,
+        ttl=args.ttl,
+        max_files=args.max_files,
+        jobs=args.jobs,
+        concurrency=args.concurrency,
+    )
+
+    # kill로 끝낼 때도 finally에서 소켓 파일을 지운다
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    print(f"treeviewd listening on {args.listen}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if parse_address(args.listen)[0] == "unix":
+            os.unlink(args.listen)